@@ -4,33 +4,54 @@ Hybrid OCR + Text Invoice Parser
 Combines Tesseract OCR (with coordinates) and extracted text for maximum accuracy
 """
 
-import sys
+import bisect
+import io
 import json
-import tempfile
+import logging
 import os
+import re
+import statistics
+import sys
+import tempfile
+from dataclasses import dataclass
 from pathlib import Path
-import requests
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+import pdf2image
 import pytesseract
+import requests
 from PIL import Image
-import pdf2image
-import fitz  # PyMuPDF
-import re
-from dataclasses import dataclass
-from typing import List, Dict, Optional, Tuple
-import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Adaptive resolution: fast pass at FAST_DPI, then re-OCR at OCR_DPI only the
+# bands with words below REOCR_CONFIDENCE and the header/totals lines. The
+# bands are stacked BAND_GAP white rows apart and OCRed in one call.
+OCR_DPI = 300
+FAST_DPI = 150
+REOCR_CONFIDENCE = 0.75
+BAND_GAP = 24
+
+# Larger documents are rejected instead of exhausting memory
+MAX_PAGES = 50
+
+# Pages mostly covered by images whose text boxes cover less than this share
+# of the image area are scans (e.g. with a scanner app footer) and get OCR
+TEXT_LAYER_MIN_COVERAGE = 0.02
+
+
 @dataclass
 class BoundingBox:
     left: int
-    top: int 
+    top: int
     width: int
     height: int
     confidence: float
 
+
 @dataclass
 class WordData:
     text: str
@@ -38,6 +59,7 @@ class WordData:
     line_num: int
     block_num: int
 
+
 @dataclass
 class InvoiceField:
     value: str
@@ -45,167 +67,445 @@ class InvoiceField:
     confidence: float
     source: str  # 'ocr', 'text', 'hybrid'
 
+
 class HybridInvoiceProcessor:
-    def __init__(self, pdf_path: str, extracted_text: str):
+    def __init__(self, pdf_path: str, extracted_text: str, adaptive: bool = False):
         self.pdf_path = pdf_path
         self.extracted_text = extracted_text
+        self.adaptive = adaptive
         self.ocr_data = []
         self.word_map = {}
-        
+
     def process_invoice(self) -> Dict:
         """Main processing pipeline"""
         try:
-            # Step 1: Convert PDF to images
-            images = self.pdf_to_images()
-            
-            # Step 2: Run OCR with coordinates
-            for page_num, image in enumerate(images):
-                ocr_result = self.run_tesseract_with_coordinates(image, page_num)
-                self.ocr_data.append(ocr_result)
-            
+            # Reject oversized documents before any page is read
+            page_count = self.get_page_count()
+            if page_count > MAX_PAGES:
+                raise ValueError(f"PDF has {page_count} pages, limit is {MAX_PAGES}")
+
+            # Step 1: Read born-digital pages from the PDF text layer
+            text_pages = self.extract_text_layer()
+            raster_pages = [n for n in range(page_count) if n not in text_pages]
+
+            # Step 2: Convert remaining pages to images and run OCR with coordinates
+            pages = dict(text_pages)
+            if raster_pages and self.adaptive:
+                for page_num in raster_pages:
+                    pages[page_num] = self.run_adaptive_ocr(page_num)
+            elif raster_pages:
+                # One rendered page in memory at a time
+                for page_num, image in zip(
+                    raster_pages, self.iter_page_images(raster_pages)
+                ):
+                    pages[page_num] = self.run_tesseract_with_coordinates(
+                        image, page_num
+                    )
+            self.ocr_data = [pages[n] for n in range(page_count)]
+
             # Step 3: Build word position map
             self.build_word_position_map()
-            
+
             # Step 4: Extract fields using hybrid approach
             fields = self.extract_invoice_fields()
-            
+
             # Step 5: Extract line items with position awareness
             line_items = self.extract_line_items_with_positions()
-            
+
             return {
                 "extracted_data": {
-                    "supplier_name": fields.get('supplier', InvoiceField('', None, 0.0, 'none')).value,
-                    "invoice_number": fields.get('invoice_number', InvoiceField('', None, 0.0, 'none')).value,
-                    "invoice_date": fields.get('date', InvoiceField('', None, 0.0, 'none')).value,
+                    "supplier_name": fields.get(
+                        "supplier", InvoiceField("", None, 0.0, "none")
+                    ).value,
+                    "invoice_number": fields.get(
+                        "invoice_number", InvoiceField("", None, 0.0, "none")
+                    ).value,
+                    "invoice_date": fields.get(
+                        "date", InvoiceField("", None, 0.0, "none")
+                    ).value,
                     "currency": "EUR",
                     "line_items": line_items,
-                    "totals": self.extract_totals_with_positions()
+                    "totals": self.extract_totals_with_positions(),
                 },
                 "processing_info": {
                     "ocr_confidence": self.calculate_overall_ocr_confidence(),
                     "text_extraction_available": bool(self.extracted_text.strip()),
                     "hybrid_processing": True,
-                    "pages_processed": len(images)
+                    "pages_processed": page_count,
+                    "text_layer_pages": sorted(text_pages),
+                    "ocr_pages": raster_pages,
                 },
-                "confidence_score": self.calculate_hybrid_confidence(fields, line_items),
-                "field_sources": {k: v.source for k, v in fields.items()}
+                "confidence_score": self.calculate_hybrid_confidence(
+                    fields, line_items
+                ),
+                "field_sources": {k: v.source for k, v in fields.items()},
             }
-            
+
         except Exception as e:
             logger.error(f"Processing error: {e}")
             return self.fallback_to_text_only()
-    
-    def pdf_to_images(self) -> List[Image.Image]:
-        """Convert PDF to images for OCR"""
+
+    def get_page_count(self) -> int:
+        """Number of pages in the PDF"""
+        with fitz.open(self.pdf_path) as doc:
+            return doc.page_count
+
+    def extract_text_layer(self, min_words: int = 3) -> Dict[int, Dict]:
+        """Read words with coordinates from the PDF text layer.
+
+        Only pages with at least min_words usable words that are not scans
+        are returned; the others need raster OCR. Coordinates are scaled to
+        300 DPI pixels so they line up with Tesseract output, and words are
+        grouped into visual lines by position.
+        """
+        pages = {}
+        scale = 300 / 72.0
+
         try:
-            # Use pdf2image for better quality
-            images = pdf2image.convert_from_path(
-                self.pdf_path,
-                dpi=300,  # High DPI for better OCR
-                fmt='RGB'
-            )
-            return images
-        except Exception as e:
-            logger.warning(f"pdf2image failed: {e}, trying PyMuPDF")
-            # Fallback to PyMuPDF
             doc = fitz.open(self.pdf_path)
-            images = []
-            for page_num in range(doc.page_count):
-                page = doc[page_num]
-                mat = fitz.Matrix(3.0, 3.0)  # 3x zoom for better quality
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
-                img = Image.open(io.BytesIO(img_data))
-                images.append(img)
-            doc.close()
-            return images
-    
-    def run_tesseract_with_coordinates(self, image: Image.Image, page_num: int) -> Dict:
+        except Exception as e:
+            logger.warning(f"Text layer extraction failed: {e}")
+            return pages
+
+        with doc:
+            for page in doc:
+                raw_words = page.get_text("words", sort=True)
+                if (
+                    len([w for w in raw_words if any(c.isalnum() for c in w[4])])
+                    < min_words
+                ):
+                    continue
+                if self.is_scanned_page(page, raw_words):
+                    continue
+
+                words = []
+                for x0, y0, x1, y1, text, _, _, _ in raw_words:
+                    text = text.strip()
+                    if not text:
+                        continue
+                    bbox = BoundingBox(
+                        left=int(x0 * scale),
+                        top=int(y0 * scale),
+                        width=int((x1 - x0) * scale),
+                        height=int((y1 - y0) * scale),
+                        confidence=1.0,  # Text layer is exact
+                    )
+                    words.append(
+                        WordData(text=text, bbox=bbox, line_num=0, block_num=0)
+                    )
+
+                pages[page.number] = {
+                    "page_num": page.number,
+                    "words": self.group_visual_lines(words),
+                    "full_text": page.get_text(),
+                    "source": "text_layer",
+                }
+
+        return pages
+
+    def is_scanned_page(self, page, raw_words) -> bool:
+        """Whether images cover most of the page and its text layer only a small part of them"""
+        page_area = page.rect.get_area()
+        image_area = min(
+            page_area,
+            sum(
+                (fitz.Rect(info["bbox"]) & page.rect).get_area()
+                for info in page.get_image_info()
+            ),
+        )
+        if page_area <= 0 or image_area < 0.5 * page_area:
+            return False
+        text_area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1, *_ in raw_words)
+        return text_area < TEXT_LAYER_MIN_COVERAGE * image_area
+
+    def group_visual_lines(self, words: List[WordData]) -> List[WordData]:
+        """Number words by visual line, top to bottom and left to right.
+
+        PyMuPDF's (block, line) numbers follow the content stream, in which
+        every table cell can be a line of its own. A word joins the current
+        line when its center is within half the median word height of the
+        line's first word.
+        """
+        if not words:
+            return words
+
+        heights = sorted(w.bbox.height for w in words)
+        tolerance = heights[len(heights) // 2] / 2
+        lines = []
+        anchor = None
+        for word in sorted(words, key=lambda w: w.bbox.top + w.bbox.height / 2):
+            center = word.bbox.top + word.bbox.height / 2
+            if anchor is None or abs(center - anchor) > tolerance:
+                anchor = center
+                lines.append([])
+            lines[-1].append(word)
+
+        grouped = []
+        for line_num, line_words in enumerate(lines):
+            for word in sorted(line_words, key=lambda w: w.bbox.left):
+                word.line_num = line_num
+                word.block_num = 0
+                grouped.append(word)
+        return grouped
+
+    def pdf_to_images(
+        self, page_numbers: Optional[List[int]] = None
+    ) -> List[Image.Image]:
+        """Convert PDF pages (all, or the given 0-based page numbers) to images for OCR"""
+        return list(self.iter_page_images(page_numbers))
+
+    def iter_page_images(
+        self, page_numbers: Optional[List[int]] = None
+    ) -> Iterator[Image.Image]:
+        """Render PDF pages one at a time, so only the page being OCRed is held in memory"""
+        if page_numbers is None:
+            page_numbers = range(self.get_page_count())
+
+        for page_num in page_numbers:
+            try:
+                # Use pdf2image for better quality
+                image = pdf2image.convert_from_path(
+                    self.pdf_path,
+                    dpi=OCR_DPI,  # High DPI for better OCR
+                    fmt="RGB",
+                    first_page=page_num + 1,
+                    last_page=page_num + 1,
+                )[0]
+            except Exception as e:
+                logger.warning(f"pdf2image failed: {e}, trying PyMuPDF")
+                # Fallback to PyMuPDF
+                with fitz.open(self.pdf_path) as doc:
+                    page = doc[page_num]
+                    mat = fitz.Matrix(3.0, 3.0)  # 3x zoom for better quality
+                    pix = page.get_pixmap(matrix=mat)
+                    img_data = pix.tobytes("png")
+                    image = Image.open(io.BytesIO(img_data))
+            yield image
+            del image
+
+    def run_tesseract_with_coordinates(
+        self, image: Image.Image, page_num: int, full_text: bool = True
+    ) -> Dict:
         """Run Tesseract OCR with bounding box data"""
         # Configure Tesseract for invoice processing
-        custom_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz€.,%-:()[]/ '
-        
+        custom_config = r"--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz€.,%-:()[]/ "
+
         # Get detailed data with coordinates
         data = pytesseract.image_to_data(
-            image, 
-            config=custom_config,
-            output_type=pytesseract.Output.DICT
+            image, config=custom_config, output_type=pytesseract.Output.DICT
         )
-        
+
         words = []
-        for i in range(len(data['text'])):
-            text = data['text'][i].strip()
-            conf = int(data['conf'][i])
-            
+        for i in range(len(data["text"])):
+            text = data["text"][i].strip()
+            conf = int(data["conf"][i])
+
             if text and conf > 30:  # Filter low confidence words
                 bbox = BoundingBox(
-                    left=data['left'][i],
-                    top=data['top'][i],
-                    width=data['width'][i],
-                    height=data['height'][i],
-                    confidence=conf / 100.0
+                    left=data["left"][i],
+                    top=data["top"][i],
+                    width=data["width"][i],
+                    height=data["height"][i],
+                    confidence=conf / 100.0,
                 )
-                
+
                 word = WordData(
                     text=text,
                     bbox=bbox,
-                    line_num=data['line_num'][i],
-                    block_num=data['block_num'][i]
+                    line_num=data["line_num"][i],
+                    block_num=data["block_num"][i],
                 )
                 words.append(word)
-        
+
         return {
-            'page_num': page_num,
-            'words': words,
-            'full_text': pytesseract.image_to_string(image, config=custom_config)
+            "page_num": page_num,
+            "words": words,
+            "full_text": self.data_to_text(data) if full_text else "",
+            "source": "ocr",
         }
-    
+
+    def run_adaptive_ocr(self, page_num: int) -> Dict:
+        """Two-tier OCR: fast low-DPI pass, then one full-DPI re-OCR of the weak and field bands"""
+        scale = OCR_DPI / FAST_DPI
+        zoom = OCR_DPI / 72.0
+
+        with fitz.open(self.pdf_path) as doc:
+            page = doc[page_num]
+            page_height = int(page.rect.height * zoom)
+
+            fast = self.run_tesseract_with_coordinates(
+                self.render_page(page, FAST_DPI), page_num, full_text=False
+            )
+            words = []
+            for word in fast["words"]:
+                b = word.bbox
+                word.bbox = BoundingBox(
+                    int(b.left * scale),
+                    int(b.top * scale),
+                    int(b.width * scale),
+                    int(b.height * scale),
+                    b.confidence,
+                )
+                words.append(word)
+
+            bands = self.find_reocr_bands(words, page_height)
+            strips = [
+                self.render_page(
+                    page,
+                    OCR_DPI,
+                    fitz.Rect(0, top / zoom, page.rect.width, bottom / zoom),
+                )
+                for top, bottom in bands
+            ]
+
+        # Stack the bands into one image, so Tesseract runs once per page
+        offsets = []
+        height = 0
+        for strip in strips:
+            offsets.append(height)
+            height += strip.height + BAND_GAP
+        stack = Image.new(
+            "RGB", (max(strip.width for strip in strips), height - BAND_GAP), "white"
+        )
+        for offset, strip in zip(offsets, strips):
+            stack.paste(strip, (0, offset))
+        crop = self.run_tesseract_with_coordinates(stack, page_num, full_text=False)
+
+        # Replace fast-pass words inside the bands with the high-resolution ones
+        words = [
+            w
+            for w in words
+            if not any(
+                top <= w.bbox.top + w.bbox.height / 2 < bottom for top, bottom in bands
+            )
+        ]
+        for word in crop["words"]:
+            band = max(
+                0,
+                bisect.bisect_right(offsets, word.bbox.top + word.bbox.height / 2) - 1,
+            )
+            word.bbox.top += bands[band][0] - offsets[band]
+            words.append(word)
+
+        words = self.group_visual_lines(words)
+        return {
+            "page_num": page_num,
+            "words": words,
+            "full_text": " ".join(w.text for w in words),
+            "source": "ocr_adaptive",
+            "reocr_fraction": round(
+                sum(b - t for t, b in bands) / float(page_height), 3
+            ),
+        }
+
+    def render_page(self, page, dpi: int, clip=None) -> Image.Image:
+        """Render a PDF page (or a clip of it, in points) with PyMuPDF"""
+        pix = page.get_pixmap(dpi=dpi, clip=clip)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+    def find_reocr_bands(
+        self, words: List[WordData], page_height: int, pad: int = 10
+    ) -> List[Tuple[int, int]]:
+        """Vertical bands (top, bottom) in 300 DPI pixels to re-OCR at full resolution.
+
+        The header, totals lines and lines with a weak word; confidently read
+        table rows keep their fast-pass words. Bands less than a median line
+        height apart are merged, so neighbouring lines become one band.
+        """
+        lines = {}
+        for word in words:
+            lines.setdefault((word.block_num, word.line_num), []).append(word)
+
+        bands = [(0, int(page_height * 0.15))]  # Header: supplier, invoice number, date
+        heights = []
+        for line_words in lines.values():
+            text = " ".join(w.text for w in line_words).lower()
+            top = min(w.bbox.top for w in line_words)
+            bottom = max(w.bbox.top + w.bbox.height for w in line_words)
+            heights.append(bottom - top)
+            weak = any(w.bbox.confidence < REOCR_CONFIDENCE for w in line_words)
+            totals = re.search(r"totaal|total|btw|vat|betalen", text)
+            if weak or totals:
+                bands.append((top, bottom))
+
+        merge_gap = int(statistics.median(heights)) if heights else 0
+        merged = []
+        for top, bottom in sorted(
+            (max(0, t - pad), min(page_height, b + pad)) for t, b in bands
+        ):
+            if merged and top <= merged[-1][1] + merge_gap:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], bottom))
+            else:
+                merged.append((top, bottom))
+        return merged
+
+    def data_to_text(self, data: Dict) -> str:
+        """Rebuild page text from image_to_data output instead of running Tesseract a second time"""
+        lines = []
+        current_key = None
+        for i, text in enumerate(data["text"]):
+            text = text.strip()
+            if not text:
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            if key != current_key:
+                lines.append([])
+                current_key = key
+            lines[-1].append(text)
+        return "\n".join(" ".join(words) for words in lines)
+
     def build_word_position_map(self):
         """Build mapping of words to their positions"""
         for page_data in self.ocr_data:
-            for word in page_data['words']:
+            for word in page_data["words"]:
                 # Normalize word for matching
-                normalized = word.text.lower().strip('.,;:')
+                normalized = word.text.lower().strip(".,;:")
                 if normalized not in self.word_map:
                     self.word_map[normalized] = []
                 self.word_map[normalized].append(word)
-    
+
     def find_word_positions(self, search_text: str) -> List[WordData]:
         """Find positions of words/phrases in OCR data"""
-        normalized_search = search_text.lower().strip('.,;:')
+        normalized_search = search_text.lower().strip(".,;:")
         return self.word_map.get(normalized_search, [])
-    
+
     def extract_invoice_fields(self) -> Dict[str, InvoiceField]:
         """Extract key fields using hybrid OCR + text approach"""
         fields = {}
-        
+
         # Supplier extraction
         supplier_ocr = self.extract_supplier_from_ocr()
         supplier_text = self.extract_supplier_from_text()
-        fields['supplier'] = self.choose_best_match('supplier', supplier_ocr, supplier_text)
-        
+        fields["supplier"] = self.choose_best_match(
+            "supplier", supplier_ocr, supplier_text
+        )
+
         # Invoice number
         invoice_ocr = self.extract_invoice_number_from_ocr()
         invoice_text = self.extract_invoice_number_from_text()
-        fields['invoice_number'] = self.choose_best_match('invoice_number', invoice_ocr, invoice_text)
-        
+        fields["invoice_number"] = self.choose_best_match(
+            "invoice_number", invoice_ocr, invoice_text
+        )
+
         # Date
         date_ocr = self.extract_date_from_ocr()
         date_text = self.extract_date_from_text()
-        fields['date'] = self.choose_best_match('date', date_ocr, date_text)
-        
+        fields["date"] = self.choose_best_match("date", date_ocr, date_text)
+
         return fields
-    
+
     def extract_supplier_from_ocr(self) -> InvoiceField:
         """Extract supplier using OCR positional data"""
         # Look for company indicators near "FACTUUR"
-        factuur_positions = self.find_word_positions('factuur')
-        
+        factuur_positions = self.find_word_positions("factuur")
+
         if factuur_positions:
             # Find words near FACTUUR with company indicators
             for page_data in self.ocr_data:
-                for word in page_data['words']:
-                    if re.search(r'(B\.V\.|BV|N\.V\.|NV|Holding|Group)', word.text, re.I):
+                for word in page_data["words"]:
+                    if re.search(
+                        r"(B\.V\.|BV|N\.V\.|NV|Holding|Group)", word.text, re.I
+                    ):
                         # Check if it's reasonably close to FACTUUR
                         for factuur_pos in factuur_positions:
                             y_distance = abs(word.bbox.top - factuur_pos.bbox.top)
@@ -214,18 +514,18 @@ class HybridInvoiceProcessor:
                                     value=word.text,
                                     bbox=word.bbox,
                                     confidence=word.bbox.confidence,
-                                    source='ocr'
+                                    source="ocr",
                                 )
-        
-        return InvoiceField('', None, 0.0, 'ocr')
-    
+
+        return InvoiceField("", None, 0.0, "ocr")
+
     def extract_supplier_from_text(self) -> InvoiceField:
         """Extract supplier from plain text"""
         patterns = [
-            r'FACTUUR\s*\n([^\n]+)',
-            r'([A-Z][a-zA-Z\s]+(?:B\.V\.|BV|N\.V\.|NV))'
+            r"FACTUUR\s*\n([^\n]+)",
+            r"([A-Z][a-zA-Z\s]+(?:B\.V\.|BV|N\.V\.|NV))",
         ]
-        
+
         for pattern in patterns:
             match = re.search(pattern, self.extracted_text, re.I | re.M)
             if match and match.group(1).strip():
@@ -233,381 +533,414 @@ class HybridInvoiceProcessor:
                     value=match.group(1).strip(),
                     bbox=None,
                     confidence=0.8,
-                    source='text'
+                    source="text",
                 )
-        
-        return InvoiceField('', None, 0.0, 'text')
-    
+
+        return InvoiceField("", None, 0.0, "text")
+
     def extract_invoice_number_from_ocr(self) -> InvoiceField:
         """Extract invoice number using OCR coordinates"""
         # Look for V followed by digits
         for page_data in self.ocr_data:
-            for word in page_data['words']:
-                if re.match(r'V\d{6,}', word.text):
+            for word in page_data["words"]:
+                if re.match(r"V\d{6,}", word.text):
                     return InvoiceField(
                         value=word.text,
                         bbox=word.bbox,
                         confidence=word.bbox.confidence,
-                        source='ocr'
+                        source="ocr",
                     )
-        
-        return InvoiceField('', None, 0.0, 'ocr')
-    
+
+        return InvoiceField("", None, 0.0, "ocr")
+
     def extract_invoice_number_from_text(self) -> InvoiceField:
         """Extract invoice number from plain text"""
         patterns = [
-            r'\b(V\d{6,})\b',
-            r'(?:Factuurnummer|Invoice.*Number)\s*:?\s*([V]?\d+)'
+            r"\b(V\d{6,})\b",
+            r"(?:Factuurnummer|Invoice.*Number)\s*:?\s*([V]?\d+)",
         ]
-        
+
         for pattern in patterns:
             match = re.search(pattern, self.extracted_text, re.I)
             if match:
                 return InvoiceField(
-                    value=match.group(1),
-                    bbox=None,
-                    confidence=0.9,
-                    source='text'
+                    value=match.group(1), bbox=None, confidence=0.9, source="text"
                 )
-        
-        return InvoiceField('', None, 0.0, 'text')
-    
+
+        return InvoiceField("", None, 0.0, "text")
+
     def extract_date_from_ocr(self) -> InvoiceField:
         """Extract date using OCR"""
-        date_pattern = r'\d{1,2}[-\/]\d{1,2}[-\/]\d{4}'
-        
+        date_pattern = r"\d{1,2}[-\/]\d{1,2}[-\/]\d{4}"
+
         for page_data in self.ocr_data:
-            for word in page_data['words']:
+            for word in page_data["words"]:
                 if re.match(date_pattern, word.text):
                     normalized_date = self.normalize_date(word.text)
                     return InvoiceField(
                         value=normalized_date,
                         bbox=word.bbox,
                         confidence=word.bbox.confidence,
-                        source='ocr'
+                        source="ocr",
                     )
-        
-        return InvoiceField('', None, 0.0, 'ocr')
-    
+
+        return InvoiceField("", None, 0.0, "ocr")
+
     def extract_date_from_text(self) -> InvoiceField:
         """Extract date from plain text"""
         patterns = [
-            r'(\d{1,2}[-\/]\d{1,2}[-\/]\d{4})',
-            r'(?:Datum|Date):\s*(\d{1,2}[-\/]\d{1,2}[-\/]\d{4})'
+            r"(\d{1,2}[-\/]\d{1,2}[-\/]\d{4})",
+            r"(?:Datum|Date):\s*(\d{1,2}[-\/]\d{1,2}[-\/]\d{4})",
         ]
-        
+
         for pattern in patterns:
             match = re.search(pattern, self.extracted_text)
             if match:
                 normalized_date = self.normalize_date(match.group(1))
                 return InvoiceField(
-                    value=normalized_date,
-                    bbox=None,
-                    confidence=0.8,
-                    source='text'
+                    value=normalized_date, bbox=None, confidence=0.8, source="text"
                 )
-        
-        return InvoiceField('', None, 0.0, 'text')
-    
-    def choose_best_match(self, field_type: str, ocr_result: InvoiceField, text_result: InvoiceField) -> InvoiceField:
+
+        return InvoiceField("", None, 0.0, "text")
+
+    def choose_best_match(
+        self, field_type: str, ocr_result: InvoiceField, text_result: InvoiceField
+    ) -> InvoiceField:
         """Choose the best result between OCR and text extraction"""
-        
+
         # If both found same value, prefer OCR (has position data)
-        if ocr_result.value and text_result.value and ocr_result.value == text_result.value:
+        if (
+            ocr_result.value
+            and text_result.value
+            and ocr_result.value == text_result.value
+        ):
             return InvoiceField(
                 value=ocr_result.value,
                 bbox=ocr_result.bbox,
                 confidence=max(ocr_result.confidence, text_result.confidence),
-                source='hybrid'
+                source="hybrid",
             )
-        
+
         # If only one found something, use that
         if ocr_result.value and not text_result.value:
             return ocr_result
         elif text_result.value and not ocr_result.value:
             return text_result
-        
+
         # If both found different values, prefer higher confidence
         if ocr_result.confidence > text_result.confidence:
             return ocr_result
         else:
             return text_result
-    
+
     def extract_line_items_with_positions(self) -> List[Dict]:
         """Extract line items using position-aware parsing"""
         items = []
-        
+
         # Find table structure using OCR coordinates
         table_area = self.identify_table_area()
-        
+
         if table_area:
             items = self.extract_from_table_area(table_area)
-        
+
         # Fallback to text-based extraction
         if not items:
             items = self.extract_line_items_from_text()
-        
+
         return items
-    
+
     def identify_table_area(self) -> Optional[Dict]:
         """Identify the invoice line items table area"""
         # Look for "Omschrijving" or "Description" header
         header_positions = []
-        header_positions.extend(self.find_word_positions('omschrijving'))
-        header_positions.extend(self.find_word_positions('description'))
-        
+        header_positions.extend(self.find_word_positions("omschrijving"))
+        header_positions.extend(self.find_word_positions("description"))
+
         if not header_positions:
             return None
-        
+
         # Find the table boundaries
         header_pos = header_positions[0]
-        
+
         # Look for currency symbols to define right boundary
         currency_positions = []
         for page_data in self.ocr_data:
-            for word in page_data['words']:
-                if '€' in word.text:
+            for word in page_data["words"]:
+                if "€" in word.text:
                     currency_positions.append(word)
-        
+
         if currency_positions:
-            rightmost_currency = max(currency_positions, key=lambda w: w.bbox.left + w.bbox.width)
-            
+            rightmost_currency = max(
+                currency_positions, key=lambda w: w.bbox.left + w.bbox.width
+            )
+
             return {
-                'top': header_pos.bbox.top,
-                'left': header_pos.bbox.left,
-                'right': rightmost_currency.bbox.left + rightmost_currency.bbox.width,
-                'bottom': header_pos.bbox.top + 400  # Estimate table height
+                "top": header_pos.bbox.top,
+                "left": header_pos.bbox.left,
+                "right": rightmost_currency.bbox.left + rightmost_currency.bbox.width,
+                "bottom": header_pos.bbox.top + 400,  # Estimate table height
             }
-        
+
         return None
-    
+
     def extract_from_table_area(self, table_area: Dict) -> List[Dict]:
         """Extract line items from identified table area"""
         items = []
-        
+
         # Group words by line within table area
         table_lines = {}
-        
+
         for page_data in self.ocr_data:
-            for word in page_data['words']:
-                if (table_area['left'] <= word.bbox.left <= table_area['right'] and
-                    table_area['top'] <= word.bbox.top <= table_area['bottom']):
-                    
-                    line_key = word.bbox.top // 20  # Group by approximate line (20px tolerance)
+            for word in page_data["words"]:
+                if (
+                    table_area["left"] <= word.bbox.left <= table_area["right"]
+                    and table_area["top"] <= word.bbox.top <= table_area["bottom"]
+                ):
+
+                    line_key = (
+                        word.bbox.top // 20
+                    )  # Group by approximate line (20px tolerance)
                     if line_key not in table_lines:
                         table_lines[line_key] = []
                     table_lines[line_key].append(word)
-        
+
         # Process each line
         for line_key in sorted(table_lines.keys()):
             words = sorted(table_lines[line_key], key=lambda w: w.bbox.left)
-            line_text = ' '.join([w.text for w in words])
-            
+            line_text = " ".join([w.text for w in words])
+
             # Skip header lines
-            if re.search(r'omschrijving|description|bedrag|amount', line_text, re.I):
+            if re.search(r"omschrijving|description|bedrag|amount", line_text, re.I):
                 continue
-                
+
             # Extract item data from positioned words
             item = self.parse_table_line(words, line_text)
             if item:
                 items.append(item)
-        
+
         return items
-    
+
     def parse_table_line(self, words: List[WordData], line_text: str) -> Optional[Dict]:
         """Parse a table line using word positions"""
         if not words:
             return None
-        
+
         # Find currency amounts
         amounts = []
         description_words = []
-        
+
         for word in words:
-            if '€' in word.text or re.match(r'[\d,]+\.\d{2}', word.text):
+            if "€" in word.text or re.match(r"[\d,]+\.\d{2}", word.text):
                 # Extract numeric value
-                amount_match = re.search(r'([\d,]+\.\d{2})', word.text)
+                amount_match = re.search(r"([\d,]+\.\d{2})", word.text)
                 if amount_match:
-                    amounts.append({
-                        'value': float(amount_match.group(1).replace(',', '')),
-                        'position': word.bbox.left,
-                        'word': word
-                    })
+                    amounts.append(
+                        {
+                            "value": float(amount_match.group(1).replace(",", "")),
+                            "position": word.bbox.left,
+                            "word": word,
+                        }
+                    )
             else:
                 description_words.append(word)
-        
+
         if not amounts:
             return None
-        
+
         # Build description from leftmost words
-        description = ' '.join([w.text for w in description_words]).strip()
-        
+        description = " ".join([w.text for w in description_words]).strip()
+
         if len(description) < 3:  # Minimum description length
             return None
-        
+
         # Use rightmost amount as total
-        total_amount = max(amounts, key=lambda a: a['position'])['value']
-        
+        total_amount = max(amounts, key=lambda a: a["position"])["value"]
+
         return {
-            'description': description,
-            'quantity': 1,
-            'rate': total_amount,
-            'amount': total_amount,
-            'confidence': 0.8,
-            'source': 'ocr_positioned'
+            "description": description,
+            "quantity": 1,
+            "rate": total_amount,
+            "amount": total_amount,
+            "confidence": 0.8,
+            "source": "ocr_positioned",
         }
-    
+
     def extract_line_items_from_text(self) -> List[Dict]:
         """Fallback: Extract line items from plain text"""
         items = []
-        lines = self.extracted_text.split('\n')
-        
+        lines = self.extracted_text.split("\n")
+
         for line in lines:
             line = line.strip()
             if not line:
                 continue
-                
+
             # Look for lines with currency amounts
-            match = re.search(r'^(.+?)\s+€\s*([\d,]+\.\d{2})$', line)
+            match = re.search(r"^(.+?)\s+€\s*([\d,]+\.\d{2})$", line)
             if match:
                 description = match.group(1).strip()
-                amount = float(match.group(2).replace(',', ''))
-                
+                amount = float(match.group(2).replace(",", ""))
+
                 # Skip total lines
-                if re.search(r'totaal|total|btw|vat|subtotal', description, re.I):
+                if re.search(r"totaal|total|btw|vat|subtotal", description, re.I):
                     continue
-                
+
                 if len(description) > 3:
-                    items.append({
-                        'description': description,
-                        'quantity': 1,
-                        'rate': amount,
-                        'amount': amount,
-                        'confidence': 0.6,
-                        'source': 'text_fallback'
-                    })
-        
+                    items.append(
+                        {
+                            "description": description,
+                            "quantity": 1,
+                            "rate": amount,
+                            "amount": amount,
+                            "confidence": 0.6,
+                            "source": "text_fallback",
+                        }
+                    )
+
         return items
-    
+
     def extract_totals_with_positions(self) -> Dict:
         """Extract totals using hybrid approach"""
         totals = {}
-        
+
         # OCR-based total extraction
         total_words = []
-        total_words.extend(self.find_word_positions('totaal'))
-        total_words.extend(self.find_word_positions('total'))
-        
+        total_words.extend(self.find_word_positions("totaal"))
+        total_words.extend(self.find_word_positions("total"))
+
         for total_word in total_words:
             # Look for amounts near "totaal" words
             for page_data in self.ocr_data:
-                for word in page_data['words']:
-                    if '€' in word.text:
+                for word in page_data["words"]:
+                    if "€" in word.text:
                         y_distance = abs(word.bbox.top - total_word.bbox.top)
                         if y_distance < 30:  # Same line
-                            amount_match = re.search(r'([\d,]+\.\d{2})', word.text)
+                            amount_match = re.search(r"([\d,]+\.\d{2})", word.text)
                             if amount_match:
-                                amount = float(amount_match.group(1).replace(',', ''))
-                                
+                                amount = float(amount_match.group(1).replace(",", ""))
+
                                 # Determine total type based on context
-                                line_text = self.get_line_text_around_position(total_word.bbox)
-                                if 'exclusief' in line_text.lower() or 'excl' in line_text.lower():
-                                    totals['subtotal'] = amount
-                                elif 'btw' in line_text.lower() or 'vat' in line_text.lower():
-                                    totals['vat_amount'] = amount
-                                elif 'betalen' in line_text.lower() or 'incl' in line_text.lower():
-                                    totals['total'] = amount
-        
+                                line_text = self.get_line_text_around_position(
+                                    total_word.bbox
+                                )
+                                if (
+                                    "exclusief" in line_text.lower()
+                                    or "excl" in line_text.lower()
+                                ):
+                                    totals["subtotal"] = amount
+                                elif (
+                                    "btw" in line_text.lower()
+                                    or "vat" in line_text.lower()
+                                ):
+                                    totals["vat_amount"] = amount
+                                elif (
+                                    "betalen" in line_text.lower()
+                                    or "incl" in line_text.lower()
+                                ):
+                                    totals["total"] = amount
+
         # Text-based fallback
         if not totals:
             text_totals = self.extract_totals_from_text()
             totals.update(text_totals)
-        
+
         return totals
-    
+
     def get_line_text_around_position(self, bbox: BoundingBox) -> str:
         """Get full line text around a position"""
         line_words = []
-        
+
         for page_data in self.ocr_data:
-            for word in page_data['words']:
+            for word in page_data["words"]:
                 y_distance = abs(word.bbox.top - bbox.top)
                 if y_distance < 20:  # Same line tolerance
                     line_words.append((word.bbox.left, word.text))
-        
+
         # Sort by x position and join
         line_words.sort(key=lambda x: x[0])
-        return ' '.join([w[1] for w in line_words])
-    
+        return " ".join([w[1] for w in line_words])
+
     def extract_totals_from_text(self) -> Dict:
         """Extract totals from plain text"""
         totals = {}
-        
+
         patterns = [
-            (r'(?:Totaal exclusief.*btw).*€\s*([\d,]+\.\d{2})', 'subtotal'),
-            (r'(?:Btw|VAT).*21%.*€\s*([\d,]+\.\d{2})', 'vat_amount'),
-            (r'(?:Totaal te betalen|Total to pay).*€\s*([\d,]+\.\d{2})', 'total')
+            (r"(?:Totaal exclusief.*btw).*€\s*([\d,]+\.\d{2})", "subtotal"),
+            (r"(?:Btw|VAT).*21%.*€\s*([\d,]+\.\d{2})", "vat_amount"),
+            (r"(?:Totaal te betalen|Total to pay).*€\s*([\d,]+\.\d{2})", "total"),
         ]
-        
+
         for pattern, key in patterns:
             match = re.search(pattern, self.extracted_text, re.I)
             if match:
-                totals[key] = float(match.group(1).replace(',', ''))
-        
+                totals[key] = float(match.group(1).replace(",", ""))
+
         return totals
-    
+
     def normalize_date(self, date_str: str) -> str:
         """Convert date to YYYY-MM-DD format"""
-        parts = re.split(r'[-\/]', date_str)
+        parts = re.split(r"[-\/]", date_str)
         if len(parts) == 3:
             if len(parts[0]) == 4:  # YYYY-MM-DD
                 return f"{parts[0]}-{parts[1].zfill(2)}-{parts[2].zfill(2)}"
             else:  # DD-MM-YYYY
                 return f"{parts[2]}-{parts[1].zfill(2)}-{parts[0].zfill(2)}"
         return date_str
-    
+
     def calculate_overall_ocr_confidence(self) -> float:
         """Calculate average OCR confidence"""
         if not self.ocr_data:
             return 0.0
-        
+
         total_confidence = 0
         word_count = 0
-        
+
         for page_data in self.ocr_data:
-            for word in page_data['words']:
+            for word in page_data["words"]:
                 total_confidence += word.bbox.confidence
                 word_count += 1
-        
+
         return total_confidence / word_count if word_count > 0 else 0.0
-    
+
     def calculate_hybrid_confidence(self, fields: Dict, line_items: List) -> float:
         """Calculate overall processing confidence"""
-        field_confidence = sum([f.confidence for f in fields.values()]) / len(fields) if fields else 0
-        
+        field_confidence = (
+            sum([f.confidence for f in fields.values()]) / len(fields) if fields else 0
+        )
+
         item_confidence = 0
         if line_items:
-            item_confidence = sum([item.get('confidence', 0) for item in line_items]) / len(line_items)
-        
+            item_confidence = sum(
+                [item.get("confidence", 0) for item in line_items]
+            ) / len(line_items)
+
         ocr_confidence = self.calculate_overall_ocr_confidence()
         text_available = 0.2 if self.extracted_text.strip() else 0
-        
-        return min((field_confidence * 0.4 + item_confidence * 0.3 + ocr_confidence * 0.2 + text_available), 1.0)
-    
+
+        return min(
+            (
+                field_confidence * 0.4
+                + item_confidence * 0.3
+                + ocr_confidence * 0.2
+                + text_available
+            ),
+            1.0,
+        )
+
     def fallback_to_text_only(self) -> Dict:
         """Fallback to text-only processing if OCR fails"""
         logger.warning("Falling back to text-only processing")
-        
+
         # Simple text extraction
-        supplier_match = re.search(r'FACTUUR\s*\n([^\n]+)', self.extracted_text, re.I)
-        supplier = supplier_match.group(1).strip() if supplier_match else ''
-        
-        invoice_match = re.search(r'\b(V\d{6,})\b', self.extracted_text)
-        invoice_number = invoice_match.group(1) if invoice_match else ''
-        
-        date_match = re.search(r'(\d{1,2}[-\/]\d{1,2}[-\/]\d{4})', self.extracted_text)
-        date = self.normalize_date(date_match.group(1)) if date_match else ''
-        
+        supplier_match = re.search(r"FACTUUR\s*\n([^\n]+)", self.extracted_text, re.I)
+        supplier = supplier_match.group(1).strip() if supplier_match else ""
+
+        invoice_match = re.search(r"\b(V\d{6,})\b", self.extracted_text)
+        invoice_number = invoice_match.group(1) if invoice_match else ""
+
+        date_match = re.search(r"(\d{1,2}[-\/]\d{1,2}[-\/]\d{4})", self.extracted_text)
+        date = self.normalize_date(date_match.group(1)) if date_match else ""
+
         return {
             "extracted_data": {
                 "supplier_name": supplier,
@@ -615,38 +948,44 @@ class HybridInvoiceProcessor:
                 "invoice_date": date,
                 "currency": "EUR",
                 "line_items": [],
-                "totals": {}
+                "totals": {},
             },
             "processing_info": {
                 "ocr_confidence": 0.0,
                 "text_extraction_available": bool(self.extracted_text.strip()),
                 "hybrid_processing": False,
-                "fallback_mode": True
+                "fallback_mode": True,
             },
             "confidence_score": 0.3,
-            "field_sources": {}
+            "field_sources": {},
         }
 
+
 def main():
     """Main function for command line usage"""
     if len(sys.argv) != 4:
-        print("Usage: python hybrid_invoice_processor.py <pdf_path> <extracted_text> <output_json_path>")
+        print(
+            "Usage: python hybrid_invoice_processor.py <pdf_path> <extracted_text> <output_json_path>"
+        )
         sys.exit(1)
-    
+
     pdf_path = sys.argv[1]
     extracted_text = sys.argv[2]
     output_path = sys.argv[3]
-    
+
     # Process the invoice
-    processor = HybridInvoiceProcessor(pdf_path, extracted_text)
+    processor = HybridInvoiceProcessor(
+        pdf_path, extracted_text, adaptive=os.environ.get("OCR_ADAPTIVE") == "1"
+    )
     result = processor.process_invoice()
-    
+
     # Save result
-    with open(output_path, 'w', encoding='utf-8') as f:
+    with open(output_path, "w", encoding="utf-8") as f:
         json.dump(result, f, indent=2, ensure_ascii=False)
-    
+
     print(f"Processing complete. Results saved to {output_path}")
     return result
 
+
 if __name__ == "__main__":
     main()
@@ -4,6 +4,7 @@
 // Configuration
 const ERPNEXT_BASE_URL = 'https://frappe.fivi.eu';
 const OCR_SERVICE_URL = 'https://ocr.fivi.eu';
+const OCR_SERVICE_TOKEN = $env.ERPNEXT_MATCH_TOKEN; // Same value as the OCR service's ERPNEXT_MATCH_TOKEN
 const OLLAMA_SERVICE_URL = 'http://ollama:11434'; // Internal Docker network
 const MODEL_NAME = 'llama3.2:1b'; // Using compact 1B model for memory-constrained environments
 
@@ -18,91 +19,71 @@ class ContextAwareInvoiceParser {
         };
     }
 
-    // Fetch ERPNext context data for better LLM accuracy
+    // Fetch ERPNext context data for better LLM accuracy. The OCR service keeps
+    // a local, incrementally synced copy, so this is one request instead of five
     async fetchERPNextContext() {
         try {
             console.log('🔍 Fetching ERPNext context data...');
-            
-            // Get suppliers
-            const suppliersResponse = await $http.request({
-                method: 'GET',
-                url: `${ERPNEXT_BASE_URL}/api/resource/Supplier`,
-                headers: {
-                    'Authorization': `token ${$vars.ERPNEXT_API_KEY}:${$vars.ERPNEXT_API_SECRET}`
-                },
-                qs: {
-                    fields: JSON.stringify(['name', 'supplier_name', 'tax_id', 'country'])
-                }
-            });
-            this.erpnextContext.suppliers = suppliersResponse.data || [];
 
-            // Get companies
-            const companiesResponse = await $http.request({
+            const context = await $http.request({
                 method: 'GET',
-                url: `${ERPNEXT_BASE_URL}/api/resource/Company`,
-                headers: {
-                    'Authorization': `token ${$vars.ERPNEXT_API_KEY}:${$vars.ERPNEXT_API_SECRET}`
-                },
-                qs: {
-                    fields: JSON.stringify(['name', 'company_name', 'tax_id', 'country'])
-                }
+                url: `${OCR_SERVICE_URL}/erpnext/context`,
+                headers: { 'X-OCR-Token': OCR_SERVICE_TOKEN },
+                qs: { items: 30 }
             });
-            this.erpnextContext.companies = companiesResponse.data || [];
+            this.erpnextContext = {
+                suppliers: context.suppliers || [],
+                companies: context.companies || [],
+                items: context.items || [],
+                currencies: context.currencies || [],
+                taxTemplates: context.tax_templates || []
+            };
 
-            // Get items (top 500 most common)
-            const itemsResponse = await $http.request({
-                method: 'GET',
-                url: `${ERPNEXT_BASE_URL}/api/resource/Item`,
-                headers: {
-                    'Authorization': `token ${$vars.ERPNEXT_API_KEY}:${$vars.ERPNEXT_API_SECRET}`
-                },
-                qs: {
-                    fields: JSON.stringify(['name', 'item_name', 'item_code', 'item_group']),
-                    limit: 500
-                }
-            });
-            this.erpnextContext.items = itemsResponse.data || [];
+            console.log(`✅ Context loaded: ${this.erpnextContext.suppliers.length} suppliers, ${this.erpnextContext.companies.length} companies, ${this.erpnextContext.items.length} items`);
 
-            // Get currencies
-            const currenciesResponse = await $http.request({
-                method: 'GET',
-                url: `${ERPNEXT_BASE_URL}/api/resource/Currency`,
-                headers: {
-                    'Authorization': `token ${$vars.ERPNEXT_API_KEY}:${$vars.ERPNEXT_API_SECRET}`
-                },
-                qs: {
-                    fields: JSON.stringify(['name', 'currency_name', 'symbol'])
-                }
-            });
-            this.erpnextContext.currencies = currenciesResponse.data || [];
+            return this.erpnextContext;
+        } catch (error) {
+            console.error('❌ Failed to fetch ERPNext context:', error.message);
+            return this.erpnextContext; // Return empty context if API fails
+        }
+    }
 
-            // Get tax templates
-            const taxResponse = await $http.request({
-                method: 'GET',
-                url: `${ERPNEXT_BASE_URL}/api/resource/Sales Taxes and Charges Template`,
-                headers: {
-                    'Authorization': `token ${$vars.ERPNEXT_API_KEY}:${$vars.ERPNEXT_API_SECRET}`
-                },
-                qs: {
-                    fields: JSON.stringify(['name', 'title'])
+    // Match supplier and line items against ERPNext (fuzzy, server-side index)
+    async matchERPNextRecords(structuredData) {
+        try {
+            const match = await $http.request({
+                method: 'POST',
+                url: `${OCR_SERVICE_URL}/erpnext/match`,
+                headers: { 'Content-Type': 'application/json', 'X-OCR-Token': OCR_SERVICE_TOKEN },
+                body: {
+                    supplier_name: structuredData.supplier?.name || '',
+                    tax_id: structuredData.supplier?.tax_id || '',
+                    items: (structuredData.line_items || []).map(item => item.description || '')
                 }
             });
-            this.erpnextContext.taxTemplates = taxResponse.data || [];
 
-            console.log(`✅ Context loaded: ${this.erpnextContext.suppliers.length} suppliers, ${this.erpnextContext.companies.length} companies, ${this.erpnextContext.items.length} items`);
-            
-            return this.erpnextContext;
+            if (match.supplier?.match) {
+                structuredData.supplier = { ...structuredData.supplier, erpnext_name: match.supplier.match.name };
+            }
+            (match.items || []).forEach((itemMatch, i) => {
+                if (itemMatch.match) structuredData.line_items[i].item_code = itemMatch.match.item_code || itemMatch.match.name;
+            });
+            structuredData.matched_records = {
+                ...(structuredData.matched_records || {}),
+                supplier_matched: !!match.supplier?.match,
+                items_matched: (match.items || []).filter(itemMatch => itemMatch.match).length
+            };
         } catch (error) {
-            console.error('❌ Failed to fetch ERPNext context:', error.message);
-            return this.erpnextContext; // Return empty context if API fails
+            console.error('❌ ERPNext matching failed:', error.message);
         }
+        return structuredData;
     }
 
     // Extract text using OCR service with positional data
     async extractTextWithOCR(pdfBuffer) {
         try {
             console.log('🔍 Processing PDF with OCR service...');
-            
+
             const formData = {
                 file: {
                     value: pdfBuffer,
@@ -188,7 +169,7 @@ class ContextAwareInvoiceParser {
     // Build context prompt with ERPNext data
     buildContextPrompt(context) {
         let prompt = "\n\nCONTEXT DATA FROM ERPNEXT:\n";
-        
+
         // Add suppliers context
         if (context.suppliers.length > 0) {
             prompt += "\nKNOWN SUPPLIERS:\n";
@@ -233,7 +214,7 @@ class ContextAwareInvoiceParser {
         }
 
         prompt += "\nINSTRUCTIONS: Use this context to match invoice data to existing ERPNext records. Prefer exact matches for supplier names, company names, and item codes.";
-        
+
         return prompt;
     }
 
@@ -294,7 +275,7 @@ CRITICAL: Return ONLY the JSON object, no additional text or explanation.`;
     // Fallback parsing if LLM fails
     fallbackParsing(text) {
         console.log('⚠️ Using fallback parsing method');
-        
+
         // Basic regex patterns for fallback
         const invoiceNumberMatch = text.match(/(?:invoice|factuur|nummer|number)[:\s#]*([A-Z0-9-]+)/i);
         const amountMatch = text.match(/(?:total|totaal)[:\s]*[€$£]?\s*([0-9,.]+)/i);
@@ -323,26 +304,29 @@ CRITICAL: Return ONLY the JSON object, no additional text or explanation.`;
     async processInvoice(pdfBuffer) {
         try {
             console.log('🚀 Starting context-aware invoice processing...');
-            
+
             // Step 1: Fetch ERPNext context
             const context = await this.fetchERPNextContext();
-            
+
             // Step 2: Extract text with OCR
             const ocrData = await this.extractTextWithOCR(pdfBuffer);
-            
+
             // Step 3: Process with LLM using context
             const structuredData = await this.processWithLLM(ocrData, context);
-            
+
+            // Step 3b: Resolve supplier and items to ERPNext records
+            await this.matchERPNextRecords(structuredData);
+
             // Step 4: Enhance with OCR positional data if needed
             structuredData.ocr_metadata = {
                 coordinates_available: ocrData.coordinates.length > 0,
                 tables_detected: ocrData.tables.length,
                 processing_method: 'hybrid_ocr_llm'
             };
-            
+
             console.log('✅ Invoice processing complete');
             return structuredData;
-            
+
         } catch (error) {
             console.error('❌ Invoice processing failed:', error.message);
             throw error;
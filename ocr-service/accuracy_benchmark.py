@@ -0,0 +1,271 @@
+"""
+Accuracy versus latency over a labeled invoice corpus
+Runs every invoice in a directory through HybridInvoiceProcessor.process_pdf
+for each combination of DPI, preprocessing profile, Tesseract --psm,
+language set and text layer on/off, and reports per-field accuracy next to
+p50/p95 latency and CPU seconds per page. With --min-accuracy it names the
+fastest configuration that meets the bar.
+
+The corpus is a directory of invoice.pdf files, each with an invoice.json
+next to it holding the expected values (all keys optional):
+    {"supplier_name": "...", "invoice_number": "...", "invoice_date": "dd-mm-yyyy",
+     "total_amount": 45.04, "vat_amount": 7.85, "subtotal": 37.19}
+
+Usage: python accuracy_benchmark.py corpus/ --dpi 200,300 --psm 4,6 --lang nld+eng,nld
+       python accuracy_benchmark.py corpus/ --generate 20   # write a synthetic corpus first
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import time
+
+import invoice_ocr_api
+import numpy as np
+from synthetic_invoices import make_invoice
+
+TEXT_FIELDS = ("supplier_name", "invoice_number", "invoice_date")
+AMOUNT_FIELDS = ("total_amount", "vat_amount", "subtotal")
+FIELDS = TEXT_FIELDS + AMOUNT_FIELDS
+
+
+def normalize(field, value):
+    """Comparable form of a text field: case, spacing and punctuation are ignored"""
+    value = str(value or "")
+    if field == "invoice_date":
+        return re.sub(r"\D", "", value)
+    return re.sub(r"[^0-9a-z]", "", value.lower())
+
+
+def field_correct(field, expected, actual):
+    if field in AMOUNT_FIELDS:
+        return actual is not None and abs(float(actual) - float(expected)) < 0.005
+    return normalize(field, expected) == normalize(field, actual) != ""
+
+
+def extracted_values(results):
+    fields = results.get("extracted_fields", {})
+    values = {field: fields.get(field) for field in TEXT_FIELDS}
+    values.update(
+        {field: fields.get("totals", {}).get(field) for field in AMOUNT_FIELDS}
+    )
+    return values
+
+
+def load_corpus(directory):
+    """[(pdf path, ground truth)] for every PDF that has a JSON label"""
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(name)
+        label_path = os.path.join(directory, stem + ".json")
+        if extension.lower() == ".pdf" and os.path.exists(label_path):
+            with open(label_path) as f:
+                truth = json.load(f)
+            corpus.append(
+                (
+                    os.path.join(directory, name),
+                    {k: v for k, v in truth.items() if k in FIELDS},
+                )
+            )
+    return corpus
+
+
+def generate_corpus(directory, count):
+    """Synthetic invoices with labels: alternating born-digital and scanned, varied noise and skew"""
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        scanned = i % 2 == 1
+        pdf_bytes, truth = make_invoice(
+            rows=4 + (i * 7) % 40,
+            text_layer=not scanned,
+            noise=(i % 3) * 6.0 if scanned else 0.0,
+            rotation=((i % 5) - 2) * 0.5 if scanned else 0.0,
+            seed=i,
+        )
+        with open(os.path.join(directory, f"synthetic-{i:03d}.pdf"), "wb") as f:
+            f.write(pdf_bytes)
+        with open(os.path.join(directory, f"synthetic-{i:03d}.json"), "w") as f:
+            json.dump(truth, f, indent=2)
+
+
+def cpu_seconds():
+    """CPU time of this process and its waited-for children (the tesseract CLI)"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def evaluate(config, corpus):
+    """Accuracy and latency of one configuration over the corpus"""
+    processor = invoice_ocr_api.HybridInvoiceProcessor(
+        execution_mode="sequential",
+        dpi=config["dpi"],
+        use_text_layer=config["text_layer"],
+        adaptive=False,
+        preprocess_profile=config["preprocess"],
+        lazy=False,
+    )
+    processor.lang = config["lang"]
+    processor.psm = config["psm"]
+    processor.use_templates = False
+
+    # Warm-up run, so engine start-up is not charged to the first document
+    processor.process_pdf(corpus[0][0])
+
+    latencies = []
+    cpu_total = 0.0
+    pages = 0
+    correct = {field: 0 for field in FIELDS}
+    labeled = {field: 0 for field in FIELDS}
+    documents_correct = 0
+    errors = []
+
+    for pdf_path, truth in corpus:
+        start_cpu, start = cpu_seconds(), time.perf_counter()
+        results = processor.process_pdf(pdf_path)
+        latencies.append(time.perf_counter() - start)
+        cpu_total += cpu_seconds() - start_cpu
+
+        if "error" in results:
+            errors.append(f'{os.path.basename(pdf_path)}: {results["error"]}')
+        pages += len(results.get("ocr_data", [])) or 1
+
+        actual = extracted_values(results)
+        all_correct = True
+        for field, expected in truth.items():
+            labeled[field] += 1
+            if field_correct(field, expected, actual[field]):
+                correct[field] += 1
+            else:
+                all_correct = False
+        documents_correct += all_correct
+
+    total_labeled = sum(labeled.values())
+    return {
+        "config": config,
+        "field_accuracy": {
+            field: round(correct[field] / labeled[field], 3)
+            for field in FIELDS
+            if labeled[field]
+        },
+        "accuracy": (
+            round(sum(correct.values()) / total_labeled, 3) if total_labeled else None
+        ),
+        "document_accuracy": round(documents_correct / len(corpus), 3),
+        "p50_seconds": round(float(np.percentile(latencies, 50)), 3),
+        "p95_seconds": round(float(np.percentile(latencies, 95)), 3),
+        "cpu_seconds_per_page": round(cpu_total / pages, 3),
+        "errors": errors,
+    }
+
+
+def parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "corpus", help="directory with invoice PDFs and their JSON labels"
+    )
+    parser.add_argument(
+        "--generate",
+        type=int,
+        metavar="N",
+        help="first write N synthetic labeled invoices",
+    )
+    parser.add_argument("--dpi", default=str(invoice_ocr_api.OCR_DPI))
+    parser.add_argument(
+        "--preprocess",
+        default=invoice_ocr_api.OCR_PREPROCESS_PROFILE,
+        help="from: " + ", ".join(invoice_ocr_api.PREPROCESS_PROFILES),
+    )
+    parser.add_argument("--psm", default=str(invoice_ocr_api.OCR_PSM))
+    parser.add_argument(
+        "--lang", default=invoice_ocr_api.OCR_LANG, help="e.g. nld+eng,nld"
+    )
+    parser.add_argument(
+        "--text-layer",
+        default="1",
+        help="1 = use the text layer, 0 = always OCR; e.g. 1,0",
+    )
+    parser.add_argument(
+        "--min-accuracy", type=float, help="field accuracy bar for the recommendation"
+    )
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_corpus(args.corpus, args.generate)
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        parser.error(f"no labeled PDFs in {args.corpus}")
+
+    preprocess = parse_list(args.preprocess)
+    unknown = [p for p in preprocess if p not in invoice_ocr_api.PREPROCESS_PROFILES]
+    if unknown:
+        parser.error(f'unknown preprocessing profiles: {", ".join(unknown)}')
+
+    matrix = itertools.product(
+        parse_list(args.dpi, int),
+        preprocess,
+        parse_list(args.psm, int),
+        parse_list(args.lang),
+        [value == "1" for value in parse_list(args.text_layer)],
+    )
+    reports = []
+    for dpi, profile, psm, lang, text_layer in matrix:
+        config = {
+            "dpi": dpi,
+            "preprocess": profile,
+            "psm": psm,
+            "lang": lang,
+            "text_layer": text_layer,
+        }
+        report = evaluate(config, corpus)
+        reports.append(report)
+        print(
+            f"dpi={dpi:<4} preprocess={profile:<5} psm={psm:<2} lang={lang:<8} text_layer={int(text_layer)}  "
+            f'accuracy {report["accuracy"]:.3f}  p50 {report["p50_seconds"]:.3f}s  '
+            f'p95 {report["p95_seconds"]:.3f}s  cpu/page {report["cpu_seconds_per_page"]:.3f}s',
+            file=sys.stderr,
+        )
+
+    summary = {"documents": len(corpus), "results": reports}
+    if args.min_accuracy is not None:
+        passing = [
+            r
+            for r in reports
+            if r["accuracy"] is not None and r["accuracy"] >= args.min_accuracy
+        ]
+        best = min(
+            passing,
+            key=lambda r: (r["p50_seconds"], r["cpu_seconds_per_page"]),
+            default=None,
+        )
+        summary["recommended"] = best["config"] if best else None
+        if best:
+            print(
+                f'fastest configuration with accuracy >= {args.min_accuracy}: {best["config"]}',
+                file=sys.stderr,
+            )
+        else:
+            print(
+                f"no configuration reaches accuracy {args.min_accuracy}",
+                file=sys.stderr,
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
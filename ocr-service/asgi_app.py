@@ -0,0 +1,136 @@
+"""
+ASGI front end for the OCR service
+Health checks and uploads are handled on the event loop and OCR runs in a
+process pool, so light endpoints stay responsive under OCR load. All other
+routes are served by the Flask app, whose invoice processing is routed
+through the same pool.
+
+Run with: gunicorn -k uvicorn.workers.UvicornWorker asgi_app:app
+(OCR_SERVER=asgi in gunicorn.conf.py)
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import invoice_ocr_api as api
+import metrics
+import response_format
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+# OCR processes per server worker: its share of the CPUs, like the Flask pools
+OCR_ASGI_WORKERS = int(os.environ.get("OCR_ASGI_WORKERS") or api.CPU_SHARE)
+
+
+async def health_check(request):
+    """Health check endpoint"""
+    return JSONResponse({"status": "healthy", "service": "hybrid-invoice-ocr"})
+
+
+async def process_invoice(request):
+    """Same contract as the Flask /process-invoice endpoint"""
+    tmp_file = None
+    try:
+        form = await request.form()
+        upload = form.get("pdf_file")
+        if upload is None or isinstance(upload, str):
+            return JSONResponse({"error": "No PDF file provided"}, status_code=400)
+
+        # Large uploads are copied to a named file in chunks and opened by path
+        if upload.size is not None and upload.size <= api.OCR_SPOOL_MAX_BYTES:
+            pdf = await upload.read()
+        else:
+            tmp_file = await run_in_threadpool(api.spool_to_file, upload.file)
+            pdf = tmp_file.name
+        metrics.count_upload("process-invoice", api.pdf_size(pdf))
+        extracted_text = form.get("extracted_text", "")
+        values = {
+            **request.query_params,
+            **{k: v for k, v in form.items() if isinstance(v, str)},
+        }
+
+        try:
+            processor = api.processor_from_values(values)
+            options = response_format.parse_options(
+                values, request.headers.get("accept-encoding", "")
+            )
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        loop = asyncio.get_running_loop()
+        if values.get("profile") == "1":
+            payload = await loop.run_in_executor(
+                api.invoice_pool,
+                api.run_profiled,
+                processor,
+                pdf,
+                extracted_text,
+                values.get("pstats") == "1",
+            )
+            return ocr_response(payload, "bypass", options)
+
+        payload, cache_status, cache_key = await run_in_threadpool(
+            api.get_cached_result, processor, pdf, extracted_text
+        )
+        if payload is None:
+            payload, ok = await loop.run_in_executor(
+                api.invoice_pool, api.serialize_invoice, processor, pdf, extracted_text
+            )
+            if cache_key and ok:
+                await run_in_threadpool(api.result_cache.put, cache_key, payload)
+
+        return ocr_response(payload, cache_status, options)
+
+    except Exception as e:
+        return JSONResponse({"error": f"Processing failed: {str(e)}"}, status_code=500)
+    finally:
+        if tmp_file is not None:
+            tmp_file.close()
+
+
+def ocr_response(payload, cache_status, options):
+    """Pre-serialized result shaped by the response options, with the cache status header"""
+    body, content_type, headers = response_format.render(payload, options)
+    return Response(
+        body, media_type=content_type, headers={**headers, "X-OCR-Cache": cache_status}
+    )
+
+
+def warm_up_process():
+    """Pool initializer: every OCR process warms up before taking work"""
+    api.warm_up()
+
+
+def start_invoice_pool():
+    # Spawned rather than forked: the server worker already runs threads
+    api.invoice_pool = ProcessPoolExecutor(
+        max_workers=OCR_ASGI_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=warm_up_process if api.OCR_WARMUP else None,
+    )
+    if api.OCR_WARMUP:
+        # Processes are started on demand; one trivial task each starts them all now
+        for _ in range(OCR_ASGI_WORKERS):
+            api.invoice_pool.submit(os.getpid)
+
+
+def stop_invoice_pool():
+    if api.invoice_pool is not None:
+        api.invoice_pool.shutdown(wait=False, cancel_futures=True)
+        api.invoice_pool = None
+
+
+app = Starlette(
+    routes=[
+        Route("/health", health_check, methods=["GET"]),
+        Route("/process-invoice", process_invoice, methods=["POST"]),
+        Mount("/", WSGIMiddleware(api.app)),
+    ],
+    on_startup=[start_invoice_pool],
+    on_shutdown=[stop_invoice_pool],
+)
@@ -0,0 +1,55 @@
+"""
+Gunicorn settings for the OCR service
+Command line flags (see the Dockerfile CMD) take precedence over these
+"""
+
+import os
+import shutil
+
+# 'wsgi': sync workers serving the Flask app; 'asgi': uvicorn workers serving
+# asgi_app, which keeps health checks and uploads off the OCR path
+OCR_SERVER = os.environ.get("OCR_SERVER", "wsgi")
+
+if OCR_SERVER == "asgi":
+    wsgi_app = "asgi_app:app"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "invoice_ocr_api:app"
+
+# Worker processes; the OCR service sizes its per-worker pools from the same
+# variable (CPUs divided by workers)
+workers = int(os.environ.get("OCR_SERVER_WORKERS") or 2)
+
+# Import the app (numpy, cv2, PyMuPDF, ...) once in the master and fork
+# workers from it. Threads, pools and OCR engine handles are all created
+# lazily, so nothing thread- or handle-bound is shared across the fork.
+preload_app = os.environ.get("OCR_PRELOAD", "1") == "1"
+
+# Start with an empty Prometheus multiprocess directory. Done here rather
+# than in on_starting: gunicorn loads this file before the (preloaded) app,
+# whose metrics open their sample files in this directory on import.
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    shutil.rmtree(MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+
+def post_worker_init(worker):
+    """Warm up sync workers; ASGI workers warm their OCR processes instead (asgi_app)"""
+    if OCR_SERVER == "asgi":
+        return
+    import invoice_ocr_api
+
+    if invoice_ocr_api.OCR_WARMUP:
+        seconds, error = invoice_ocr_api.warm_up()
+        if error:
+            worker.log.warning("OCR warm-up failed after %.2fs: %s", seconds, error)
+        else:
+            worker.log.info("OCR warm-up took %.2fs", seconds)
+
+
+def child_exit(server, worker):
+    """Drop the live gauge samples of an exited worker"""
+    import metrics
+
+    metrics.mark_process_dead(worker.pid)
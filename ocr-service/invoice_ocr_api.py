@@ -4,28 +4,342 @@ Flask API server for hybrid invoice OCR processing
 Combines PDF text extraction with Tesseract OCR for positional data
 """
 
+import hashlib
+import hmac
+import io
+import json
+import math
+import multiprocessing
 import os
+import re
+import shutil
 import tempfile
-import json
-from flask import Flask, request, jsonify
-import pytesseract
-from PIL import Image
-import fitz  # PyMuPDF
-from pdf2image import convert_from_path
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
 import cv2
+import fitz  # PyMuPDF
+import metrics
 import numpy as np
+import response_format
+from flask import Flask, Request, Response, jsonify, request
+from job_queue import JobQueue, QueueFullError
+from language_detect import choose_language
+from layout_templates import TemplateStore, layout_fingerprint
+from ocr_engine import get_engine
+from profiling import RequestProfile
+from reference_index import ReferenceIndex
+from result_cache import ResultCache, make_cache_key
+from table_engine import cluster_columns
+from word_table import WordTable
+
+
+class UploadRequest(Request):
+    """
+    Request whose file uploads stay in memory when the request is at most
+    OCR_SPOOL_MAX_BYTES, and otherwise go to named temporary files whose
+    path can be handed to PyMuPDF (removed when the request is closed)
+    """
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        if total_content_length is None or total_content_length > OCR_SPOOL_MAX_BYTES:
+            return tempfile.NamedTemporaryFile(suffix=".pdf", dir=OCR_TEMP_DIR)
+        return io.BytesIO()
+
 
 app = Flask(__name__)
+app.request_class = UploadRequest
+
+AMOUNT_RE = re.compile(r"€\s*([\d,]+\.\d{2})")
+DATE_RE = re.compile(r"\d{1,2}[-/]\d{1,2}[-/]\d{4}")
+INVOICE_NUMBER_RE = re.compile(r"V\d+")
+
+# gunicorn worker processes (gunicorn.conf.py); the thread and process pools
+# of each worker default to its share of the CPUs, so they do not multiply
+OCR_SERVER_WORKERS = int(os.environ.get("OCR_SERVER_WORKERS") or 2)
+CPU_SHARE = max(1, (os.cpu_count() or 1) // OCR_SERVER_WORKERS)
+
+# Page execution: 'sequential' runs pages in the request worker, 'process'
+# fans them out over a pool of OCR worker processes
+OCR_EXECUTION_MODE = os.environ.get("OCR_EXECUTION_MODE", "sequential")
+OCR_MAX_WORKERS = int(os.environ.get("OCR_MAX_WORKERS") or CPU_SHARE)
+
+OCR_DPI = int(os.environ.get("OCR_DPI", 300))
+
+# Resource guards: documents with more pages are rejected, pages larger than
+# OCR_MAX_PAGE_PIXELS at OCR_DPI are rendered at a lower DPI instead
+OCR_MAX_PAGES = int(os.environ.get("OCR_MAX_PAGES", 50))
+OCR_MAX_PAGE_PIXELS = int(os.environ.get("OCR_MAX_PAGE_PIXELS", 40_000_000))
+OCR_LANG = os.environ.get("OCR_LANG", "nld+eng")
+# Tesseract page segmentation mode; 6 assumes a uniform block of text
+OCR_PSM = int(os.environ.get("OCR_PSM", 6))
+
+# Language detection: OCR each page with the single language found in the
+# document text or in a quick low-resolution pass (page scaled down to
+# OCR_LANG_DETECT_WIDTH pixels), and with the combined OCR_LANG models only
+# when that is ambiguous
+OCR_LANG_DETECT = os.environ.get("OCR_LANG_DETECT", "0") == "1"
+OCR_LANG_DETECT_WIDTH = int(os.environ.get("OCR_LANG_DETECT_WIDTH", 1000))
+
+# Born-digital PDFs: read words from the text layer, rasterize only pages
+# with fewer than TEXT_LAYER_MIN_WORDS usable words and scans: pages mostly
+# covered by images (over TEXT_LAYER_SCAN_IMAGE_FRACTION of the page) whose
+# text boxes cover less than TEXT_LAYER_MIN_COVERAGE of the image area, such
+# as a scanner app footer on top of the scanned invoice
+OCR_USE_TEXT_LAYER = os.environ.get("OCR_USE_TEXT_LAYER", "1") == "1"
+TEXT_LAYER_MIN_WORDS = int(os.environ.get("TEXT_LAYER_MIN_WORDS", 3))
+TEXT_LAYER_MIN_COVERAGE = float(os.environ.get("TEXT_LAYER_MIN_COVERAGE", 0.02))
+TEXT_LAYER_SCAN_IMAGE_FRACTION = 0.5
+
+# Adaptive resolution: OCR the page at OCR_FAST_DPI, then re-render and
+# re-OCR at OCR_DPI only low-confidence words and field regions
+OCR_ADAPTIVE = os.environ.get("OCR_ADAPTIVE", "0") == "1"
+OCR_FAST_DPI = int(os.environ.get("OCR_FAST_DPI", 150))
+OCR_REOCR_CONFIDENCE = int(os.environ.get("OCR_REOCR_CONFIDENCE", 75))
+TOTALS_KEYWORDS = ("totaal", "total", "btw", "vat", "te betalen")
+# White rows between re-OCR bands stacked into one image, so Tesseract
+# keeps them apart as separate lines
+BAND_GAP = 24
+
+# Lazy mode: OCR pages in OCR_LAZY_ORDER (per request: ?lazy_order=) and
+# stop once every required field was found with at least
+# OCR_LAZY_MIN_CONFIDENCE. The order is a comma separated list of 'first',
+# 'last', 'middle' (the pages in between) and 1-based page numbers, negative
+# ones counting from the end; pages it leaves out follow in page order
+OCR_LAZY = os.environ.get("OCR_LAZY", "0") == "1"
+OCR_LAZY_MIN_CONFIDENCE = float(os.environ.get("OCR_LAZY_MIN_CONFIDENCE", 0.8))
+OCR_LAZY_ORDER = os.environ.get("OCR_LAZY_ORDER", "first,last,middle")
+LAZY_ORDER_NAMES = ("first", "last", "middle")
+REQUIRED_FIELDS = ("supplier_name", "invoice_number", "invoice_date", "total_amount")
+
+# Supplier layout templates: remember where a supplier's fields are printed
+# and, for invoices whose header matches, OCR only those bands of the page
+OCR_TEMPLATES = os.environ.get("OCR_TEMPLATES", "0") == "1"
+TEMPLATE_HEADER_FRACTION = 0.2
+
+template_store = (
+    TemplateStore(
+        os.environ.get(
+            "OCR_TEMPLATES_PATH", "/app/output/templates/layout_templates.json"
+        ),
+        min_similarity=float(os.environ.get("OCR_TEMPLATE_MIN_SIMILARITY", 0.6)),
+    )
+    if OCR_TEMPLATES
+    else None
+)
+
+# ERPNext reference data (suppliers, items, companies, currencies, tax
+# templates) kept in a local index for matching; disabled without ERPNEXT_URL.
+# /erpnext/match and /erpnext/context return ERPNext records (tax ids
+# included), so they need ERPNEXT_MATCH_TOKEN in the X-OCR-Token header and
+# stay closed while it is unset.
+ERPNEXT_URL = os.environ.get("ERPNEXT_URL", "")
+ERPNEXT_MATCH_TOKEN = os.environ.get("ERPNEXT_MATCH_TOKEN", "")
+ERPNEXT_MATCH_MAX_LIMIT = 20
+
+reference_index = (
+    ReferenceIndex(
+        ERPNEXT_URL,
+        os.environ.get("ERPNEXT_API_KEY", ""),
+        os.environ.get("ERPNEXT_API_SECRET", ""),
+        os.environ.get(
+            "ERPNEXT_INDEX_PATH", "/app/output/erpnext/reference_index.json"
+        ),
+        ttl=int(os.environ.get("ERPNEXT_INDEX_TTL", 300)),
+        full_sync_interval=int(os.environ.get("ERPNEXT_FULL_SYNC_INTERVAL", 24 * 3600)),
+        min_score=float(os.environ.get("ERPNEXT_MATCH_MIN_SCORE", 0.5)),
+    )
+    if ERPNEXT_URL
+    else None
+)
+
+# Preprocessing: 'auto' picks none/light/full per page from a cheap noise
+# and contrast estimate; a fixed profile can be forced for benchmarking
+PREPROCESS_PROFILES = ("auto", "none", "light", "full")
+OCR_PREPROCESS_PROFILE = os.environ.get("OCR_PREPROCESS_PROFILE", "auto")
+
+# Result cache keyed by PDF content + processing parameters; bump
+# PIPELINE_VERSION whenever a change alters results for the same input
+PIPELINE_VERSION = 7
+OCR_CACHE_ENABLED = os.environ.get("OCR_CACHE_ENABLED", "1") == "1"
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", "/app/output/cache")
+
+result_cache = (
+    ResultCache(
+        OCR_CACHE_DIR,
+        ttl=int(os.environ.get("OCR_CACHE_TTL", 7 * 24 * 3600)),
+        memory_items=int(os.environ.get("OCR_CACHE_MEMORY_ITEMS", 128)),
+        memory_bytes=int(os.environ.get("OCR_CACHE_MEMORY_MB", 256)) * 1024 * 1024,
+        disk_bytes=int(os.environ.get("OCR_CACHE_DISK_MB", 1024)) * 1024 * 1024,
+        sweep_interval=int(os.environ.get("OCR_CACHE_SWEEP_INTERVAL", 300)),
+    )
+    if OCR_CACHE_ENABLED
+    else None
+)
+
+# Asynchronous /jobs API: bounded queue drained by a pool of CPU_SHARE
+# threads per worker; jobs of a worker that exited are reported as failed
+job_queue = JobQueue(
+    os.environ.get("OCR_JOBS_DIR", "/app/output/jobs"),
+    workers=int(os.environ.get("OCR_JOB_WORKERS") or CPU_SHARE),
+    max_queue=int(os.environ.get("OCR_JOB_QUEUE_SIZE", 16)),
+    result_ttl=int(os.environ.get("OCR_JOB_RESULT_TTL", 24 * 3600)),
+    on_depth_change=metrics.set_queue_depth,
+)
+
+# /process-invoices batch endpoint shares the job worker count
+batch_pool = ThreadPoolExecutor(
+    max_workers=job_queue.workers, thread_name_prefix="ocr-batch"
+)
+OCR_BATCH_MAX_FILES = int(os.environ.get("OCR_BATCH_MAX_FILES", 100))
+OCR_BATCH_MAX_MB = int(os.environ.get("OCR_BATCH_MAX_MB", 200))
+
+# No request body may exceed a full batch (plus room for the multipart
+# framing and form fields); larger ones get 413 before any part is parsed
+app.config["MAX_CONTENT_LENGTH"] = (OCR_BATCH_MAX_MB + 1) * 1024 * 1024
+
+# Uploads up to OCR_SPOOL_MAX_MB are kept in memory and opened by PyMuPDF
+# straight from bytes; larger ones are spooled to a temporary file that is
+# hashed in chunks and opened by path
+OCR_SPOOL_MAX_BYTES = int(float(os.environ.get("OCR_SPOOL_MAX_MB", 20)) * 1024 * 1024)
+OCR_TEMP_DIR = os.environ.get("OCR_TEMP_DIR", "/app/temp")
+
+# ?profile=1&pstats=1 writes a cProfile dump per request here
+OCR_PROFILE_DIR = os.environ.get("OCR_PROFILE_DIR", "/app/output/profiles")
+
+# Run a synthetic page through the pipeline when a worker (or ASGI OCR
+# process) starts, so the first real invoice does not pay for loading
+OCR_WARMUP = os.environ.get("OCR_WARMUP", "1") == "1"
+
+# Set by the ASGI front end (asgi_app.py): whole invoices then run in this
+# process pool instead of the calling thread
+invoice_pool = None
+
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+
+def get_page_pool(max_workers):
+    """
+    Return the per-worker page OCR pool, creating it on first use (once,
+    however many request threads ask at the same time). Its processes are
+    spawned rather than forked: the request worker runs job and batch
+    threads, and a fork copies whatever locks they hold at that moment.
+    """
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+    return _page_pool
+
+
+def is_pdf_bytes(pdf):
+    return isinstance(pdf, (bytes, bytearray, memoryview))
+
+
+def open_pdf(pdf):
+    """Open a PDF given as a file path or as bytes held in memory"""
+    if is_pdf_bytes(pdf):
+        return fitz.open(stream=pdf, filetype="pdf")
+    return fitz.open(pdf)
+
+
+def parse_lazy_order(spec):
+    """Entries of a lazy page order: 'first', 'last', 'middle' or non-zero page numbers"""
+    entries = []
+    for entry in spec.split(","):
+        entry = entry.strip().lower()
+        if entry in LAZY_ORDER_NAMES:
+            entries.append(entry)
+            continue
+        try:
+            number = int(entry)
+        except ValueError:
+            number = 0
+        if number == 0:
+            raise ValueError(f"Unknown lazy page order entry: {entry!r}")
+        entries.append(number)
+    return tuple(entries)
+
+
+def _run_page_task(task):
+    """Pool entry point: run one page method of a (pickled) processor in a worker process"""
+    processor, method, args = task
+    return getattr(processor, method)(*args)
+
 
 class HybridInvoiceProcessor:
-    def __init__(self):
-        self.temp_dir = "/app/temp"
+    def __init__(
+        self,
+        execution_mode=None,
+        max_workers=None,
+        dpi=None,
+        use_text_layer=None,
+        adaptive=None,
+        preprocess_profile=None,
+        lazy=None,
+        lazy_order=None,
+    ):
+        self.temp_dir = OCR_TEMP_DIR
         os.makedirs(self.temp_dir, exist_ok=True)
+        self.execution_mode = execution_mode or OCR_EXECUTION_MODE
+        self.max_workers = max_workers or OCR_MAX_WORKERS
+        self.dpi = dpi or OCR_DPI
+        self.use_text_layer = (
+            OCR_USE_TEXT_LAYER if use_text_layer is None else use_text_layer
+        )
+        self.lang = OCR_LANG
+        self.psm = OCR_PSM
+        self.lang_detect = OCR_LANG_DETECT
+        self.adaptive = OCR_ADAPTIVE if adaptive is None else adaptive
+        self.fast_dpi = OCR_FAST_DPI
+        self.preprocess_profile = preprocess_profile or OCR_PREPROCESS_PROFILE
+        self.lazy = OCR_LAZY if lazy is None else lazy
+        self.lazy_order = parse_lazy_order(lazy_order or OCR_LAZY_ORDER)
+        self.use_templates = template_store is not None
+        if self.preprocess_profile not in PREPROCESS_PROFILES:
+            raise ValueError(
+                f"Unknown preprocessing profile: {self.preprocess_profile}"
+            )
+
+    def cache_params(self, extracted_text=None):
+        """Processing parameters that change the result for the same PDF"""
+        return {
+            "pipeline_version": PIPELINE_VERSION,
+            "dpi": self.dpi,
+            "lang": self.lang,
+            "psm": self.psm,
+            "lang_detect": [OCR_LANG_DETECT_WIDTH] if self.lang_detect else False,
+            "preprocess": self.preprocess_profile,
+            "use_text_layer": (
+                [TEXT_LAYER_MIN_WORDS, TEXT_LAYER_MIN_COVERAGE]
+                if self.use_text_layer
+                else False
+            ),
+            "adaptive": (
+                [self.fast_dpi, OCR_REOCR_CONFIDENCE] if self.adaptive else False
+            ),
+            "lazy": (
+                [OCR_LAZY_MIN_CONFIDENCE, list(self.lazy_order)] if self.lazy else False
+            ),
+            "templates": self.use_templates,
+            "extracted_text": hashlib.sha256(
+                (extracted_text or "").encode("utf-8")
+            ).hexdigest(),
+        }
 
     def process_pdf(self, pdf_path, extracted_text=None):
         """
-        Process PDF with hybrid approach:
-        1. Extract text with coordinates using Tesseract
+        Process PDF (a file path or the PDF bytes) with hybrid approach:
+        1. Extract text with coordinates from the PDF text layer, or
+           with Tesseract for pages that have no usable text layer
         2. Compare with pre-extracted text for validation
         3. Combine for enhanced accuracy
         """
@@ -34,302 +348,1252 @@ class HybridInvoiceProcessor:
             "text_validation": {},
             "layout_analysis": {},
             "extracted_fields": {},
-            "confidence_scores": {}
+            "confidence_scores": {},
+            "processing_info": {},
         }
 
+        tmp_file = None
         try:
-            # Convert PDF to images
-            images = convert_from_path(pdf_path, dpi=300)
-            
-            for page_num, image in enumerate(images):
-                page_result = self.process_page(image, page_num, extracted_text)
-                results["ocr_data"].append(page_result)
-
-            # Analyze layout and extract fields
-            results["layout_analysis"] = self.analyze_layout(results["ocr_data"])
-            results["extracted_fields"] = self.extract_invoice_fields(results["ocr_data"], extracted_text)
-            results["text_validation"] = self.validate_with_extracted_text(results["extracted_fields"], extracted_text)
+            start = time.perf_counter()
+
+            # Reject oversized documents before any page is read
+            page_count = self.get_page_count(pdf_path)
+            if page_count > OCR_MAX_PAGES:
+                raise ValueError(
+                    f"PDF has {page_count} pages, limit is {OCR_MAX_PAGES}"
+                )
+
+            # Born-digital pages come straight from the text layer
+            text_pages = (
+                self.extract_text_layer(pdf_path) if self.use_text_layer else {}
+            )
+            raster_page_nums = [n for n in range(page_count) if n not in text_pages]
+
+            # Page tasks in the process pool get a path instead of a pickled copy of the bytes
+            if (
+                self.execution_mode == "process"
+                and len(raster_page_nums) > 1
+                and is_pdf_bytes(pdf_path)
+            ):
+                tmp_file = tempfile.NamedTemporaryFile(suffix=".pdf", dir=self.temp_dir)
+                tmp_file.write(pdf_path)
+                tmp_file.flush()
+                pdf_path = tmp_file.name
+
+            # A conclusive document text sets the language of every raster page; passed
+            # down rather than stored, since concurrent requests share a processor
+            lang_hint = (
+                self.text_language(text_pages, extracted_text)
+                if self.lang_detect
+                else None
+            )
+
+            # Remaining pages are rendered to grayscale and OCRed inside the page tasks
+            page_timed = dict(text_pages)
+            skipped_pages = []
+            template_pages = template_info = None
+            if self.use_templates and raster_page_nums and raster_page_nums[0] == 0:
+                template_pages, template_info = self.ocr_pages_template(
+                    pdf_path,
+                    page_count,
+                    raster_page_nums,
+                    page_timed,
+                    extracted_text,
+                    lang_hint,
+                )
+
+            if template_pages is not None:
+                page_timed.update(template_pages)
+            elif self.lazy:
+                skipped_pages = self.ocr_pages_lazy(
+                    pdf_path,
+                    page_count,
+                    raster_page_nums,
+                    page_timed,
+                    extracted_text,
+                    lang_hint,
+                )
+            else:
+                page_timed.update(
+                    self.ocr_pages(
+                        pdf_path, raster_page_nums, extracted_text, lang_hint
+                    )
+                )
+            for page_num in skipped_pages:
+                page_timed[page_num] = (
+                    {"page": page_num, "table": WordTable.empty(), "source": "skipped"},
+                    0.0,
+                )
+
+            results["ocr_data"] = [page_timed[n][0] for n in range(page_count)]
+            results["processing_info"] = {
+                "execution_mode": self.execution_mode,
+                "adaptive": self.adaptive,
+                "lazy": self.lazy,
+                "pages_processed": page_count - len(skipped_pages),
+                "text_layer_pages": sorted(text_pages),
+                "ocr_pages": [n for n in raster_page_nums if n not in skipped_pages],
+                "skipped_pages": skipped_pages,
+                "render_time": round(
+                    sum(p.get("render_time", 0.0) for p in results["ocr_data"]), 3
+                ),
+                "page_times": [round(page_timed[n][1], 3) for n in range(page_count)],
+            }
+            if self.lang_detect:
+                results["processing_info"]["language"] = self.language_summary(
+                    results["ocr_data"], lang_hint
+                )
+
+            # Analyze layout once and share it with the field extractors
+            with metrics.timed("layout_model"):
+                layout_models = self.build_layout_models(results["ocr_data"])
+                table = self.build_table(layout_models)
+            if template_info is not None:
+                fingerprint = template_info.pop("fingerprint")
+                if template_pages is None:
+                    template_info["learned"] = self.learn_template(
+                        fingerprint, page_count, results["ocr_data"], layout_models
+                    )
+                results["processing_info"]["template"] = template_info
+            with metrics.timed("analyze_layout"):
+                results["layout_analysis"] = self.analyze_layout(
+                    results["ocr_data"], layout_models, table
+                )
+            with metrics.timed("extract_invoice_fields"):
+                results["extracted_fields"] = self.extract_invoice_fields(
+                    results["ocr_data"], extracted_text, layout_models, table
+                )
+            results["text_validation"] = self.validate_with_extracted_text(
+                results["extracted_fields"], extracted_text
+            )
             results["confidence_scores"] = self.calculate_confidence_scores(results)
 
+            # Word and line dicts are built only here, for the response
+            results["ocr_data"] = [
+                self.page_response(page) for page in results["ocr_data"]
+            ]
+            results["processing_info"]["total_time"] = round(
+                time.perf_counter() - start, 3
+            )
+            metrics.observe_stage("process_pdf", time.perf_counter() - start)
+            for page in results["ocr_data"]:
+                metrics.count_pages(page.get("source", "ocr"))
+
         except Exception as e:
+            results["ocr_data"] = []
             results["error"] = str(e)
+        finally:
+            if tmp_file is not None:
+                tmp_file.close()
 
         return results
 
-    def process_page(self, image, page_num, extracted_text=None):
-        """Process a single page with Tesseract OCR"""
-        # Convert PIL image to OpenCV format for preprocessing
-        cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        
-        # Preprocessing for better OCR
-        processed_image = self.preprocess_image(cv_image)
-        
-        # Get OCR data with coordinates
-        ocr_data = pytesseract.image_to_data(
-            processed_image, 
-            lang='nld+eng',
-            output_type=pytesseract.Output.DICT,
-            config='--psm 6'  # Assume uniform block of text
+    def page_response(self, page_result):
+        """Page result in the API response layout: its word table as word and line dicts"""
+        page_result = dict(page_result)
+        return {
+            "page": page_result.pop("page"),
+            **page_result.pop("table").to_dicts(),
+            **page_result,
+        }
+
+    def get_page_count(self, pdf_path):
+        """Number of pages in the PDF"""
+        with open_pdf(pdf_path) as doc:
+            return doc.page_count
+
+    def render_gray(self, page, dpi, clip=None):
+        """
+        Render a PDF page (or a clip rectangle of it, in points) to a
+        single-channel pixmap and view its samples as a numpy array without
+        copying. Returns (array, pixmap): the pixmap owns the buffer and must
+        stay referenced while the array is in use.
+        """
+        with metrics.timed("render"):
+            pix = page.get_pixmap(
+                dpi=dpi, colorspace=fitz.csGRAY, clip=clip, alpha=False
+            )
+        gray = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(
+            pix.height, pix.stride
+        )[:, : pix.width]
+        return gray, pix
+
+    def extract_text_layer(self, pdf_path):
+        """
+        Read words with coordinates from the PDF text layer.
+        Returns {page_num: (page_result, seconds)} for pages with usable text.
+        """
+        pages = {}
+        with open_pdf(pdf_path) as doc:
+            for page in doc:
+                start = time.perf_counter()
+                with metrics.timed("text_layer"):
+                    page_result = self.process_text_layer_page(page)
+                if page_result is not None:
+                    pages[page.number] = (page_result, time.perf_counter() - start)
+        return pages
+
+    def process_text_layer_page(self, page):
+        """Build the process_page structure from a PDF page's text layer"""
+        # PDF points -> pixels at the processing DPI, so boxes match raster OCR output
+        scale = self.dpi / 72.0
+        raw_words = page.get_text("words", sort=True)
+
+        usable = [w for w in raw_words if any(c.isalnum() for c in w[4])]
+        if len(usable) < TEXT_LAYER_MIN_WORDS or self.is_scanned_page(page, raw_words):
+            return None
+
+        return self.build_page(
+            page.number,
+            WordTable.from_text_layer(raw_words, scale),
+            int(page.rect.width * scale),
+            int(page.rect.height * scale),
+            "text_layer",
         )
 
-        # Structure the OCR data
-        words = []
-        lines = []
-        current_line = []
-        current_line_num = -1
-
-        for i, word_text in enumerate(ocr_data['text']):
-            if int(ocr_data['conf'][i]) > 30:  # Filter low confidence
-                word_info = {
-                    'text': word_text.strip(),
-                    'confidence': int(ocr_data['conf'][i]),
-                    'bbox': {
-                        'x': int(ocr_data['left'][i]),
-                        'y': int(ocr_data['top'][i]),
-                        'width': int(ocr_data['width'][i]),
-                        'height': int(ocr_data['height'][i])
-                    },
-                    'line_num': int(ocr_data['line_num'][i]),
-                    'word_num': int(ocr_data['word_num'][i])
-                }
+    def is_scanned_page(self, page, raw_words):
+        """
+        Whether a page with a text layer is still a scan: images cover most of
+        the page and the text boxes only a small part of the image area
+        """
+        page_area = page.rect.get_area()
+        image_area = min(
+            page_area,
+            sum(
+                (fitz.Rect(info["bbox"]) & page.rect).get_area()
+                for info in page.get_image_info()
+            ),
+        )
+        if page_area <= 0 or image_area < TEXT_LAYER_SCAN_IMAGE_FRACTION * page_area:
+            return False
+        text_area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1, *_ in raw_words)
+        return text_area < TEXT_LAYER_MIN_COVERAGE * image_area
+
+    def ocr_pages(self, pdf_path, page_nums, extracted_text=None, lang_hint=None):
+        """Render and OCR the given pages, returning {page_num: (page_result, seconds)}"""
+        return dict(
+            self.iter_page_results(pdf_path, page_nums, extracted_text, lang_hint)
+        )
+
+    def ocr_pages_lazy(
+        self,
+        pdf_path,
+        page_count,
+        page_nums,
+        page_timed,
+        extracted_text=None,
+        lang_hint=None,
+    ):
+        """
+        OCR pages in lazy order (self.lazy_order) into page_timed, stopping
+        once all required fields are confidently found.
+        Returns the skipped page numbers.
+        """
+        order = self.lazy_page_order(page_nums, page_count)
+        window = self.max_workers if self.execution_mode == "process" else 1
+        layout_models = {}
+        position = 0
+
+        while position < len(order):
+            # Page 0 anchors the layout analysis, so it is always OCRed
+            if 0 in page_timed and self.required_fields_found(
+                page_timed, layout_models
+            ):
+                break
+            chunk = sorted(order[position : position + window])
+            page_timed.update(
+                self.ocr_pages(pdf_path, chunk, extracted_text, lang_hint)
+            )
+            position += window
+
+        return sorted(order[position:])
+
+    def lazy_page_order(self, page_nums, page_count):
+        """
+        The raster pages page_nums in the order self.lazy_order names them:
+        'first', 'last' and 'middle' refer to page_nums, numbers to 1-based
+        document pages. Pages the order leaves out follow in page order.
+        """
+        raster = set(page_nums)
+        order = []
+        for entry in self.lazy_order:
+            if entry == "first":
+                picks = page_nums[:1]
+            elif entry == "last":
+                picks = page_nums[-1:]
+            elif entry == "middle":
+                picks = page_nums[1:-1]
+            else:
+                picks = [entry - 1 if entry > 0 else page_count + entry]
+            for page_num in picks:
+                if page_num in raster and page_num not in order:
+                    order.append(page_num)
+        return order + [n for n in page_nums if n not in order]
+
+    def required_fields_found(self, page_timed, layout_models):
+        """Whether the pages processed so far yield every required field confidently"""
+        for page_num in page_timed:
+            if page_num not in layout_models:
+                layout_models[page_num] = self.build_layout_model(
+                    page_timed[page_num][0]
+                )
+
+        located = self.locate_fields([layout_models[n] for n in sorted(layout_models)])
+        return all(
+            field in located and located[field]["confidence"] >= OCR_LAZY_MIN_CONFIDENCE
+            for field in REQUIRED_FIELDS
+        )
+
+    def iter_page_results(
+        self, pdf_path, page_nums, extracted_text=None, lang_hint=None
+    ):
+        """
+        Yield (page_num, (page_result, seconds)) in page order. Only a bounded
+        window of pages is rendered at any time: one in sequential mode,
+        max_workers in process mode, so peak memory does not grow with the
+        page count.
+        """
+        method = (
+            "process_page_adaptive_timed" if self.adaptive else "process_pdf_page_timed"
+        )
+        tasks = [
+            (pdf_path, page_num, extracted_text, lang_hint) for page_num in page_nums
+        ]
+
+        if self.execution_mode == "process" and len(tasks) > 1:
+            pool = get_page_pool(self.max_workers)
+            pending = deque()
+            for task in tasks:
+                pending.append(
+                    (task[1], pool.submit(_run_page_task, (self, method, task)))
+                )
+                if len(pending) >= self.max_workers:
+                    page_num, future = pending.popleft()
+                    yield page_num, future.result()
+            while pending:
+                page_num, future = pending.popleft()
+                yield page_num, future.result()
+        elif self.adaptive:
+            for task in tasks:
+                yield task[1], self.process_page_adaptive_timed(*task)
+        else:
+            start = time.perf_counter()
+            for page_num, gray, render_time in self.iter_rendered_pages(
+                pdf_path, page_nums
+            ):
+                page_result = self.process_page(
+                    gray, page_num, extracted_text, lang_hint=lang_hint
+                )
+                page_result["render_time"] = round(render_time, 3)
+                yield page_num, (page_result, time.perf_counter() - start)
+                start = time.perf_counter()
+
+    def iter_rendered_pages(self, pdf_path, page_nums=None):
+        """
+        Yield (page_num, gray, render_seconds) one page at a time. The array
+        is a view on the page's pixmap, which is released when the next page
+        is requested, so consumers must finish with it before advancing.
+        """
+        with open_pdf(pdf_path) as doc:
+            for page_num in range(doc.page_count) if page_nums is None else page_nums:
+                start = time.perf_counter()
+                page = doc[page_num]
+                gray, pix = self.render_gray(page, self.page_dpi(page))
+                yield page_num, gray, time.perf_counter() - start
+                del gray, pix
+
+    def page_dpi(self, page):
+        """Processing DPI, lowered so the rendered page stays within OCR_MAX_PAGE_PIXELS"""
+        area_inches = (page.rect.width / 72.0) * (page.rect.height / 72.0)
+        if area_inches <= 0:
+            return self.dpi
+        return min(self.dpi, int(math.sqrt(OCR_MAX_PAGE_PIXELS / area_inches)))
+
+    def page_pixels(self, page, dpi):
+        """(width, height) of the page rendered at dpi, rounded as render_gray's pixmap is"""
+        zoom = dpi / 72.0
+        pixels = (page.rect * fitz.Matrix(zoom, zoom)).irect
+        return pixels.width, pixels.height
+
+    def process_pdf_page_timed(
+        self, pdf_path, page_num, extracted_text=None, lang_hint=None
+    ):
+        """Render one PDF page to grayscale, OCR it and report how long it took"""
+        start = time.perf_counter()
+        for _, gray, render_time in self.iter_rendered_pages(pdf_path, [page_num]):
+            page_result = self.process_page(
+                gray, page_num, extracted_text, lang_hint=lang_hint
+            )
+            page_result["render_time"] = round(render_time, 3)
+        return page_result, time.perf_counter() - start
+
+    def process_page_adaptive_timed(
+        self, pdf_path, page_num, extracted_text=None, lang_hint=None
+    ):
+        """Adaptive-resolution OCR of a single page and how long it took"""
+        start = time.perf_counter()
+        with open_pdf(pdf_path) as doc:
+            page_result = self.process_page_adaptive(
+                doc[page_num], extracted_text, lang_hint
+            )
+        return page_result, time.perf_counter() - start
+
+    def process_page_adaptive(self, page, extracted_text=None, lang_hint=None):
+        """
+        Two-tier OCR of a PDF page:
+        1. Fast pass over the whole page at fast_dpi
+        2. Re-render and re-OCR at the full DPI only the bands holding
+           low-confidence words or invoice field regions
+        Coordinates in the result are in full-DPI pixels, as with process_page
+        """
+        dpi = self.page_dpi(page)
+        fast_dpi = min(self.fast_dpi, dpi)
+        scale = dpi / fast_dpi
+        page_width, page_height = self.page_pixels(page, dpi)
+
+        gray, pix = self.render_gray(page, fast_dpi)
+        fast = self.process_page(gray, page.number, extracted_text, lang_hint=lang_hint)
+        del gray, pix
+        language = fast.get("language")
+        words = fast["table"].scaled(scale)
+
+        regions = self.find_reocr_regions(words.lines(), page_width, page_height)
+
+        # Replace fast-pass words inside the regions with the high-resolution ones
+        words = words[~self.centers_in(words, regions)]
+        bands = self.ocr_bands(
+            page,
+            dpi,
+            [(y0, y1) for _, y0, _, y1 in regions],
+            extracted_text,
+            language and language["lang"],
+        )[0]
+
+        page_result = self.build_page(
+            page.number,
+            WordTable.concat([words, bands]).group_lines(),
+            page_width,
+            page_height,
+            "ocr_adaptive",
+        )
+        if language:
+            page_result["language"] = language
+        page_result["reocr_regions"] = len(regions)
+        page_result["reocr_fraction"] = round(
+            sum((y1 - y0) * (x1 - x0) for x0, y0, x1, y1 in regions)
+            / float(page_width * page_height),
+            3,
+        )
+        return page_result
+
+    def ocr_bands(
+        self, page, dpi, bands, extracted_text=None, lang=None, lang_hint=None
+    ):
+        """
+        OCR full-width horizontal bands ((y0, y1) in pixels at dpi) of a PDF
+        page with a single engine call: the bands are rendered, stacked into
+        one image BAND_GAP white rows apart and OCRed together, and the boxes
+        are mapped back to page pixels. Returns (words, language info), the
+        language being detected on the stack (or taken from lang_hint)
+        unless lang is given; the words come as a WordTable.
+        """
+        if not bands:
+            return WordTable.empty(), None
+
+        zoom = dpi / 72.0
+        strips = []
+        for y0, y1 in bands:
+            gray, pix = self.render_gray(
+                page, dpi, fitz.Rect(0, y0 / zoom, page.rect.width, y1 / zoom)
+            )
+            strips.append(gray.copy())
+            del gray, pix
+
+        # Stack offsets of each band; clips can differ by a pixel in width
+        offsets = np.cumsum(
+            [0] + [strip.shape[0] + BAND_GAP for strip in strips[:-1]]
+        ).tolist()
+        stack = np.full(
+            (offsets[-1] + strips[-1].shape[0], max(s.shape[1] for s in strips)),
+            255,
+            dtype=np.uint8,
+        )
+        for offset, strip in zip(offsets, strips):
+            stack[offset : offset + strip.shape[0], : strip.shape[1]] = strip
+        del strips
+
+        crop = self.process_page(stack, page.number, extracted_text, lang, lang_hint)
+        words = crop["table"]
+        _, centers = words.centers()
+        band = np.maximum(np.searchsorted(offsets, centers, side="right") - 1, 0)
+        words.cols["y"] += (np.asarray([y0 for y0, _ in bands]) - np.asarray(offsets))[
+            band
+        ].astype(np.int32)
+        return words, crop.get("language")
+
+    def ocr_pages_template(
+        self,
+        pdf_path,
+        page_count,
+        page_nums,
+        page_timed,
+        extracted_text=None,
+        lang_hint=None,
+    ):
+        """
+        Fast path for repeat suppliers: OCR the header band of page 0, match
+        its fingerprint against the stored supplier templates and, on a
+        match, OCR only the template's field bands of each raster page.
+        Returns (pages, info): pages is {page_num: (page_result, seconds)},
+        or None when there is no match, the bands miss a required field or
+        part of the line item table (see table_complete). info keeps the
+        fingerprint so a miss can be learned after full OCR.
+        """
+        pages = {}
+        covered = {}
+        with open_pdf(pdf_path) as doc:
+            for page_num in page_nums:
+                start = time.perf_counter()
+                page = doc[page_num]
+                dpi = self.page_dpi(page)
+                width, height = self.page_pixels(page, dpi)
+                words = WordTable.empty()
+                top = 0
+
+                if page_num == 0:
+                    top = int(height * TEMPLATE_HEADER_FRACTION)
+                    words, language = self.ocr_bands(
+                        page, dpi, [(0, top)], extracted_text, lang_hint=lang_hint
+                    )
+                    fingerprint = layout_fingerprint(
+                        words, width, height, TEMPLATE_HEADER_FRACTION
+                    )
+                    template, similarity = template_store.match(fingerprint, page_count)
+                    info = {
+                        "supplier": template["supplier"] if template else None,
+                        "similarity": round(similarity, 3),
+                        "fingerprint": fingerprint,
+                    }
+                    if template is None:
+                        template_store.record("misses")
+                        return None, info
+
+                bands = []
+                for band in template["bands"]:
+                    if band["page"] != page_num:
+                        continue
+                    y0 = max(int(band["top"] * height), top)
+                    y1 = min(int(band["bottom"] * height), height)
+                    if y1 > y0:
+                        bands.append((y0, y1))
+                band_words = self.ocr_bands(
+                    page, dpi, bands, extracted_text, language and language["lang"]
+                )[0]
+                covered[page_num] = (height, [(0, top)] + bands)
+
+                page_result = self.build_page(
+                    page_num,
+                    WordTable.concat([words, band_words]).group_lines(),
+                    width,
+                    height,
+                    "template",
+                )
+                if language:
+                    page_result["language"] = language
+                pages[page_num] = (page_result, time.perf_counter() - start)
+
+        # Layout changed since the template was learned: fall back to full OCR
+        layout_models = {}
+        if not self.required_fields_found(
+            {**page_timed, **pages}, layout_models
+        ) or not self.table_complete(
+            [layout_models[n] for n in sorted(layout_models)], covered
+        ):
+            template_store.record("fallbacks")
+            return None, info
+
+        template_store.record("hits")
+        return pages, info
+
+    def table_complete(self, layout_models, covered):
+        """
+        Whether the template bands caught the whole line item table: the
+        item amounts add up to the subtotal or, on invoices without one, the
+        bands cover the table from its header line down to the first totals
+        line, so no row can lie outside them. covered is {page_num:
+        (height, bands)} of the OCRed pixel bands.
+        """
+        table = self.build_table(layout_models)
+        if not table["rows"]:
+            return False
+
+        located = self.locate_fields(layout_models)
+        if "subtotal" in located:
+            items = self.extract_table_items(table["rows"], table["columns"])
+            return (
+                abs(
+                    sum(item["amount"] for item in items) - located["subtotal"]["value"]
+                )
+                < 0.01
+            )
+
+        models = {model["page"]: model for model in layout_models}
+        first, last = models[table["pages"][0]], models[table["pages"][-1]]
+        header = first["regions"]["line_items_region"]
+        if header is None or not last["totals_lines"]:
+            return False
+
+        for page_num in table["pages"]:
+            height, bands = covered.get(page_num, (0, []))
+            top = header["bbox"]["y"] if page_num == first["page"] else 0
+            bottom = height
+            if page_num == last["page"]:
+                bottom = int(last["lines"].y0[last["totals_lines"][0]["line"]])
+            for y0, y1 in sorted(bands):
+                if y0 > top:
+                    break
+                top = max(top, y1)
+            if top < bottom:
+                return False
+        return True
 
-                if word_text.strip():  # Only non-empty words
-                    words.append(word_info)
-                    
-                    # Group words into lines
-                    if ocr_data['line_num'][i] != current_line_num:
-                        if current_line:
-                            lines.append({
-                                'line_num': current_line_num,
-                                'words': current_line,
-                                'text': ' '.join([w['text'] for w in current_line]),
-                                'bbox': self.get_line_bbox(current_line)
-                            })
-                        current_line = [word_info]
-                        current_line_num = ocr_data['line_num'][i]
-                    else:
-                        current_line.append(word_info)
-
-        # Add last line
-        if current_line:
-            lines.append({
-                'line_num': current_line_num,
-                'words': current_line,
-                'text': ' '.join([w['text'] for w in current_line]),
-                'bbox': self.get_line_bbox(current_line)
-            })
+    def learn_template(self, fingerprint, page_count, ocr_data, layout_models):
+        """
+        Store the supplier template for a fully OCRed invoice: the padded
+        bands of every located field plus the line item table (down to the
+        totals lines), normalized to the page height. Only invoices with a header fingerprint and all
+        required fields qualify.
+        """
+        located = self.locate_fields(layout_models)
+        if not fingerprint or not all(field in located for field in REQUIRED_FIELDS):
+            return False
+
+        boxes = []
+        for field in located.values():
+            bbox = layout_models[field["page"]]["lines"].bbox(field["line"])
+            boxes.append((field["page"], bbox, bbox["height"]))
+        for model in layout_models:
+            rows = list(model["table_rows"])
+            if model["regions"]["line_items_region"]:
+                rows.append(model["regions"]["line_items_region"]["start_line"])
+            if rows and model["totals_lines"]:
+                rows.append(
+                    model["totals_lines"][0]["line"]
+                )  # Down to the totals, so added rows stay in the band
+            if rows:
+                lines = model["lines"]
+                boxes.append(
+                    (
+                        model["page"],
+                        lines.bbox_union(rows),
+                        int(lines.y1[rows[0]] - lines.y0[rows[0]]),
+                    )
+                )
+
+        bands = []
+        for page_num, bbox, pad in sorted(boxes, key=lambda b: (b[0], b[1]["y"])):
+            # pad is one line of slack for shifted layouts
+            height = ocr_data[page_num]["image_size"]["height"]
+            top = max(0.0, (bbox["y"] - pad) / height)
+            bottom = min(1.0, (bbox["y"] + bbox["height"] + pad) / height)
+            if bands and bands[-1]["page"] == page_num and top <= bands[-1]["bottom"]:
+                bands[-1]["bottom"] = max(bands[-1]["bottom"], round(bottom, 4))
+            else:
+                bands.append(
+                    {"page": page_num, "top": round(top, 4), "bottom": round(bottom, 4)}
+                )
+
+        template_store.learn(
+            located["supplier_name"]["value"], fingerprint, page_count, bands
+        )
+        return True
 
+    def find_reocr_regions(self, lines, page_width, page_height, pad=10):
+        """
+        Horizontal bands (x0, y0, x1, y1) in full-DPI pixels to re-OCR: the
+        header, totals lines and lines with a weak word. Confidently read
+        table rows keep their fast-pass words. Bands less than a median
+        line height apart are merged, so neighbouring lines become one band.
+        lines is the LineTable of the fast pass, scaled to full DPI.
+        """
+        totals = np.asarray(
+            [
+                any(keyword in text.lower() for keyword in TOTALS_KEYWORDS)
+                for text in lines.text
+            ],
+            dtype=bool,
+        )
+        selected = (lines.min_confidence < OCR_REOCR_CONFIDENCE) | totals
+        bands = [(0, int(page_height * 0.15))]  # Header: supplier, invoice number, date
+        bands.extend(zip(lines.y0[selected].tolist(), lines.y1[selected].tolist()))
+
+        merge_gap = int(np.median(lines.y1 - lines.y0)) if len(lines) else 0
+        merged = []
+        for y0, y1 in sorted(
+            (max(0, y0 - pad), min(page_height, y1 + pad)) for y0, y1 in bands
+        ):
+            if merged and y0 <= merged[-1][1] + merge_gap:
+                merged[-1][1] = max(merged[-1][1], y1)
+            else:
+                merged.append([y0, y1])
+
+        return [(0, y0, page_width, y1) for y0, y1 in merged]
+
+    def centers_in(self, words, regions):
+        """Mask of the words of a WordTable whose box center lies inside any (x0, y0, x1, y1) region"""
+        cx, cy = words.centers()
+        inside = np.zeros(len(words), dtype=bool)
+        for x0, y0, x1, y1 in regions:
+            inside |= (cx >= x0) & (cx < x1) & (cy >= y0) & (cy < y1)
+        return inside
+
+    def build_page(self, page_num, words, width, height, source):
+        """
+        Page result kept through layout analysis: the page's WordTable (lines
+        contiguous) under 'table'; page_response turns it into the API layout
+        """
         return {
-            'page': page_num,
-            'words': words,
-            'lines': lines,
-            'image_size': {'width': image.width, 'height': image.height}
+            "page": page_num,
+            "table": words,
+            "image_size": {"width": width, "height": height},
+            "source": source,
         }
 
-    def preprocess_image(self, cv_image):
-        """Preprocess image for better OCR results"""
-        # Convert to grayscale
-        gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
-        
+    def process_page(
+        self, image, page_num, extracted_text=None, lang=None, lang_hint=None
+    ):
+        """
+        Process a single page (grayscale numpy array or PIL image) with
+        Tesseract OCR, in the given language or the one page_language picks
+        (the document's lang_hint when there is one)
+        """
+        if isinstance(image, np.ndarray):
+            gray = image
+        else:
+            # PIL image: a single conversion straight to grayscale
+            gray = cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2GRAY)
+        height, width = gray.shape[:2]
+
+        language = None
+        if lang is None:
+            lang, language = self.page_language(gray, lang_hint)
+
+        # Preprocessing for better OCR
+        processed_image, preprocess_info = self.preprocess_page(gray)
+
+        # Get OCR data with coordinates (warm in-process engine when available)
+        start = time.perf_counter()
+        with metrics.timed("image_to_data"):
+            ocr_data = get_engine().image_to_data(
+                processed_image, lang=lang, psm=self.psm
+            )
+
+        # Columnar word table; the word/line dicts are only built for the response
+        page_result = self.build_page(
+            page_num,
+            WordTable.from_tesseract(ocr_data, min_confidence=30),
+            width,
+            height,
+            "ocr",
+        )
+        page_result["preprocess"] = preprocess_info
+        if language is not None:
+            language["estimated_saved_seconds"] = self.language_saving(
+                language, time.perf_counter() - start
+            )
+            page_result["language"] = language
+        return page_result
+
+    def text_language(self, text_pages, extracted_text=None):
+        """Single language of the text layer pages and pre-extracted text, or None when not conclusive"""
+        candidates = self.lang.split("+")
+        if len(candidates) < 2:
+            return None
+        words = [
+            text
+            for page_result, _ in text_pages.values()
+            for text in page_result["table"].text.tolist()
+        ]
+        words.extend((extracted_text or "").split())
+        lang, _ = choose_language(words, candidates)
+        return lang
+
+    def page_language(self, gray, lang_hint=None):
+        """
+        Tesseract language for a page: the document text's language
+        (lang_hint) when known, otherwise the one detected in a low-resolution pass with the
+        first candidate model, or the combined self.lang when that pass is
+        ambiguous. Returns (lang, info); info is None without detection.
+        """
+        candidates = self.lang.split("+")
+        if not self.lang_detect or len(candidates) < 2:
+            return self.lang, None
+        if lang_hint:
+            return lang_hint, {
+                "lang": lang_hint,
+                "method": "text",
+                "detect_seconds": 0.0,
+            }
+
+        start = time.perf_counter()
+        scale = min(1.0, OCR_LANG_DETECT_WIDTH / gray.shape[1])
+        small = (
+            cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            if scale < 1
+            else gray
+        )
+        with metrics.timed("lang_detect"):
+            data = get_engine().image_to_data(small, lang=candidates[0], psm=self.psm)
+        words = [
+            text
+            for text, conf in zip(data["text"], data["conf"])
+            if text.strip() and float(conf) >= 30
+        ]
+        lang, scores = choose_language(words, candidates)
+
+        return lang or self.lang, {
+            "lang": lang or self.lang,
+            "method": "ocr" if lang else "ambiguous",
+            "scores": scores,
+            "detect_seconds": round(time.perf_counter() - start, 3),
+        }
+
+    def language_saving(self, language, ocr_seconds):
+        """
+        Estimated seconds saved on a page by OCR with fewer language models,
+        taking Tesseract time as proportional to the number of models, minus
+        the detection pass (negative when detection did not pay off)
+        """
+        ratio = len(self.lang.split("+")) / len(language["lang"].split("+"))
+        return round(ocr_seconds * (ratio - 1) - language["detect_seconds"], 3)
+
+    def language_summary(self, ocr_data, lang_hint=None):
+        """Per-page language choice and the detection cost and estimated saving for the document"""
+        detected = [page["language"] for page in ocr_data if page.get("language")]
+        return {
+            "candidates": self.lang,
+            "text_hint": lang_hint,
+            "pages": [
+                {
+                    "page": page["page"],
+                    "lang": page["language"]["lang"],
+                    "method": page["language"]["method"],
+                }
+                for page in ocr_data
+                if page.get("language")
+            ],
+            "detect_seconds": round(
+                sum(info["detect_seconds"] for info in detected), 3
+            ),
+            "estimated_saved_seconds": round(
+                sum(info.get("estimated_saved_seconds", 0.0) for info in detected), 3
+            ),
+        }
+
+    def preprocess_page(self, gray):
+        """Pick a preprocessing profile for a grayscale page and apply it; returns (image, info)"""
+        if self.preprocess_profile == "auto":
+            profile, stats = self.select_preprocess_profile(gray)
+        else:
+            profile, stats = self.preprocess_profile, {}
+
+        start = time.perf_counter()
+        with metrics.timed("preprocess_image"):
+            processed = self.preprocess_image(gray, profile)
+        info = {"profile": profile, "time": round(time.perf_counter() - start, 3)}
+        info.update(stats)
+        return processed, info
+
+    def select_preprocess_profile(self, gray):
+        """
+        Cheap page quality estimate:
+        - noise: mean absolute difference to a 3x3 median blur, on a
+          full-resolution 512 px center patch (downscaling would hide speckle)
+        - mid_tones: share of pixels that are neither ink nor paper, and
+          contrast between paper (median) and ink (darkest 0.2%), from the
+          histogram of a ~600 px wide downscale
+        Clean digital renders get 'none', mildly noisy scans 'light'
+        """
+        h, w = gray.shape
+        patch = gray[
+            max(0, h // 2 - 256) : h // 2 + 256, max(0, w // 2 - 256) : w // 2 + 256
+        ]
+        noise = float(np.mean(cv2.absdiff(patch, cv2.medianBlur(patch, 3))))
+
+        factor = min(1.0, 600.0 / w)
+        small = cv2.resize(
+            gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA
+        )
+        hist = cv2.calcHist([small], [0], None, [256], [0, 256]).ravel()
+        cdf = np.cumsum(hist) / hist.sum()
+        mid_tones = float(cdf[215] - cdf[40])
+        contrast = int(np.searchsorted(cdf, 0.5) - np.searchsorted(cdf, 0.002))
+        sharpness = float(cv2.Laplacian(small, cv2.CV_64F).var())
+
+        if noise < 2.0 and mid_tones < 0.05:
+            profile = "none"
+        elif noise < 8.0 and contrast > 100:
+            profile = "light"
+        else:
+            profile = "full"
+
+        return profile, {
+            "noise": round(noise, 2),
+            "mid_tones": round(mid_tones, 3),
+            "contrast": contrast,
+            "sharpness": round(sharpness, 1),
+        }
+
+    def preprocess_image(self, gray, profile="full"):
+        """Preprocess a grayscale image for better OCR results"""
+        if profile == "none":
+            return gray
+
+        if profile == "light":
+            # Remove speckle, then binarize
+            denoised = cv2.medianBlur(gray, 3)
+            _, binary = cv2.threshold(
+                denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
+            )
+            return binary
+
         # Denoise
         denoised = cv2.fastNlMeansDenoising(gray)
-        
+
         # Increase contrast
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
         enhanced = clahe.apply(denoised)
-        
+
         return enhanced
 
-    def get_line_bbox(self, words):
-        """Calculate bounding box for a line of words"""
-        if not words:
-            return {'x': 0, 'y': 0, 'width': 0, 'height': 0}
-        
-        min_x = min(w['bbox']['x'] for w in words)
-        min_y = min(w['bbox']['y'] for w in words)
-        max_x = max(w['bbox']['x'] + w['bbox']['width'] for w in words)
-        max_y = max(w['bbox']['y'] + w['bbox']['height'] for w in words)
-        
-        return {
-            'x': min_x,
-            'y': min_y,
-            'width': max_x - min_x,
-            'height': max_y - min_y
+    def build_layout_model(self, page_result):
+        """
+        Single pass over a page's lines collecting everything the layout
+        analysis and field extractors need: regions, table rows and
+        candidate supplier/invoice number/date/amount tokens. Lines are
+        referred to by index into the page's LineTable ('lines').
+        """
+        lines = page_result["table"].lines()
+        model = {
+            "page": page_result.get("page", 0),
+            "lines": lines,
+            "regions": {
+                "header_region": None,
+                "line_items_region": None,
+                "totals_region": None,
+            },
+            "table_rows": [],
+            "supplier_lines": [],
+            "invoice_number_tokens": [],
+            "date_tokens": [],
+            "amount_tokens": [],
+            "totals_lines": [],
         }
-
-    def analyze_layout(self, ocr_data):
+        regions = model["regions"]
+
+        model["table_rows"] = self.detect_table_rows(page_result["table"], lines)
+
+        for i, text in enumerate(lines.text):
+            lower = text.lower()
+            has_euro = "€" in text
+
+            # Find key sections by content
+            if "factuur" in lower or "invoice" in lower:
+                regions["header_region"] = {"start_line": i, "bbox": lines.bbox(i)}
+            elif "omschrijving" in lower or "description" in lower:
+                regions["line_items_region"] = {"start_line": i, "bbox": lines.bbox(i)}
+            elif "totaal" in lower and has_euro:
+                regions["totals_region"] = {"start_line": i, "bbox": lines.bbox(i)}
+
+            # Supplier candidates in the header (first 10 lines)
+            if i < 10 and any(
+                suffix in text.upper() for suffix in ["B.V.", "BV", "N.V.", "NV"]
+            ):
+                model["supplier_lines"].append(i)
+
+            if text.startswith("V") and any(c.isdigit() for c in text):
+                match = INVOICE_NUMBER_RE.search(text)
+                if match:
+                    model["invoice_number_tokens"].append(
+                        {"line": i, "text": match.group()}
+                    )
+
+            for match in DATE_RE.finditer(text):
+                model["date_tokens"].append({"line": i, "text": match.group()})
+
+            if has_euro:
+                amounts = [
+                    float(m.group(1).replace(",", "")) for m in AMOUNT_RE.finditer(text)
+                ]
+                for value in amounts:
+                    model["amount_tokens"].append({"line": i, "value": value})
+                # 'Totaal btw' as well as a bare 'Btw 21%' line
+                if ("totaal" in lower or lower.startswith("btw")) and amounts:
+                    model["totals_lines"].append(
+                        {"line": i, "text": lower, "amount": amounts[0]}
+                    )
+
+        return model
+
+    def build_layout_models(self, ocr_data):
+        """Layout model per page"""
+        return [self.build_layout_model(page) for page in ocr_data]
+
+    def analyze_layout(self, ocr_data, layout_models=None, table=None):
         """Analyze document layout to identify sections"""
-        if not ocr_data or not ocr_data[0]['lines']:
+        if not ocr_data or not len(ocr_data[0]["table"]):
             return {}
 
-        lines = ocr_data[0]['lines']  # Assuming single page for now
-        
+        if layout_models is None:
+            layout_models = self.build_layout_models(ocr_data)
+        if table is None:
+            table = self.build_table(layout_models)
+        model = layout_models[0]  # Header and regions come from the first page
+
         layout = {
-            'header_region': None,
-            'supplier_region': None,
-            'invoice_details_region': None,
-            'line_items_region': None,
-            'totals_region': None,
-            'table_structure': None
+            "header_region": model["regions"]["header_region"],
+            "supplier_region": None,
+            "invoice_details_region": None,
+            "line_items_region": model["regions"]["line_items_region"],
+            "totals_region": model["regions"]["totals_region"],
+            "table_structure": self.table_structure(table),
         }
 
-        # Find key sections by content
-        for i, line in enumerate(lines):
-            text = line['text'].lower()
-            
-            if 'factuur' in text or 'invoice' in text:
-                layout['header_region'] = {'start_line': i, 'bbox': line['bbox']}
-            elif 'omschrijving' in text or 'description' in text:
-                layout['line_items_region'] = {'start_line': i, 'bbox': line['bbox']}
-            elif 'totaal' in text and '€' in line['text']:
-                layout['totals_region'] = {'start_line': i, 'bbox': line['bbox']}
+        return layout
+
+    def build_table(self, layout_models):
+        """
+        Line item table stitched across pages: the table rows of every page
+        in page order, as (LineTable, line index) pairs, with columns
+        clustered once over all of them
+        """
+        rows = [
+            (model["lines"], i) for model in layout_models for i in model["table_rows"]
+        ]
+        return {
+            "rows": rows,
+            "pages": [model["page"] for model in layout_models if model["table_rows"]],
+            "columns": self.table_columns(rows),
+        }
 
-        # Analyze table structure
-        layout['table_structure'] = self.detect_table_structure(lines)
+    def table_columns(self, rows):
+        """Column model from the amount and number tokens of table rows (a bare '€' is not an anchor)"""
+        positions = []
+        for lines, i in rows:
+            words = lines.line_words(i)
+            positions.append(words.cols["x"][self.numeric_tokens(words.text)])
+        return cluster_columns(np.concatenate(positions) if positions else [])
 
-        return layout
+    def detect_table_rows(self, words, lines):
+        """
+        Indexes of the table rows among a page's lines: lines with at least
+        two numeric tokens in columns that another such line shares. Columns
+        are clustered over the numeric tokens of every line with two or
+        more of them, so a phone or account number line does not align with
+        the amount columns. A one row table has nothing to align with; there
+        a line needs two currency amounts.
+        """
+        if not len(lines):
+            return []
+
+        numeric = self.numeric_tokens(words.text)
+        token_lines = np.repeat(np.arange(len(lines)), lines.ends - lines.starts)[
+            numeric
+        ]
+        candidates = np.bincount(token_lines, minlength=len(lines))[token_lines] >= 2
+        token_lines = token_lines[candidates]
+        x = words.cols["x"][numeric][candidates]
+
+        columns = cluster_columns(x)
+        if len(columns):
+            token_columns = columns.assign(x)
+            line_columns = np.unique(np.stack([token_lines, token_columns]), axis=1)
+            support = np.bincount(line_columns[1], minlength=len(columns))
+            if support.max() >= 2:
+                aligned = support[token_columns] >= 2
+                return np.flatnonzero(
+                    np.bincount(token_lines[aligned], minlength=len(lines)) >= 2
+                ).tolist()
+
+        euro_words = (np.char.find(words.text, "€") >= 0).astype(np.int32)
+        return np.flatnonzero(np.add.reduceat(euro_words, lines.starts) >= 2).tolist()
+
+    def numeric_tokens(self, text):
+        """Mask of amount ('€10.00', not a bare '€') and number tokens in a word text array"""
+        digits = np.char.isdigit(
+            np.char.replace(np.char.replace(text, ",", ""), ".", "")
+        )
+        return ((np.char.find(text, "€") >= 0) & (text != "€")) | digits
 
-    def detect_table_structure(self, lines):
-        """Detect table structure in the document"""
-        table_info = {
-            'has_table': False,
-            'columns': [],
-            'header_line': None,
-            'data_lines': []
+    def table_structure(self, table):
+        """Table structure for the layout analysis result"""
+        return {
+            "has_table": bool(table["rows"]),
+            "columns": table["columns"].anchors,
+            "header_line": None,
+            "data_lines": [lines.to_line(i) for lines, i in table["rows"]],
+            "pages": table["pages"],
         }
 
-        # Look for lines with multiple currency amounts (indicating table rows)
-        for line in lines:
-            euro_matches = len([w for w in line['words'] if '€' in w['text']])
-            if euro_matches >= 2:
-                table_info['has_table'] = True
-                table_info['data_lines'].append(line)
-
-        # Analyze column positions if table detected
-        if table_info['has_table'] and table_info['data_lines']:
-            # Find consistent x-positions across table rows
-            x_positions = []
-            for line in table_info['data_lines']:
-                for word in line['words']:
-                    if '€' in word['text'] or word['text'].replace(',', '').replace('.', '').isdigit():
-                        x_positions.append(word['bbox']['x'])
-
-            # Cluster x-positions to find columns
-            if x_positions:
-                x_positions.sort()
-                columns = []
-                current_col = x_positions[0]
-                tolerance = 20  # pixels
-
-                for x in x_positions[1:]:
-                    if x - current_col > tolerance:
-                        columns.append(current_col)
-                        current_col = x
-                columns.append(current_col)
-
-                table_info['columns'] = columns
-
-        return table_info
-
-    def extract_invoice_fields(self, ocr_data, extracted_text=None):
+    def detect_table_structure(self, lines):
+        """Detect table structure in line dicts of the API response layout"""
+        words = WordTable.from_words(
+            [word for line in lines for word in line["words"]]
+        ).group_lines()
+        return self.table_structure(
+            self.build_table([self.build_layout_model({"table": words})])
+        )
+
+    def cluster_columns(self, x_positions, tolerance=20):
+        """Cluster x-positions (pixels) into column anchors"""
+        return cluster_columns(x_positions, tolerance).anchors
+
+    def locate_fields(self, layout_models):
+        """
+        Find header fields and totals across pages (in page order) from the
+        layout models. Returns {field: {'value', 'page', 'line', 'confidence'}};
+        the first match wins for header fields, the last for totals.
+        """
+        located = {}
+
+        def locate(field, value, model, line_index):
+            confidence = model["lines"].confidence[line_index] / 100
+            located[field] = {
+                "value": value,
+                "page": model["page"],
+                "line": line_index,
+                "confidence": round(float(confidence), 3),
+            }
+
+        for model in layout_models:
+            lines = model["lines"]
+
+            # Supplier (look in header region)
+            if "supplier_name" not in located and model["supplier_lines"]:
+                i = model["supplier_lines"][0]
+                locate("supplier_name", lines.text[i].strip(), model, i)
+
+            if "invoice_number" not in located and model["invoice_number_tokens"]:
+                token = model["invoice_number_tokens"][0]
+                locate("invoice_number", token["text"], model, token["line"])
+
+            if "invoice_date" not in located and model["date_tokens"]:
+                token = model["date_tokens"][0]
+                locate("invoice_date", token["text"], model, token["line"])
+
+            for total_line in model["totals_lines"]:
+                text = total_line["text"]
+                if "te betalen" in text:
+                    locate(
+                        "total_amount", total_line["amount"], model, total_line["line"]
+                    )
+                elif "btw" in text:
+                    locate(
+                        "vat_amount", total_line["amount"], model, total_line["line"]
+                    )
+                elif "exclusief" in text:
+                    locate("subtotal", total_line["amount"], model, total_line["line"])
+
+        return located
+
+    def extract_invoice_fields(
+        self, ocr_data, extracted_text=None, layout_models=None, table=None
+    ):
         """Extract invoice fields using positional data"""
         fields = {
-            'supplier_name': '',
-            'invoice_number': '',
-            'invoice_date': '',
-            'line_items': [],
-            'totals': {}
+            "supplier_name": "",
+            "invoice_number": "",
+            "invoice_date": "",
+            "line_items": [],
+            "totals": {},
         }
 
-        if not ocr_data or not ocr_data[0]['lines']:
+        if not ocr_data or not len(ocr_data[0]["table"]):
             return fields
 
-        lines = ocr_data[0]['lines']
-
-        # Extract supplier (look in header region)
-        for i, line in enumerate(lines[:10]):  # Check first 10 lines
-            text = line['text']
-            if any(suffix in text.upper() for suffix in ['B.V.', 'BV', 'N.V.', 'NV']):
-                fields['supplier_name'] = text.strip()
-                break
-
-        # Extract invoice number
-        for line in lines:
-            text = line['text']
-            if text.startswith('V') and any(c.isdigit() for c in text):
-                import re
-                match = re.search(r'V\d+', text)
-                if match:
-                    fields['invoice_number'] = match.group()
-                    break
-
-        # Extract date
-        for line in lines:
-            text = line['text']
-            import re
-            date_match = re.search(r'\d{1,2}[-/]\d{1,2}[-/]\d{4}', text)
-            if date_match:
-                fields['invoice_date'] = date_match.group()
-                break
-
-        # Extract line items using table structure
-        table_structure = self.analyze_layout(ocr_data)['table_structure']
-        if table_structure and table_structure['has_table']:
-            fields['line_items'] = self.extract_table_items(table_structure['data_lines'])
-
-        # Extract totals
-        for line in lines:
-            text = line['text']
-            if 'totaal' in text.lower() and '€' in text:
-                import re
-                amount_match = re.search(r'€\s*([\d,]+\.\d{2})', text)
-                if amount_match:
-                    amount = float(amount_match.group(1).replace(',', ''))
-                    if 'te betalen' in text.lower():
-                        fields['totals']['total_amount'] = amount
-                    elif 'btw' in text.lower():
-                        fields['totals']['vat_amount'] = amount
-                    elif 'exclusief' in text.lower():
-                        fields['totals']['subtotal'] = amount
+        if layout_models is None:
+            layout_models = self.build_layout_models(ocr_data)
+
+        located = self.locate_fields(layout_models)
+        for field in ("supplier_name", "invoice_number", "invoice_date"):
+            if field in located:
+                fields[field] = located[field]["value"]
+        for field in ("total_amount", "vat_amount", "subtotal"):
+            if field in located:
+                fields["totals"][field] = located[field]["value"]
+
+        # Extract line items from the table stitched across all pages
+        if table is None:
+            table = self.build_table(layout_models)
+        if table["rows"]:
+            fields["line_items"] = self.extract_table_items(
+                table["rows"], table["columns"]
+            )
 
         return fields
 
-    def extract_table_items(self, table_lines):
-        """Extract line items from table structure"""
+    def extract_table_items(self, table_rows, columns=None):
+        """
+        Extract line items from table rows ((LineTable, line index) pairs).
+        Words are grouped into cells by column, so an amount split into '€'
+        and '10.00' tokens is read as one
+        """
+        if columns is None:
+            columns = self.table_columns(table_rows)
         items = []
-        
-        for line in table_lines:
+
+        for lines, line_index in table_rows:
             # Skip lines that look like totals
-            if any(word in line['text'].lower() for word in ['totaal', 'btw', 'subtotal']):
+            if any(
+                word in lines.text[line_index].lower()
+                for word in ["totaal", "btw", "subtotal"]
+            ):
                 continue
 
             # Extract description and amounts
-            words = line['words']
+            words = lines.line_words(line_index)
+            texts = words.text.tolist()
+            word_columns = columns.assign(words.cols["x"]).tolist()
+            for i in range(len(texts) - 2, -1, -1):
+                if texts[i] == "€":
+                    word_columns[i] = word_columns[
+                        i + 1
+                    ]  # Currency sign belongs to the amount after it
+
+            cells = {}
+            for text, column in zip(texts, word_columns):
+                cells.setdefault(column, []).append(text)
+
             description_words = []
             amounts = []
-
-            for word in words:
-                if '€' in word['text']:
-                    import re
-                    amount_match = re.search(r'€\s*([\d,]+\.\d{2})', word['text'])
-                    if amount_match:
-                        amounts.append(float(amount_match.group(1).replace(',', '')))
-                elif not word['text'].replace(',', '').replace('.', '').isdigit():
-                    description_words.append(word['text'])
+            for column in sorted(cells):
+                texts = cells[column]
+                amounts.extend(
+                    float(m.group(1).replace(",", ""))
+                    for m in AMOUNT_RE.finditer(" ".join(texts))
+                )
+                description_words.extend(
+                    text
+                    for text in texts
+                    if "€" not in text
+                    and not text.replace(",", "").replace(".", "").isdigit()
+                )
 
             if description_words and amounts:
-                description = ' '.join(description_words).strip()
+                description = " ".join(description_words).strip()
                 if len(description) > 3:  # Minimum description length
                     item = {
-                        'description': description,
-                        'quantity': 1,
-                        'amount': amounts[-1] if amounts else 0  # Use last amount as total
+                        "description": description,
+                        "quantity": 1,
+                        "amount": (
+                            amounts[-1] if amounts else 0
+                        ),  # Use last amount as total
                     }
-                    
+
                     if len(amounts) > 1:
-                        item['unit_price'] = amounts[0]
-                        item['total'] = amounts[-1]
-                    
+                        item["unit_price"] = amounts[0]
+                        item["total"] = amounts[-1]
+
                     items.append(item)
 
         return items
@@ -337,10 +1601,10 @@ class HybridInvoiceProcessor:
     def validate_with_extracted_text(self, ocr_fields, extracted_text):
         """Validate OCR results against pre-extracted text"""
         validation = {
-            'supplier_match': False,
-            'invoice_number_match': False,
-            'amounts_match': False,
-            'text_coverage': 0.0
+            "supplier_match": False,
+            "invoice_number_match": False,
+            "amounts_match": False,
+            "text_coverage": 0.0,
         }
 
         if not extracted_text:
@@ -349,47 +1613,53 @@ class HybridInvoiceProcessor:
         extracted_lower = extracted_text.lower()
 
         # Check supplier name
-        if ocr_fields['supplier_name']:
-            supplier_lower = ocr_fields['supplier_name'].lower()
-            validation['supplier_match'] = supplier_lower in extracted_lower
+        if ocr_fields["supplier_name"]:
+            supplier_lower = ocr_fields["supplier_name"].lower()
+            validation["supplier_match"] = supplier_lower in extracted_lower
 
         # Check invoice number
-        if ocr_fields['invoice_number']:
-            validation['invoice_number_match'] = ocr_fields['invoice_number'] in extracted_text
+        if ocr_fields["invoice_number"]:
+            validation["invoice_number_match"] = (
+                ocr_fields["invoice_number"] in extracted_text
+            )
 
         # Check amounts
-        if ocr_fields['totals'].get('total_amount'):
-            amount_str = str(ocr_fields['totals']['total_amount'])
-            validation['amounts_match'] = amount_str.replace('.', ',') in extracted_text or amount_str in extracted_text
+        if ocr_fields["totals"].get("total_amount"):
+            amount_str = str(ocr_fields["totals"]["total_amount"])
+            validation["amounts_match"] = (
+                amount_str.replace(".", ",") in extracted_text
+                or amount_str in extracted_text
+            )
 
         # Calculate text coverage
         ocr_words = set()
-        for item in ocr_fields['line_items']:
-            ocr_words.update(item['description'].lower().split())
-        
+        for item in ocr_fields["line_items"]:
+            ocr_words.update(item["description"].lower().split())
+
         extracted_words = set(extracted_text.lower().split())
         if extracted_words:
             common_words = ocr_words.intersection(extracted_words)
-            validation['text_coverage'] = len(common_words) / len(extracted_words)
+            validation["text_coverage"] = len(common_words) / len(extracted_words)
 
         return validation
 
     def calculate_confidence_scores(self, results):
         """Calculate overall confidence scores"""
         scores = {
-            'ocr_confidence': 0.0,
-            'text_validation_score': 0.0,
-            'layout_confidence': 0.0,
-            'overall_confidence': 0.0
+            "ocr_confidence": 0.0,
+            "text_validation_score": 0.0,
+            "layout_confidence": 0.0,
+            "overall_confidence": 0.0,
         }
 
         # OCR confidence (average word confidence)
-        if results['ocr_data'] and results['ocr_data'][0]['words']:
-            word_confidences = [w['confidence'] for w in results['ocr_data'][0]['words']]
-            scores['ocr_confidence'] = sum(word_confidences) / len(word_confidences) / 100
+        if results["ocr_data"] and len(results["ocr_data"][0]["table"]):
+            scores["ocr_confidence"] = (
+                float(results["ocr_data"][0]["table"].cols["confidence"].mean()) / 100
+            )
 
         # Text validation score
-        validation = results['text_validation']
+        validation = results["text_validation"]
         validation_score = 0
         validation_count = 0
 
@@ -397,43 +1667,307 @@ class HybridInvoiceProcessor:
             if isinstance(value, bool):
                 validation_score += 1 if value else 0
                 validation_count += 1
-            elif key == 'text_coverage':
+            elif key == "text_coverage":
                 validation_score += value
                 validation_count += 1
 
         if validation_count > 0:
-            scores['text_validation_score'] = validation_score / validation_count
+            scores["text_validation_score"] = validation_score / validation_count
 
         # Layout confidence
-        layout = results['layout_analysis']
+        layout = results["layout_analysis"]
         layout_score = 0
-        if layout.get('table_structure', {}).get('has_table'):
+        if layout.get("table_structure", {}).get("has_table"):
             layout_score += 0.3
-        if layout.get('header_region'):
+        if layout.get("header_region"):
             layout_score += 0.2
-        if layout.get('totals_region'):
+        if layout.get("totals_region"):
             layout_score += 0.3
-        if layout.get('line_items_region'):
+        if layout.get("line_items_region"):
             layout_score += 0.2
 
-        scores['layout_confidence'] = layout_score
+        scores["layout_confidence"] = layout_score
 
         # Overall confidence (weighted average)
-        scores['overall_confidence'] = (
-            scores['ocr_confidence'] * 0.4 +
-            scores['text_validation_score'] * 0.4 +
-            scores['layout_confidence'] * 0.2
+        scores["overall_confidence"] = (
+            scores["ocr_confidence"] * 0.4
+            + scores["text_validation_score"] * 0.4
+            + scores["layout_confidence"] * 0.2
         )
 
         return scores
 
 
-@app.route('/health', methods=['GET'])
+def warm_up():
+    """
+    OCR a small synthetic invoice page through the raster pipeline, loading
+    libraries, Tesseract language data and the engine handle of this
+    thread. Never raises; returns (seconds, error or None).
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        doc = fitz.open()
+        page = doc.new_page(width=300, height=200)
+        for i, line in enumerate(
+            ("Warmup B.V.", "Factuur 01-01-2024", "Totaal te betalen € 1.00")
+        ):
+            page.insert_text((20, 40 + 25 * i), line, fontsize=11)
+
+        processor = HybridInvoiceProcessor(
+            execution_mode="sequential", use_text_layer=False, lazy=False
+        )
+        processor.use_templates = False
+        error = processor.process_pdf(doc.tobytes()).get("error")
+        doc.close()
+    except Exception as e:
+        error = str(e)
+
+    seconds = time.perf_counter() - start
+    metrics.observe_stage("warmup", seconds)
+    return seconds, error
+
+
+@app.errorhandler(413)
+def request_too_large(error):
+    """JSON instead of the default HTML page for bodies over MAX_CONTENT_LENGTH"""
+    return jsonify({"error": f"Request larger than {OCR_BATCH_MAX_MB + 1} MB"}), 413
+
+
+@app.route("/health", methods=["GET"])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'service': 'hybrid-invoice-ocr'})
+    return jsonify({"status": "healthy", "service": "hybrid-invoice-ocr"})
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Result cache hit/miss counters for this worker"""
+    if result_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, "pid": os.getpid(), **result_cache.get_stats()})
+
+
+@app.route("/templates/stats", methods=["GET"])
+def template_stats():
+    """Supplier template hit/miss counters for this worker"""
+    if template_store is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, "pid": os.getpid(), **template_store.get_stats()})
+
+
+def erpnext_access_error():
+    """Error response for the ERPNext data endpoints, or None when the request may proceed"""
+    if reference_index is None:
+        return jsonify({"error": "ERPNext index is not configured (ERPNEXT_URL)"}), 404
+    if not ERPNEXT_MATCH_TOKEN:
+        return (
+            jsonify(
+                {
+                    "error": "ERPNext endpoints are disabled until ERPNEXT_MATCH_TOKEN is set"
+                }
+            ),
+            403,
+        )
+    token = request.headers.get("X-OCR-Token", "")
+    if not hmac.compare_digest(
+        token.encode("utf-8"), ERPNEXT_MATCH_TOKEN.encode("utf-8")
+    ):
+        return jsonify({"error": "Missing or invalid X-OCR-Token header"}), 401
+    return None
+
+
+@app.route("/erpnext/match", methods=["POST"])
+def erpnext_match():
+    """
+    Match an invoice against ERPNext suppliers and items
+    Expects: X-OCR-Token header; JSON with supplier_name, optional tax_id and
+    items (descriptions), or the extracted_fields of an OCR result
+    Returns: best match (or null) and scored candidates for the supplier and each item
+    """
+    error = erpnext_access_error()
+    if error is not None:
+        return error
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    fields = body.get("extracted_fields", body)
+    if not isinstance(fields, dict):
+        return jsonify({"error": "extracted_fields must be an object"}), 400
+
+    descriptions = body.get("items")
+    if descriptions is None:
+        line_items = fields.get("line_items") or []
+        if not isinstance(line_items, list):
+            return jsonify({"error": "line_items must be a list"}), 400
+        descriptions = [
+            item.get("description") or ""
+            for item in line_items
+            if isinstance(item, dict)
+        ]
+    if not isinstance(descriptions, list):
+        return jsonify({"error": "items must be a list of descriptions"}), 400
+
+    try:
+        limit = int(body.get("limit", 3))
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit must be an integer"}), 400
+    limit = max(1, min(limit, ERPNEXT_MATCH_MAX_LIMIT))
+
+    tax_id = fields.get("tax_id")
+    return jsonify(
+        {
+            "supplier": reference_index.match_supplier(
+                str(fields.get("supplier_name") or ""),
+                None if tax_id is None else str(tax_id),
+                limit,
+            ),
+            "items": reference_index.match_items([str(d) for d in descriptions], limit),
+        }
+    )
+
+
+@app.route("/erpnext/context", methods=["GET"])
+def erpnext_context():
+    """
+    Cached ERPNext reference lists (suppliers, companies, currencies, tax
+    templates, ?items=N items); expects the X-OCR-Token header
+    """
+    error = erpnext_access_error()
+    if error is not None:
+        return error
+    max_items = request.args.get("items", 30, type=int)
+    return jsonify(reference_index.context(max_items=max(0, max_items)))
+
+
+@app.route("/erpnext/index/stats", methods=["GET"])
+def erpnext_index_stats():
+    """Record counts, sync age and lookup counters of the ERPNext index"""
+    if reference_index is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, "pid": os.getpid(), **reference_index.get_stats()})
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus exposition of stage latencies, pages, uploads, cache lookups and queue depth"""
+    if not metrics.enabled():
+        return jsonify({"error": "prometheus_client is not installed"}), 404
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+def json_response(payload, cache_status, options=None):
+    """Return pre-serialized JSON with the cache status header, shaped by the response options"""
+    if options is None:
+        response = Response(payload, mimetype="application/json")
+    else:
+        body, content_type, headers = response_format.render(payload, options)
+        response = Response(body, mimetype=content_type)
+        response.headers.update(headers)
+    response.headers["X-OCR-Cache"] = cache_status
+    return response
+
+
+def response_options():
+    """Response options of this request (?fields=, ?detail=, ?format=, Accept-Encoding)"""
+    return response_format.parse_options(
+        request.values, request.headers.get("Accept-Encoding", "")
+    )
+
+
+def processor_from_request():
+    """Processor with per-request overrides (?preprocess=none for benchmarking, ?lazy=1, ?lazy_order=)"""
+    return processor_from_values(request.values)
+
 
-@app.route('/process-invoice', methods=['POST'])
+def processor_from_values(values):
+    """Processor from a mapping of query/form values"""
+    lazy = values.get("lazy")
+    return HybridInvoiceProcessor(
+        preprocess_profile=values.get("preprocess"),
+        lazy=None if lazy is None else lazy == "1",
+        lazy_order=values.get("lazy_order"),
+    )
+
+
+def upload_pdf(upload):
+    """
+    PDF of an uploaded file: its bytes when the upload was kept in memory,
+    otherwise the path of its temporary file, valid until the request ends
+    """
+    stream = upload.stream
+    if isinstance(stream, io.BytesIO):
+        return stream.getvalue()
+    if isinstance(getattr(stream, "name", None), str):
+        stream.flush()
+        return stream.name
+    return upload.read()
+
+
+def pdf_size(pdf):
+    """Size in bytes of a PDF given as bytes or a file path"""
+    return len(pdf) if is_pdf_bytes(pdf) else os.path.getsize(pdf)
+
+
+def spool_to_file(stream):
+    """Copy a file-like upload in chunks to a named temporary file, removed when closed"""
+    tmp_file = tempfile.NamedTemporaryFile(suffix=".pdf", dir=OCR_TEMP_DIR)
+    shutil.copyfileobj(stream, tmp_file, 1024 * 1024)
+    tmp_file.flush()
+    return tmp_file
+
+
+def get_cached_result(processor, pdf, extracted_text):
+    """Look up a result for a PDF (bytes or path) in the cache, returning (payload, cache_status, cache_key)"""
+    if result_cache is None:
+        return None, "disabled", None
+    cache_key = make_cache_key(pdf, processor.cache_params(extracted_text))
+    payload, tier = result_cache.get(cache_key)
+    cache_status = "miss" if payload is None else f"hit-{tier}"
+    metrics.count_cache_lookup(cache_status)
+    return payload, cache_status, cache_key
+
+
+def serialize_invoice(processor, pdf, extracted_text):
+    """Process an uploaded PDF (bytes or path); returns (serialized result, whether it succeeded)"""
+    results = processor.process_pdf(pdf, extracted_text)
+    return app.json.dumps(results).encode("utf-8"), "error" not in results
+
+
+def run_invoice(processor, pdf, extracted_text, cache_key=None):
+    """Process an uploaded PDF (bytes or path); returns (serialized result, whether it succeeded)"""
+    if invoice_pool is not None:
+        payload, ok = invoice_pool.submit(
+            serialize_invoice, processor, pdf, extracted_text
+        ).result()
+    else:
+        payload, ok = serialize_invoice(processor, pdf, extracted_text)
+    if cache_key and ok:
+        result_cache.put(cache_key, payload)
+    return payload, ok
+
+
+def run_job(processor, pdf, extracted_text, cache_key=None):
+    """Job queue entry point: the serialized result of run_invoice"""
+    return run_invoice(processor, pdf, extracted_text, cache_key)[0]
+
+
+def run_profiled(processor, pdf, extracted_text, dump_pstats=False):
+    """
+    Process an uploaded PDF with a per-stage time/memory breakdown added as
+    'profile'. Pages run in this process so every stage is measured, and the
+    cache is bypassed in both directions.
+    """
+    processor.execution_mode = "sequential"
+    with RequestProfile(OCR_PROFILE_DIR if dump_pstats else None) as profile:
+        results = processor.process_pdf(pdf, extracted_text)
+    results["profile"] = profile.report()
+    return app.json.dumps(results).encode("utf-8")
+
+
+@app.route("/process-invoice", methods=["POST"])
 def process_invoice():
     """
     Main endpoint for processing invoices
@@ -442,35 +1976,247 @@ def process_invoice():
     """
     try:
         # Check if PDF file is provided
-        if 'pdf_file' not in request.files:
-            return jsonify({'error': 'No PDF file provided'}), 400
-
-        pdf_file = request.files['pdf_file']
-        extracted_text = request.form.get('extracted_text', '')
+        if "pdf_file" not in request.files:
+            return jsonify({"error": "No PDF file provided"}), 400
 
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf', dir='/app/temp') as tmp_file:
-            pdf_file.save(tmp_file.name)
-            tmp_pdf_path = tmp_file.name
+        # Bytes, or the path of the spooled upload for large requests
+        pdf = upload_pdf(request.files["pdf_file"])
+        extracted_text = request.form.get("extracted_text", "")
+        metrics.count_upload("process-invoice", pdf_size(pdf))
 
         try:
-            # Process the PDF
-            processor = HybridInvoiceProcessor()
-            results = processor.process_pdf(tmp_pdf_path, extracted_text)
+            processor = processor_from_request()
+            options = response_options()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if request.values.get("profile") == "1":
+            payload = run_profiled(
+                processor, pdf, extracted_text, request.values.get("pstats") == "1"
+            )
+            return json_response(payload, "bypass", options)
+
+        # Repeat submissions of the same PDF are served from the cache
+        payload, cache_status, cache_key = get_cached_result(
+            processor, pdf, extracted_text
+        )
+        if payload is None:
+            payload, _ = run_invoice(processor, pdf, extracted_text, cache_key)
 
-            # Clean up temporary file
-            os.unlink(tmp_pdf_path)
+        return json_response(payload, cache_status, options)
 
-            return jsonify(results)
+    except Exception as e:
+        return jsonify({"error": f"Processing failed: {str(e)}"}), 500
 
-        except Exception as e:
-            # Clean up temporary file on error
-            if os.path.exists(tmp_pdf_path):
-                os.unlink(tmp_pdf_path)
-            raise e
 
-    except Exception as e:
-        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+def upload_size(upload):
+    """Size of an uploaded part without reading it: its declared length, else that of its spooled stream"""
+    if upload.content_length:
+        return upload.content_length
+    stream = upload.stream
+    position = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(position)
+    return size
+
+
+def read_batch_uploads():
+    """
+    Collect (filename, pdf_bytes) from a batch request: any number of
+    pdf_files parts and/or zip archives (archive parts or .zip uploads).
+    Sizes are checked before a part is read or an archive member inflated.
+    """
+    uploads = []
+    max_bytes = OCR_BATCH_MAX_MB * 1024 * 1024
+    total_bytes = 0
+
+    for field in ("pdf_files", "pdf_file", "archive"):
+        for upload in request.files.getlist(field):
+            size = upload_size(upload)
+            metrics.count_upload("process-invoices", size)
+            filename = upload.filename or f"upload-{len(uploads)}.pdf"
+
+            if field == "archive" or filename.lower().endswith(".zip"):
+                with zipfile.ZipFile(upload.stream) as archive:
+                    for info in archive.infolist():
+                        name = info.filename
+                        if (
+                            info.is_dir()
+                            or not name.lower().endswith(".pdf")
+                            or name.startswith("__MACOSX/")
+                        ):
+                            continue
+                        # Check the declared size before inflating anything
+                        total_bytes += info.file_size
+                        if (
+                            total_bytes > max_bytes
+                            or len(uploads) >= OCR_BATCH_MAX_FILES
+                        ):
+                            raise ValueError("Batch too large")
+                        uploads.append((name, archive.read(info)))
+            else:
+                total_bytes += size
+                if total_bytes > max_bytes or len(uploads) >= OCR_BATCH_MAX_FILES:
+                    raise ValueError("Batch too large")
+                uploads.append((filename, upload.read()))
+
+    return uploads
+
+
+def process_batch_item(processor, pdf_bytes):
+    """
+    Process one batch file, returning (payload, cache_status, ok); ok is
+    False when the result carries an error (only successes are cached)
+    """
+    payload, cache_status, cache_key = get_cached_result(processor, pdf_bytes, "")
+    if payload is not None:
+        return payload, cache_status, True
+    payload, ok = run_invoice(processor, pdf_bytes, "", cache_key)
+    return payload, cache_status, ok
+
+
+@app.route("/process-invoices", methods=["POST"])
+def process_invoices():
+    """
+    Batch endpoint: many PDFs (pdf_files parts) or a zip archive in one request
+    Returns: NDJSON stream, one line per invoice in completion order,
+    followed by a summary line
+    """
+    try:
+        processor = processor_from_request()
+        uploads = read_batch_uploads()
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({"error": str(e)}), 400
+    if not uploads:
+        return jsonify({"error": "No PDF files provided"}), 400
+
+    def generate():
+        start = time.perf_counter()
+        failed = 0
+        futures = {
+            batch_pool.submit(process_batch_item, processor, pdf_bytes): (
+                index,
+                filename,
+            )
+            for index, (filename, pdf_bytes) in enumerate(uploads)
+        }
+
+        for future in as_completed(futures):
+            index, filename = futures[future]
+            header = {"index": index, "filename": filename}
+            try:
+                payload, cache_status, ok = future.result()
+            except Exception as e:
+                failed += 1
+                yield app.json.dumps(
+                    {**header, "error": f"Processing failed: {str(e)}"}
+                ) + "\n"
+                continue
+            failed += not ok
+
+            # Splice the pre-serialized result in instead of re-encoding it
+            header["cache"] = cache_status
+            yield app.json.dumps(header)[:-1] + ',"result":' + payload.decode(
+                "utf-8"
+            ) + "}\n"
+
+        yield app.json.dumps(
+            {
+                "summary": {
+                    "files": len(uploads),
+                    "failed": failed,
+                    "elapsed": round(time.perf_counter() - start, 3),
+                }
+            }
+        ) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+def job_links(job_id):
+    return {"status_url": f"/jobs/{job_id}", "result_url": f"/jobs/{job_id}/result"}
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Queue an invoice for background processing
+    Expects: same form fields as /process-invoice
+    Returns: 202 with job id and polling URLs, or 429 when the queue is full
+    """
+    if "pdf_file" not in request.files:
+        return jsonify({"error": "No PDF file provided"}), 400
+
+    pdf_bytes = request.files["pdf_file"].read()
+    metrics.count_upload("jobs", len(pdf_bytes))
+    extracted_text = request.form.get("extracted_text", "")
+    try:
+        processor = processor_from_request()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    payload, cache_status, cache_key = get_cached_result(
+        processor, pdf_bytes, extracted_text
+    )
+    if payload is not None:
+        job_id = job_queue.complete(payload)
+        status = "done"
+    else:
+        try:
+            job_id = job_queue.submit(
+                run_job, processor, pdf_bytes, extracted_text, cache_key
+            )
+        except QueueFullError as e:
+            response = jsonify({"error": str(e), "retry_after": e.retry_after})
+            response.status_code = 429
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response
+        status = "queued"
+
+    response = jsonify({"job_id": job_id, "status": status, **job_links(job_id)})
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job_id}"
+    response.headers["X-OCR-Cache"] = cache_status
+    return response
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Status of a queued job"""
+    status = job_queue.get_status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    response = jsonify({**status, **job_links(job_id)})
+    if status["status"] in ("queued", "running"):
+        response.headers["Retry-After"] = str(job_queue.retry_after())
+    return response
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    """Result of a finished job; 202 while it is still pending"""
+    status = job_queue.get_status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if status["status"] == "failed":
+        return jsonify({"error": f"Processing failed: {status.get('error', '')}"}), 500
+    if status["status"] != "done":
+        response = jsonify(status)
+        response.status_code = 202
+        response.headers["Retry-After"] = str(job_queue.retry_after())
+        return response
+
+    try:
+        options = response_options()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    payload = job_queue.get_result(job_id)
+    if payload is None:
+        return jsonify({"error": "Result expired"}), 410
+    return json_response(payload, "job", options)
+
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=False)
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=8080, debug=False)
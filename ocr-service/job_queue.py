@@ -0,0 +1,290 @@
+"""
+Bounded background job queue for the OCR service
+Job state is kept on disk so any gunicorn worker can answer status requests
+"""
+
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue cannot accept more work"""
+
+    def __init__(self, retry_after):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """
+    Fixed pool of worker threads fed by a bounded queue.
+
+    Jobs are callables returning serialized JSON bytes. Status records and
+    results are written to jobs_dir as <id>.json and <id>.result.json.
+    on_depth_change(depth) is called whenever jobs are queued, start or finish.
+
+    Queued jobs live in the memory of the worker process that accepted them.
+    Each process holds an flock on jobs_dir/owners/<token>.lock and records
+    its token in the jobs it accepts; a queued or running job whose owner's
+    lock is free belongs to a process that exited (a restart or a crash) and
+    is marked failed, by a sweep on startup and whenever its status is read.
+    """
+
+    STALE_ERROR = "The worker processing this job exited; submit it again"
+
+    def __init__(
+        self, jobs_dir, workers, max_queue, result_ttl=24 * 3600, on_depth_change=None
+    ):
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self.on_depth_change = on_depth_change
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._running = 0
+        self._avg_seconds = None  # Moving average of job duration
+        self._last_cleanup = 0.0
+        self._owner = None
+        self._owner_pid = None
+        self._owner_file = None
+
+        os.makedirs(os.path.join(self.jobs_dir, "owners"), exist_ok=True)
+        self.recover()
+
+    def submit(self, func, *args):
+        """Queue func(*args) and return the new job id, or raise QueueFullError"""
+        self._start_workers()
+
+        job_id = uuid.uuid4().hex
+        self._write_status(
+            job_id,
+            {
+                "job_id": job_id,
+                "status": "queued",
+                "submitted_at": time.time(),
+                "owner": self._owner_token(),
+            },
+        )
+
+        try:
+            self._queue.put_nowait((job_id, func, args))
+        except queue.Full:
+            self._remove(job_id)
+            raise QueueFullError(self.retry_after())
+
+        self._depth_changed()
+        self._cleanup_expired()
+        return job_id
+
+    def complete(self, payload):
+        """Record an already finished job (e.g. a cache hit) without queueing it"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._write_result(job_id, payload)
+        self._write_status(
+            job_id,
+            {
+                "job_id": job_id,
+                "status": "done",
+                "submitted_at": now,
+                "started_at": now,
+                "finished_at": now,
+            },
+        )
+        return job_id
+
+    def get_status(self, job_id):
+        """Status record for a job, or None if unknown"""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id, "json"), encoding="utf-8") as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return self._fail_if_stale(job_id, status)
+
+    def recover(self):
+        """
+        Mark queued and running jobs of exited worker processes as failed and
+        remove the lock files those processes left behind
+        """
+        for entry in os.scandir(self.jobs_dir):
+            job_id, _, suffix = entry.name.partition(".")
+            if suffix == "json" and job_id.isalnum():
+                self.get_status(job_id)
+
+        owners_dir = os.path.join(self.jobs_dir, "owners")
+        for entry in os.scandir(owners_dir):
+            owner, _, suffix = entry.name.partition(".")
+            if suffix == "lock" and not self._owner_alive(owner):
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+
+    def get_result(self, job_id):
+        """Serialized result of a finished job, or None"""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id, "result.json"), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def depth(self):
+        """Jobs waiting plus jobs running in this worker"""
+        with self._lock:
+            return self._queue.qsize() + self._running
+
+    def retry_after(self):
+        """Seconds a client should wait before submitting or polling again"""
+        with self._lock:
+            avg = self._avg_seconds or 5.0
+            backlog = self._queue.qsize() + self._running
+        return max(1, int(avg * backlog / max(self.workers, 1)))
+
+    def _start_workers(self):
+        # Started lazily so threads are created after gunicorn forks the worker
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f"ocr-job-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            job_id, func, args = self._queue.get()
+            with self._lock:
+                self._running += 1
+            self._depth_changed()
+
+            status = self.get_status(job_id) or {"job_id": job_id}
+            status.update({"status": "running", "started_at": time.time()})
+            self._write_status(job_id, status)
+
+            try:
+                payload = func(*args)
+                self._write_result(job_id, payload)
+                status["status"] = "done"
+            except Exception as e:
+                status.update({"status": "failed", "error": str(e)})
+
+            status["finished_at"] = time.time()
+            self._write_status(job_id, status)
+
+            with self._lock:
+                self._running -= 1
+                duration = status["finished_at"] - status["started_at"]
+                self._avg_seconds = (
+                    duration
+                    if self._avg_seconds is None
+                    else 0.8 * self._avg_seconds + 0.2 * duration
+                )
+            self._queue.task_done()
+            self._depth_changed()
+
+    def _owner_token(self):
+        """
+        Token of this process, created after a fork: a lock file created
+        under a temporary name, locked, then renamed into place, so a
+        sweep never sees it unlocked
+        """
+        with self._lock:
+            if self._owner_pid != os.getpid():
+                owner = uuid.uuid4().hex
+                tmp_path = self._owner_path(owner) + ".tmp"
+                lock_file = open(tmp_path, "w")
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.rename(tmp_path, self._owner_path(owner))
+                self._owner, self._owner_pid, self._owner_file = (
+                    owner,
+                    os.getpid(),
+                    lock_file,
+                )
+            return self._owner
+
+    def _owner_alive(self, owner):
+        """Whether the process with this token still holds its lock"""
+        if not owner:
+            return False
+        if owner == self._owner and self._owner_pid == os.getpid():
+            return True
+        try:
+            with open(self._owner_path(owner)) as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    def _fail_if_stale(self, job_id, status):
+        if status.get("status") not in ("queued", "running") or self._owner_alive(
+            status.get("owner")
+        ):
+            return status
+        status.update(
+            {"status": "failed", "error": self.STALE_ERROR, "finished_at": time.time()}
+        )
+        self._write_status(job_id, status)
+        return status
+
+    def _owner_path(self, owner):
+        return os.path.join(self.jobs_dir, "owners", f"{owner}.lock")
+
+    def _depth_changed(self):
+        if self.on_depth_change is not None:
+            self.on_depth_change(self.depth())
+
+    def _path(self, job_id, suffix):
+        return os.path.join(self.jobs_dir, f"{job_id}.{suffix}")
+
+    def _write_status(self, job_id, status):
+        self._write_atomic(
+            self._path(job_id, "json"), json.dumps(status).encode("utf-8")
+        )
+
+    def _write_result(self, job_id, payload):
+        self._write_atomic(self._path(job_id, "result.json"), payload)
+
+    def _write_atomic(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _remove(self, job_id):
+        for suffix in ("json", "result.json"):
+            try:
+                os.unlink(self._path(job_id, suffix))
+            except OSError:
+                pass
+
+    def _cleanup_expired(self):
+        """Drop job records and results older than result_ttl, at most once a minute"""
+        now = time.time()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+
+        cutoff = now - self.result_ttl
+        for entry in os.scandir(self.jobs_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
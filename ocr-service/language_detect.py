@@ -0,0 +1,190 @@
+"""
+Cheap language detection for invoice pages
+Counts frequent function words and invoice vocabulary per language in a
+page's text, so Tesseract can run with one language model instead of a
+combined one such as nld+eng.
+"""
+
+import re
+
+# Tesseract language code -> frequent words on invoices in that language
+STOPWORDS = {
+    "nld": frozenset(
+        (
+            "de",
+            "het",
+            "een",
+            "en",
+            "van",
+            "voor",
+            "met",
+            "op",
+            "te",
+            "is",
+            "aan",
+            "bij",
+            "uw",
+            "wij",
+            "naar",
+            "factuur",
+            "factuurnummer",
+            "factuurdatum",
+            "datum",
+            "totaal",
+            "btw",
+            "bedrag",
+            "omschrijving",
+            "aantal",
+            "prijs",
+            "betalen",
+            "vervaldatum",
+            "klant",
+            "klantnummer",
+            "exclusief",
+            "inclusief",
+            "excl",
+            "incl",
+            "betaling",
+            "termijn",
+            "dagen",
+            "stuks",
+            "pagina",
+            "rekening",
+            "periode",
+        )
+    ),
+    "eng": frozenset(
+        (
+            "the",
+            "and",
+            "of",
+            "for",
+            "to",
+            "with",
+            "on",
+            "is",
+            "your",
+            "we",
+            "by",
+            "from",
+            "please",
+            "this",
+            "invoice",
+            "date",
+            "total",
+            "vat",
+            "amount",
+            "description",
+            "quantity",
+            "qty",
+            "price",
+            "due",
+            "customer",
+            "number",
+            "payment",
+            "subtotal",
+            "tax",
+            "terms",
+            "days",
+            "page",
+            "account",
+            "period",
+        )
+    ),
+    "deu": frozenset(
+        (
+            "der",
+            "die",
+            "das",
+            "und",
+            "von",
+            "für",
+            "mit",
+            "auf",
+            "zu",
+            "ist",
+            "ihre",
+            "wir",
+            "bitte",
+            "rechnung",
+            "rechnungsnummer",
+            "rechnungsdatum",
+            "datum",
+            "gesamt",
+            "summe",
+            "mwst",
+            "betrag",
+            "beschreibung",
+            "menge",
+            "preis",
+            "kunde",
+            "kundennummer",
+            "zahlung",
+            "netto",
+            "brutto",
+            "seite",
+        )
+    ),
+    "fra": frozenset(
+        (
+            "le",
+            "la",
+            "les",
+            "et",
+            "de",
+            "du",
+            "des",
+            "pour",
+            "avec",
+            "sur",
+            "est",
+            "votre",
+            "nous",
+            "facture",
+            "numéro",
+            "date",
+            "total",
+            "tva",
+            "montant",
+            "désignation",
+            "quantité",
+            "prix",
+            "client",
+            "paiement",
+            "échéance",
+            "ht",
+            "ttc",
+            "page",
+        )
+    ),
+}
+
+WORD_RE = re.compile(r"[a-zà-ÿ]+")
+
+
+def language_scores(words, candidates):
+    """Hits per candidate language with a word list, over lowercase word tokens"""
+    tokens = [token for word in words for token in WORD_RE.findall(word.lower())]
+    return {
+        lang: sum(token in STOPWORDS[lang] for token in tokens)
+        for lang in candidates
+        if lang in STOPWORDS
+    }
+
+
+def choose_language(words, candidates, min_hits=3, min_ratio=2.0):
+    """
+    Single best language among the candidates, or None when the evidence is
+    ambiguous: too few hits, a runner-up within min_ratio, or a candidate
+    without a word list. Returns (language or None, scores).
+    """
+    scores = language_scores(words, candidates)
+    if len(scores) < len(candidates) or not scores:
+        return None, scores
+
+    ranked = sorted(scores.items(), key=lambda item: -item[1])
+    best, best_hits = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    if best_hits < min_hits or best_hits < min_ratio * runner_up:
+        return None, scores
+    return best, scores
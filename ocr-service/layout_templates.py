@@ -0,0 +1,144 @@
+"""
+Supplier layout templates for the OCR service
+Remembers where each supplier's fields are printed so repeat invoices only
+need OCR of those regions
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+
+
+def layout_fingerprint(words, width, height, header_fraction=0.2, grid=(20, 40)):
+    """
+    Fingerprint of a page header (words is a WordTable): the set of
+    alphabetic header words with their position quantized to a grid of the
+    page size, so it is independent of DPI and tolerant to small shifts
+    """
+    tokens = set()
+    cx, cy = words.centers()
+    for text, cx, cy in zip(
+        words.text.tolist(), (cx / width).tolist(), (cy / height).tolist()
+    ):
+        text = text.lower().strip(".,:;")
+        if cy >= header_fraction or len(text) < 2 or not text.isalpha():
+            continue
+        tokens.add(f"{text}@{int(cx * grid[0])},{int(cy * grid[1])}")
+    return sorted(tokens)
+
+
+def fingerprint_similarity(a, b):
+    """Jaccard similarity of two fingerprints"""
+    a, b = set(a), set(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class TemplateStore:
+    """
+    Templates keyed by supplier name, persisted as one JSON file shared by
+    all gunicorn workers (flock around read-modify-write). Each template
+    holds the header fingerprint, the page count and the vertical bands
+    (normalized 0-1 per page) where the invoice fields were found.
+    """
+
+    def __init__(self, path, min_similarity=0.6):
+        self.path = path
+        self.min_similarity = min_similarity
+
+        self._templates = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "fallbacks": 0, "learned": 0}
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def match(self, fingerprint, page_count):
+        """Best template for a fingerprint as (template, similarity), or (None, best_similarity)"""
+        best, best_similarity = None, 0.0
+        for template in self._load().values():
+            if template["page_count"] != page_count:
+                continue
+            similarity = fingerprint_similarity(fingerprint, template["fingerprint"])
+            if similarity > best_similarity:
+                best, best_similarity = template, similarity
+
+        if best_similarity >= self.min_similarity:
+            return best, best_similarity
+        return None, best_similarity
+
+    def learn(self, supplier, fingerprint, page_count, bands):
+        """Store or replace the template for a supplier"""
+        template = {
+            "supplier": supplier,
+            "fingerprint": fingerprint,
+            "page_count": page_count,
+            "bands": bands,
+            "learned_at": time.time(),
+        }
+        with self._file_lock():
+            templates = self._read()
+            templates[supplier] = template
+            self._write(templates)
+        self.record("learned")
+
+    def record(self, outcome):
+        """Count a hit, miss, fallback or learned template"""
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"] + stats["fallbacks"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["templates"] = len(self._load())
+        return stats
+
+    def _load(self):
+        """Templates, re-read when another worker changed the file"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return {}
+        with self._lock:
+            if mtime != self._mtime:
+                self._templates = self._read()
+                self._mtime = mtime
+            return self._templates
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, templates):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(templates, f)
+        os.replace(tmp_path, self.path)
+
+    def _file_lock(self):
+        return _FileLock(self.path + ".lock")
+
+
+class _FileLock:
+    """Exclusive flock on a lock file, for use as a context manager"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "w")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
@@ -0,0 +1,118 @@
+"""
+Prometheus metrics for the OCR service
+With PROMETHEUS_MULTIPROC_DIR set, every gunicorn worker and page pool
+process writes its samples to that directory and /metrics aggregates them
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+import profiling
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # Optional: metrics are disabled without it
+    prometheus_client = None
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+STAGE_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+if prometheus_client is not None:
+    STAGE_SECONDS = prometheus_client.Histogram(
+        "ocr_stage_seconds",
+        "Time spent per pipeline stage",
+        ["stage"],
+        buckets=STAGE_BUCKETS,
+    )
+    PAGES = prometheus_client.Counter("ocr_pages_total", "Pages processed", ["source"])
+    UPLOAD_BYTES = prometheus_client.Counter(
+        "ocr_upload_bytes_total", "Bytes of uploaded PDFs", ["endpoint"]
+    )
+    CACHE_LOOKUPS = prometheus_client.Counter(
+        "ocr_cache_lookups_total", "Result cache lookups", ["result"]
+    )
+    QUEUE_DEPTH = prometheus_client.Gauge(
+        "ocr_job_queue_depth", "Jobs queued or running", multiprocess_mode="livesum"
+    )
+
+
+def enabled():
+    return prometheus_client is not None
+
+
+def observe_stage(stage, seconds):
+    """Record the duration of one pipeline stage"""
+    if prometheus_client is not None:
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def timed(stage):
+    """Time the enclosed block as a pipeline stage (also reported to an active request profile)"""
+    profile = profiling.current()
+    if profile is not None:
+        profile.enter(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+        if profile is not None:
+            profile.exit(stage)
+
+
+def count_pages(source, pages=1):
+    if prometheus_client is not None and pages:
+        PAGES.labels(source).inc(pages)
+
+
+def count_upload(endpoint, size):
+    if prometheus_client is not None:
+        UPLOAD_BYTES.labels(endpoint).inc(size)
+
+
+def count_cache_lookup(result):
+    if prometheus_client is not None:
+        CACHE_LOOKUPS.labels(result).inc()
+
+
+def set_queue_depth(depth):
+    if prometheus_client is not None:
+        QUEUE_DEPTH.set(depth)
+
+
+def render():
+    """Exposition text and content type for /metrics, aggregated over processes when multiprocess"""
+    if MULTIPROC_DIR:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return (
+        prometheus_client.generate_latest(registry),
+        prometheus_client.CONTENT_TYPE_LATEST,
+    )
+
+
+def mark_process_dead(pid):
+    """Drop the live gauge samples of an exited worker (gunicorn child_exit hook)"""
+    if prometheus_client is not None and MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
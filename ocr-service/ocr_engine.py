@@ -0,0 +1,148 @@
+"""
+Tesseract engine abstraction for the OCR service
+Keeps a warm in-process Tesseract API handle per thread (tesserocr) and
+falls back to pytesseract, which starts a tesseract process per call
+"""
+
+import os
+import threading
+
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:  # Optional: falls back to pytesseract
+    tesserocr = None
+
+# 'auto' uses tesserocr when it is installed
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "auto")
+
+
+class PytesseractEngine:
+    """One tesseract subprocess per call; image is written to a temp file"""
+
+    name = "pytesseract"
+
+    def image_to_data(self, image, lang, psm=6, dpi=None):
+        config = f"--psm {psm}"
+        if dpi:
+            config += f" --dpi {dpi}"
+        return pytesseract.image_to_data(
+            image, lang=lang, output_type=pytesseract.Output.DICT, config=config
+        )
+
+
+class TesserocrEngine:
+    """
+    Long-lived Tesseract API handles, one per (thread, lang, psm), fed raw
+    numpy buffers. Language data is loaded once per handle instead of on
+    every page.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get_api(self, lang, psm):
+        apis = getattr(self._local, "apis", None)
+        if apis is None:
+            apis = self._local.apis = {}
+
+        api = apis.get((lang, psm))
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(lang=lang, psm=psm)
+            apis[(lang, psm)] = api
+        return api
+
+    def image_to_data(self, image, lang, psm=6, dpi=None):
+        """Word-level results in pytesseract's Output.DICT layout"""
+        api = self.get_api(lang, psm)
+
+        height, width = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        # tobytes() is C-contiguous, so a row is exactly width * channels bytes
+        api.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+        if dpi:
+            api.SetSourceResolution(dpi)
+        api.Recognize()
+
+        data = {
+            key: []
+            for key in (
+                "level",
+                "page_num",
+                "block_num",
+                "par_num",
+                "line_num",
+                "word_num",
+                "left",
+                "top",
+                "width",
+                "height",
+                "conf",
+                "text",
+            )
+        }
+        block_num = par_num = line_num = word_num = 0
+
+        iterator = api.GetIterator()
+        if iterator is None:
+            return data
+
+        level = tesserocr.RIL.WORD
+        for word in tesserocr.iterate_level(iterator, level):
+            # Same numbering as Tesseract's TSV output: paragraphs restart
+            # per block, lines per paragraph, words per line
+            if word.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                block_num += 1
+                par_num = 0
+            if word.IsAtBeginningOf(tesserocr.RIL.PARA):
+                par_num += 1
+                line_num = 0
+            if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                line_num += 1
+                word_num = 0
+            word_num += 1
+
+            bbox = word.BoundingBox(level)
+            if bbox is None:
+                continue
+            x0, y0, x1, y1 = bbox
+
+            data["level"].append(5)
+            data["page_num"].append(1)
+            data["block_num"].append(block_num)
+            data["par_num"].append(par_num)
+            data["line_num"].append(line_num)
+            data["word_num"].append(word_num)
+            data["left"].append(x0)
+            data["top"].append(y0)
+            data["width"].append(x1 - x0)
+            data["height"].append(y1 - y0)
+            data["conf"].append(word.Confidence(level))
+            data["text"].append(word.GetUTF8Text(level) or "")
+
+        return data
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Per-process engine, chosen by OCR_ENGINE"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            if OCR_ENGINE == "tesserocr" or (
+                OCR_ENGINE == "auto" and tesserocr is not None
+            ):
+                if tesserocr is None:
+                    raise RuntimeError(
+                        "OCR_ENGINE=tesserocr but tesserocr is not installed"
+                    )
+                _engine = TesserocrEngine()
+            else:
+                _engine = PytesseractEngine()
+        return _engine
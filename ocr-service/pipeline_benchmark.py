@@ -0,0 +1,249 @@
+"""
+Pipeline benchmark on synthetic Dutch invoices
+Runs every scenario (page count, table size, scan noise, rotation, text
+layer or scan) in a fresh process, times process_pdf end to end and per
+stage, and records pages per second and peak RSS. Results are compared with
+a stored baseline; a scenario that is slower or uses more memory than the
+baseline allows, or that the baseline lacks, makes the run exit with status
+1. Without a baseline file the run fails unless --update-baseline is given.
+
+Usage: python pipeline_benchmark.py                        # compare with benchmark_baseline.json
+       python pipeline_benchmark.py --update-baseline      # record a new baseline
+       python pipeline_benchmark.py --implementation both --scenarios text-1p,scan-1p
+
+Baselines are only comparable on the same machine and image; record one
+there first. Stage times are complete in sequential execution only.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from synthetic_invoices import make_invoice
+
+SCENARIOS = {
+    "text-1p": {"rows": 8},
+    "text-4p": {"rows": 100},
+    "scan-1p": {"rows": 8, "text_layer": False},
+    "scan-1p-noisy": {"rows": 8, "text_layer": False, "noise": 12.0},
+    "scan-1p-rotated": {"rows": 8, "text_layer": False, "noise": 4.0, "rotation": 1.5},
+    "scan-3p-noisy": {"rows": 70, "text_layer": False, "noise": 12.0},
+}
+IMPLEMENTATIONS = ("service", "cli")
+
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json"
+)
+
+# Stages faster than this in the baseline are reported but never fail the run
+MIN_STAGE_SECONDS = 0.05
+
+
+def run_service(pdf_path, repeat, execution_mode):
+    """process_pdf of the OCR service; returns [(seconds, stage seconds, error)]"""
+    import invoice_ocr_api
+    from profiling import RequestProfile
+
+    processor = invoice_ocr_api.HybridInvoiceProcessor(execution_mode=execution_mode)
+    processor.use_templates = False  # a learned template would change the later runs
+
+    runs = []
+    for _ in range(repeat + 1):  # the first run warms up and is dropped
+        with RequestProfile(trace_memory=False) as profile:
+            results = processor.process_pdf(pdf_path)
+        stages = {stage: record["seconds"] for stage, record in profile.stages.items()}
+        runs.append((profile.total_seconds, stages, results.get("error")))
+    return runs[1:]
+
+
+def run_cli(pdf_path, repeat, execution_mode):
+    """process_invoice of the standalone hybrid_invoice_processor.py"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from hybrid_invoice_processor import HybridInvoiceProcessor
+
+    runs = []
+    for _ in range(repeat + 1):
+        start = time.perf_counter()
+        result = HybridInvoiceProcessor(pdf_path, "").process_invoice()
+        runs.append((time.perf_counter() - start, {}, result.get("error")))
+    return runs[1:]
+
+
+def measure(implementation, pdf_path, pages, repeat, execution_mode):
+    """Runs in a fresh process, so the peak RSS belongs to this scenario alone"""
+    runner = run_service if implementation == "service" else run_cli
+    runs = runner(pdf_path, repeat, execution_mode)
+
+    seconds = statistics.median(run[0] for run in runs)
+    stage_names = sorted({stage for run in runs for stage in run[1]})
+    return {
+        "pages": pages,
+        "seconds": round(seconds, 4),
+        "pages_per_second": round(pages / seconds, 3) if seconds else None,
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        "stages": {
+            stage: round(statistics.median(run[1].get(stage, 0.0) for run in runs), 4)
+            for stage in stage_names
+        },
+        "errors": sorted({run[2] for run in runs if run[2]}),
+    }
+
+
+def compare(name, result, baseline, tolerance, memory_tolerance):
+    """Regression messages for one scenario"""
+    problems = []
+    if result["errors"]:
+        problems.append(f'{name}: failed: {"; ".join(result["errors"])}')
+    if baseline is None:
+        problems.append(
+            f"{name}: not in the baseline; run with --update-baseline to record it"
+        )
+        return problems
+
+    if result["seconds"] > baseline["seconds"] * (1 + tolerance):
+        problems.append(
+            f'{name}: {result["seconds"]:.3f}s vs baseline {baseline["seconds"]:.3f}s'
+        )
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + memory_tolerance):
+        problems.append(
+            f'{name}: peak RSS {result["peak_rss_mb"]} MB vs baseline {baseline["peak_rss_mb"]} MB'
+        )
+    for stage, base_seconds in baseline.get("stages", {}).items():
+        seconds = result["stages"].get(stage, 0.0)
+        if base_seconds >= MIN_STAGE_SECONDS and seconds > base_seconds * (
+            1 + tolerance
+        ):
+            problems.append(
+                f"{name}: stage {stage} {seconds:.3f}s vs baseline {base_seconds:.3f}s"
+            )
+    return problems
+
+
+def machine_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help="comma separated, from: " + ", ".join(SCENARIOS),
+    )
+    parser.add_argument(
+        "--implementation", choices=IMPLEMENTATIONS + ("both",), default="service"
+    )
+    parser.add_argument(
+        "--execution-mode", default="sequential", help="OCR service execution mode"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="measured runs per scenario, after one warm-up run",
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%"
+    )
+    parser.add_argument(
+        "--memory-tolerance", type=float, default=0.15, help="allowed peak RSS growth"
+    )
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(unknown)}')
+    implementations = (
+        IMPLEMENTATIONS if args.implementation == "both" else (args.implementation,)
+    )
+
+    baseline = {}
+    if not args.update_baseline:
+        if not os.path.exists(args.baseline):
+            parser.error(
+                f"no baseline at {args.baseline}; run with --update-baseline to record one"
+            )
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != machine_info():
+            print(
+                f'warning: baseline was recorded on {baseline.get("machine")}',
+                file=sys.stderr,
+            )
+
+    results = {}
+    problems = []
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in names:
+            pdf_bytes, truth = make_invoice(seed=len(results), **SCENARIOS[name])
+            pdf_path = os.path.join(temp_dir, f"{name}.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(pdf_bytes)
+
+            for implementation in implementations:
+                key = f"{implementation}/{name}"
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    result = pool.submit(
+                        measure,
+                        implementation,
+                        pdf_path,
+                        truth["pages"],
+                        args.repeat,
+                        args.execution_mode,
+                    ).result()
+                results[key] = result
+                problems += compare(
+                    key,
+                    result,
+                    baseline.get("scenarios", {}).get(key),
+                    args.tolerance,
+                    args.memory_tolerance,
+                )
+                print(
+                    f'{key:32} {result["seconds"]:8.3f}s {result["pages_per_second"] or 0:8.2f} pages/s '
+                    f'{result["peak_rss_mb"]:8.1f} MB',
+                    file=sys.stderr,
+                )
+
+    report = {"machine": machine_info(), "repeat": args.repeat, "scenarios": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        if baseline_failures := [p for p in problems if ": failed: " in p]:
+            print("\n".join(baseline_failures), file=sys.stderr)
+            sys.exit(1)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline written to {args.baseline}", file=sys.stderr)
+        return
+
+    if problems:
+        print("regressions:\n  " + "\n  ".join(problems), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
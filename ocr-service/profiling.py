@@ -0,0 +1,142 @@
+"""
+On-demand profiling of a single OCR request
+Wall time and peak traced memory per pipeline stage, plus an optional
+cProfile dump; stages report in through metrics.timed
+"""
+
+import cProfile
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+_local = threading.local()
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current():
+    """Profile active in this thread, if any"""
+    return getattr(_local, "profile", None)
+
+
+def rss_bytes():
+    """Current resident set size; 0 where /proc is not available"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class RequestProfile:
+    """
+    Context manager that activates profiling for the current thread.
+
+    Memory is measured with tracemalloc (Python and numpy allocations),
+    which is process wide and slows down allocation-heavy Python code; use
+    the timings to compare stages, not as absolute numbers. Native buffers
+    such as PyMuPDF pixmaps are only visible in the RSS growth per stage.
+    With trace_memory=False only times and RSS growth are recorded.
+    """
+
+    def __init__(self, pstats_dir=None, trace_memory=True):
+        self.pstats_dir = pstats_dir
+        self.trace_memory = trace_memory
+        self.pstats_path = None
+        self.stages = {}
+        self.total_seconds = 0.0
+        self.peak_bytes = 0
+
+        self._stack = []  # [stage, start_time, start_bytes, max_bytes, start_rss]
+        self._max_bytes = 0
+        self._base_bytes = 0
+        self._profiler = None
+        self._owns_tracing = False
+
+    def __enter__(self):
+        if self.trace_memory:
+            self._owns_tracing = not tracemalloc.is_tracing()
+            if self._owns_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._base_bytes = self._max_bytes = tracemalloc.get_traced_memory()[0]
+
+        if self.pstats_dir:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+        self._start = time.perf_counter()
+        _local.profile = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.profile = None
+        self.total_seconds = time.perf_counter() - self._start
+
+        if self._profiler is not None:
+            self._profiler.disable()
+            os.makedirs(self.pstats_dir, exist_ok=True)
+            self.pstats_path = os.path.join(
+                self.pstats_dir,
+                f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.pstats',
+            )
+            self._profiler.dump_stats(self.pstats_path)
+
+        self._track_peak()
+        self.peak_bytes = self._max_bytes - self._base_bytes
+        if self._owns_tracing:
+            tracemalloc.stop()
+
+    def enter(self, stage):
+        """Start a (possibly nested) stage"""
+        current_bytes = self._track_peak()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self._stack.append(
+            [stage, time.perf_counter(), current_bytes, current_bytes, rss_bytes()]
+        )
+
+    def exit(self, stage):
+        """End the innermost stage and fold its numbers into the per-stage totals"""
+        self._track_peak()
+        _, start, start_bytes, max_bytes, start_rss = self._stack.pop()
+
+        record = self.stages.setdefault(
+            stage, {"calls": 0, "seconds": 0.0, "peak_bytes": 0, "rss_growth": 0}
+        )
+        record["calls"] += 1
+        record["seconds"] += time.perf_counter() - start
+        record["peak_bytes"] = max(record["peak_bytes"], max_bytes - start_bytes)
+        record["rss_growth"] = max(record["rss_growth"], rss_bytes() - start_rss)
+
+    def _track_peak(self):
+        """Fold the peak since the last reset into every open stage; returns current bytes"""
+        if not self.trace_memory:
+            return 0
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        self._max_bytes = max(self._max_bytes, peak_bytes)
+        for frame in self._stack:
+            frame[3] = max(frame[3], peak_bytes)
+        return current_bytes
+
+    def report(self):
+        """Stage breakdown for the response"""
+        return {
+            "total_seconds": round(self.total_seconds, 3),
+            "peak_memory_mb": round(self.peak_bytes / 1048576, 1),
+            # ru_maxrss is the lifetime peak of this worker process, in KiB on Linux
+            "worker_max_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+            ),
+            "stages": {
+                stage: {
+                    "calls": record["calls"],
+                    "seconds": round(record["seconds"], 3),
+                    "peak_memory_mb": round(record["peak_bytes"] / 1048576, 1),
+                    "rss_growth_mb": round(record["rss_growth"] / 1048576, 1),
+                }
+                for stage, record in self.stages.items()
+            },
+            "pstats": self.pstats_path,
+        }
@@ -0,0 +1,379 @@
+"""
+Local index of ERPNext reference data for supplier and item matching
+Suppliers, items, companies, currencies and tax templates are pulled from
+the ERPNext REST API once and then refreshed with delta pulls (records
+modified since the last sync) when the TTL has passed, so matching an
+invoice is a local lookup instead of a round of REST calls.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import quote
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# key: (doctype, fields); records with disabled=1 (or enabled=0) are left out
+DOCTYPES = {
+    "suppliers": (
+        "Supplier",
+        ["name", "supplier_name", "tax_id", "country", "disabled", "modified"],
+    ),
+    "items": (
+        "Item",
+        ["name", "item_name", "item_code", "item_group", "disabled", "modified"],
+    ),
+    "companies": ("Company", ["name", "company_name", "tax_id", "country", "modified"]),
+    "currencies": (
+        "Currency",
+        ["name", "currency_name", "symbol", "enabled", "modified"],
+    ),
+    "tax_templates": (
+        "Purchase Taxes and Charges Template",
+        ["name", "title", "disabled", "modified"],
+    ),
+}
+PAGE_LENGTH = 500
+
+# Dropped before matching so 'Jansen B.V.' and 'Jansen BV' are the same name
+LEGAL_FORMS = {
+    "bv",
+    "nv",
+    "vof",
+    "cv",
+    "ev",
+    "bvba",
+    "gmbh",
+    "ltd",
+    "inc",
+    "llc",
+    "sa",
+    "sarl",
+}
+
+
+def normalize_name(text):
+    """Lowercase words without punctuation or legal form"""
+    text = re.sub(r"(?<=\b\w)\.", "", (text or "").lower())  # b.v. -> bv
+    words = re.sub(r"[^0-9a-zÀ-ɏ]+", " ", text).split()
+    return " ".join(w for w in words if w not in LEGAL_FORMS)
+
+
+def normalize_code(text):
+    """Identifier (VAT number, item code) without spacing or punctuation"""
+    return re.sub(r"[^0-9A-Z]", "", (text or "").upper())
+
+
+def trigrams(text):
+    """Trigrams of every word padded with spaces, as pg_trgm does"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """Fuzzy name lookup: candidates share a trigram, ranked by Dice similarity"""
+
+    def __init__(self):
+        self._postings = defaultdict(list)
+        self._sizes = {}
+
+    def add(self, key, text):
+        grams = trigrams(normalize_name(text))
+        if not grams:
+            return
+        self._sizes[key] = len(grams)
+        for gram in grams:
+            self._postings[gram].append(key)
+
+    def search(self, text, limit=3, min_score=0.3):
+        """[(key, score)] best first"""
+        grams = trigrams(normalize_name(text))
+        if not grams:
+            return []
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        scored = [
+            (key, 2 * count / (len(grams) + self._sizes[key]))
+            for key, count in shared.items()
+        ]
+        scored = [(key, round(score, 3)) for key, score in scored if score >= min_score]
+        scored.sort(key=lambda item: -item[1])
+        return scored[:limit]
+
+    def __len__(self):
+        return len(self._sizes)
+
+
+class ReferenceIndex:
+    """
+    ERPNext reference data persisted as one JSON snapshot shared by all
+    gunicorn workers. The worker that finds the snapshot older than the TTL
+    pulls the changes under a flock while the others keep serving what they
+    have; every worker rebuilds its lookup indexes when the file changes.
+    Deletions are only seen by the full pull every full_sync_interval.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        api_key,
+        api_secret,
+        path,
+        ttl=300,
+        full_sync_interval=86400,
+        timeout=30,
+        min_score=0.5,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.path = path
+        self.ttl = ttl
+        self.full_sync_interval = full_sync_interval
+        self.timeout = timeout
+        self.min_score = min_score
+
+        self._session = requests.Session()
+        self._session.headers["Authorization"] = f"token {api_key}:{api_secret}"
+        self._snapshot = {
+            "records": {},
+            "last_modified": {},
+            "synced_at": 0,
+            "full_synced_at": 0,
+        }
+        self._mtime = None
+        self._retry_at = 0
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self.stats = {
+            "syncs": 0,
+            "full_syncs": 0,
+            "sync_errors": 0,
+            "last_error": None,
+            "lookups": 0,
+        }
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def match_supplier(self, name, tax_id=None, limit=3):
+        """Supplier candidates for an invoice; an exact VAT number match wins"""
+        snapshot = self._fresh()
+        suppliers = snapshot["records"].get("suppliers", {})
+        self._count_lookup()
+
+        code = normalize_code(tax_id)
+        if code:
+            key = self._indexes["supplier_tax_ids"].get(code)
+            if key is not None:
+                return self._result([(key, 1.0)], suppliers, "tax_id")
+        return self._result(
+            self._indexes["suppliers"].search(name, limit), suppliers, "name"
+        )
+
+    def match_items(self, descriptions, limit=3):
+        """Item candidates per line item description; an exact item code match wins"""
+        snapshot = self._fresh()
+        items = snapshot["records"].get("items", {})
+        self._count_lookup(len(descriptions))
+
+        results = []
+        for description in descriptions:
+            key = self._indexes["item_codes"].get(normalize_code(description))
+            if key is not None:
+                match = self._result([(key, 1.0)], items, "item_code")
+            else:
+                match = self._result(
+                    self._indexes["items"].search(description, limit), items, "name"
+                )
+            results.append({"description": description, **match})
+        return results
+
+    def context(self, max_items=30):
+        """Reference lists for prompts and dropdowns"""
+        records = self._fresh()["records"]
+        lists = {kind: list(records.get(kind, {}).values()) for kind in DOCTYPES}
+        lists["items"] = lists["items"][:max_items]
+        return lists
+
+    def get_stats(self):
+        snapshot = self._fresh()
+        with self._lock:
+            stats = dict(self.stats)
+        stats["records"] = {
+            kind: len(snapshot["records"].get(kind, {})) for kind in DOCTYPES
+        }
+        stats["synced_at"] = snapshot["synced_at"]
+        stats["full_synced_at"] = snapshot["full_synced_at"]
+        stats["age_seconds"] = (
+            round(time.time() - snapshot["synced_at"], 1)
+            if snapshot["synced_at"]
+            else None
+        )
+        return stats
+
+    def _result(self, scored, records, method):
+        candidates = [{**records[key], "score": score} for key, score in scored]
+        return {
+            "match": (
+                candidates[0]
+                if candidates and candidates[0]["score"] >= self.min_score
+                else None
+            ),
+            "method": method if candidates else None,
+            "candidates": candidates,
+        }
+
+    def _count_lookup(self, count=1):
+        with self._lock:
+            self.stats["lookups"] += count
+
+    def _fresh(self):
+        """Current snapshot, synced first when it is older than the TTL"""
+        snapshot = self._load()
+        now = time.time()
+        if now - snapshot["synced_at"] >= self.ttl and now >= self._retry_at:
+            self._sync()
+            snapshot = self._load()
+        return snapshot
+
+    def _sync(self):
+        """Pull changes, unless another worker is already doing so"""
+        lock_file = open(self.path + ".lock", "w")
+        try:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+
+            snapshot = self._read()  # another worker may have just synced
+            now = time.time()
+            if now - snapshot["synced_at"] < self.ttl:
+                return
+
+            full = now - snapshot["full_synced_at"] >= self.full_sync_interval
+            try:
+                snapshot = self._pull(snapshot, full)
+            except (requests.RequestException, ValueError) as e:
+                logger.warning("ERPNext reference sync failed: %s", e)
+                with self._lock:
+                    self.stats["sync_errors"] += 1
+                    self.stats["last_error"] = str(e)
+                self._retry_at = now + min(self.ttl, 60)
+                return
+
+            snapshot["synced_at"] = now
+            if full:
+                snapshot["full_synced_at"] = now
+            self._write(snapshot)
+            with self._lock:
+                self.stats["syncs"] += 1
+                self.stats["full_syncs"] += full
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def _pull(self, snapshot, full):
+        """New snapshot with every doctype fully reloaded, or updated with records modified since the last pull"""
+        records, last_modified = {}, {}
+        for kind, (doctype, fields) in DOCTYPES.items():
+            since = None if full else snapshot["last_modified"].get(kind)
+            current = {} if since is None else dict(snapshot["records"].get(kind, {}))
+            newest = since
+
+            for row in self._fetch(doctype, fields, since):
+                newest = max(newest or "", row.get("modified") or "")
+                if row.get("disabled") in (1, "1") or row.get("enabled") in (0, "0"):
+                    current.pop(row["name"], None)
+                else:
+                    current[row["name"]] = {
+                        k: v
+                        for k, v in row.items()
+                        if k not in ("disabled", "enabled", "modified")
+                    }
+
+            records[kind] = current
+            if newest:
+                last_modified[kind] = newest
+        return {**snapshot, "records": records, "last_modified": last_modified}
+
+    def _fetch(self, doctype, fields, since=None):
+        """Rows of a doctype in pages, oldest change first; >= so equal timestamps are not skipped"""
+        params = {
+            "fields": json.dumps(fields),
+            "order_by": "modified asc",
+            "limit_page_length": PAGE_LENGTH,
+        }
+        if since:
+            params["filters"] = json.dumps([["modified", ">=", since]])
+
+        start = 0
+        while True:
+            response = self._session.get(
+                f"{self.base_url}/api/resource/{quote(doctype)}",
+                params={**params, "limit_start": start},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            rows = response.json().get("data", [])
+            yield from rows
+            if len(rows) < PAGE_LENGTH:
+                return
+            start += PAGE_LENGTH
+
+    def _load(self):
+        """Snapshot, re-read and re-indexed when another worker changed the file"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        with self._lock:
+            if mtime != self._mtime or not self._indexes:
+                self._snapshot = self._read()
+                self._indexes = self._build_indexes(self._snapshot["records"])
+                self._mtime = mtime
+            return self._snapshot
+
+    def _build_indexes(self, records):
+        suppliers, items = TrigramIndex(), TrigramIndex()
+        supplier_tax_ids, item_codes = {}, {}
+        for key, supplier in records.get("suppliers", {}).items():
+            suppliers.add(key, supplier.get("supplier_name") or key)
+            if normalize_code(supplier.get("tax_id")):
+                supplier_tax_ids[normalize_code(supplier["tax_id"])] = key
+        for key, item in records.get("items", {}).items():
+            items.add(key, item.get("item_name") or key)
+            if normalize_code(item.get("item_code")):
+                item_codes[normalize_code(item["item_code"])] = key
+        return {
+            "suppliers": suppliers,
+            "items": items,
+            "supplier_tax_ids": supplier_tax_ids,
+            "item_codes": item_codes,
+        }
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {
+                "records": {},
+                "last_modified": {},
+                "synced_at": 0,
+                "full_synced_at": 0,
+            }
+
+    def _write(self, snapshot):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
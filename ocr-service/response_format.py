@@ -0,0 +1,185 @@
+"""
+Response shaping for the invoice endpoints
+?fields= selects parts of the result, ?detail= sets how much OCR geometry
+is returned and ?format= picks the encoding; gzip follows Accept-Encoding.
+The cache always holds the full result; shaping happens per response.
+"""
+
+import gzip
+import itertools
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# summary: page metadata only; lines: lines with their boxes; words: everything
+DETAIL_LEVELS = ("summary", "lines", "words")
+# columnar: JSON with per-page word and line columns instead of a dict per word
+FORMATS = ("json", "columnar", "msgpack")
+
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "columnar": "application/json",
+    "msgpack": "application/msgpack",
+}
+
+WORD_COLUMNS = ("text", "confidence", "x", "y", "width", "height", "line_num")
+LINE_COLUMNS = ("text", "x", "y", "width", "height")
+
+
+def parse_options(values, accept_encoding=""):
+    """Response options from query/form values; raises ValueError for unknown values"""
+    fields = [
+        f.strip() for f in values.get("fields", "").split(",") if f.strip()
+    ] or None
+    detail = values.get("detail", "words")
+    if detail not in DETAIL_LEVELS:
+        raise ValueError(
+            f'Unknown detail level: {detail} (one of {", ".join(DETAIL_LEVELS)})'
+        )
+    encoding = values.get("format", "json")
+    if encoding not in FORMATS:
+        raise ValueError(f'Unknown format: {encoding} (one of {", ".join(FORMATS)})')
+    if encoding == "msgpack" and msgpack is None:
+        raise ValueError("format=msgpack is not available: msgpack is not installed")
+
+    return {
+        "fields": fields,
+        "detail": detail,
+        "format": encoding,
+        "gzip": "gzip" in (accept_encoding or "").lower(),
+    }
+
+
+def is_full(options):
+    """True when the stored payload can be returned as it is"""
+    return (
+        options["fields"] is None
+        and options["detail"] == "words"
+        and options["format"] == "json"
+    )
+
+
+def render(payload, options):
+    """
+    Shape a serialized full result for the response.
+    Returns (body, content_type, headers).
+    """
+    content_type = CONTENT_TYPES[options["format"]]
+    if is_full(options):
+        body = payload
+    else:
+        results = shape(json.loads(payload), options)
+        if options["format"] == "msgpack":
+            body = msgpack.packb(results, use_bin_type=True)
+        else:
+            body = json.dumps(
+                results, ensure_ascii=False, separators=(",", ":")
+            ).encode("utf-8")
+
+    headers = {"Vary": "Accept-Encoding"}
+    if options["gzip"] and len(body) >= GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return body, content_type, headers
+
+
+def shape(results, options):
+    """Apply field selection, detail level and columnar layout to a result dict"""
+    if options["fields"]:
+        results = select_fields(results, options["fields"])
+
+    columnar = options["format"] != "json"
+    if "ocr_data" in results:
+        results["ocr_data"] = [
+            shape_page(page, options["detail"], columnar)
+            for page in results["ocr_data"]
+        ]
+
+    table = results.get("layout_analysis", {}).get("table_structure")
+    if table and "data_lines" in table:
+        if options["detail"] == "summary":
+            table["data_lines"] = len(table["data_lines"])
+        else:
+            table["data_lines"] = shape_lines(
+                table["data_lines"], options["detail"], columnar, own_words=True
+            )
+    return results
+
+
+def shape_page(page, detail, columnar):
+    words = page.pop("words", [])
+    lines = page.pop("lines", [])
+    page["word_count"] = len(words)
+    page["line_count"] = len(lines)
+
+    if detail != "summary":
+        page["lines"] = shape_lines(lines, detail, columnar)
+    if detail == "words" and columnar:
+        # Line membership is kept as each line's first word and word count
+        page["words"] = word_columns(words)
+    elif detail == "words":
+        page["words"] = words
+    return page
+
+
+def shape_lines(lines, detail, columnar, own_words=False):
+    """
+    Lines at a detail level. In columnar form lines point into the page's
+    word columns by first word and word count, or carry their own word
+    columns (own_words) when they are not a page's lines, e.g. table rows.
+    """
+    if not columnar:
+        if detail == "lines":
+            return [{k: v for k, v in line.items() if k != "words"} for line in lines]
+        return lines
+
+    columns = {name: [] for name in LINE_COLUMNS}
+    for line in lines:
+        columns["text"].append(line["text"])
+        for name in ("x", "y", "width", "height"):
+            columns[name].append(line["bbox"][name])
+    if detail == "words":
+        counts = [len(line["words"]) for line in lines]
+        columns["word_count"] = counts
+        columns["first_word"] = [0, *itertools.accumulate(counts)][: len(counts)]
+        if own_words:
+            columns["words"] = word_columns(
+                [word for line in lines for word in line["words"]]
+            )
+    return columns
+
+
+def word_columns(words):
+    columns = {name: [] for name in WORD_COLUMNS}
+    for word in words:
+        columns["text"].append(word["text"])
+        columns["confidence"].append(word["confidence"])
+        columns["line_num"].append(word["line_num"])
+        for name in ("x", "y", "width", "height"):
+            columns[name].append(word["bbox"][name])
+    return columns
+
+
+def select_fields(results, fields):
+    """Keep only the given top-level keys or dotted paths (and any error)"""
+    selected = {}
+    for path in fields:
+        source, target = results, selected
+        keys = path.split(".")
+        for key in keys[:-1]:
+            if not isinstance(source, dict) or key not in source:
+                break
+            source = source[key]
+            target = target.setdefault(key, {})
+        else:
+            if isinstance(source, dict) and keys[-1] in source:
+                target[keys[-1]] = source[keys[-1]]
+    if "error" in results:
+        selected["error"] = results["error"]
+    return selected
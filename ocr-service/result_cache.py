@@ -0,0 +1,260 @@
+"""
+Content-addressed cache for invoice processing results
+Memory LRU tier in front of an on-disk tier on the ocr_output volume
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(pdf, params):
+    """
+    Hash of the PDF (its bytes, or a file path read in chunks) plus the
+    processing parameters that affect the result
+    """
+    digest = hashlib.sha256()
+    if isinstance(pdf, (bytes, bytearray, memoryview)):
+        digest.update(pdf)
+    else:
+        with open(pdf, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier result cache. Entries are stored as serialized JSON bytes so
+    hits can be returned without re-encoding.
+
+    Memory tier: LRU bounded by entry count and total bytes.
+    Disk tier: one file per key, bounded by total bytes. Files are aged by
+    mtime (write time) and ordered for eviction by atime, which disk hits
+    set, so the least recently used go first. The tier's size is tracked
+    incrementally; the directory is only scanned when the size is unknown
+    or over budget, and every sweep_interval seconds to pick up writes of
+    other workers and expired files.
+    Both tiers expire entries older than ttl seconds.
+    """
+
+    def __init__(
+        self,
+        cache_dir,
+        ttl=7 * 24 * 3600,
+        memory_items=128,
+        memory_bytes=256 * 1024 * 1024,
+        disk_bytes=1024 * 1024 * 1024,
+        sweep_interval=300,
+    ):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.sweep_interval = sweep_interval
+
+        self._memory = OrderedDict()  # key -> (stored_at, payload)
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._disk_size = (
+            None  # Bytes on disk as of the last sweep plus own writes; None until swept
+        )
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expired": 0,
+        }
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """Return (payload, tier) for a cached result, or (None, None) on a miss"""
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, payload = entry
+                if now - stored_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return payload, "memory"
+                self._drop_memory(key)
+                self.stats["expired"] += 1
+
+        payload, stored_at = self._read_disk(key, now)
+        with self._lock:
+            if payload is not None:
+                self.stats["disk_hits"] += 1
+                self._put_memory(key, payload, stored_at)
+                return payload, "disk"
+            self.stats["misses"] += 1
+        return None, None
+
+    def put(self, key, payload):
+        """Store a serialized result in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, payload, now)
+            self.stats["stores"] += 1
+        self._write_disk(key, payload)
+
+    def get_stats(self):
+        """Counters plus current tier sizes"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_size
+            stats["disk_bytes"] = self._disk_size
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3)
+            if lookups
+            else 0.0
+        )
+        return stats
+
+    # Memory tier (callers hold the lock)
+
+    def _put_memory(self, key, payload, stored_at):
+        if len(payload) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._drop_memory(key)
+        self._memory[key] = (stored_at, payload)
+        self._memory_size += len(payload)
+
+        while (
+            len(self._memory) > self.memory_items
+            or self._memory_size > self.memory_bytes
+        ):
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+            self.stats["memory_evictions"] += 1
+
+    def _drop_memory(self, key):
+        _, payload = self._memory.pop(key)
+        self._memory_size -= len(payload)
+
+    # Disk tier
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _read_disk(self, key, now):
+        if not self.cache_dir:
+            return None, None
+
+        path = self._disk_path(key)
+        try:
+            st = os.stat(path)
+            if now - st.st_mtime > self.ttl:
+                self._unlink(path, st.st_size, "expired")
+                return None, None
+            with open(path, "rb") as f:
+                payload = f.read()
+            os.utime(
+                path, (now, st.st_mtime)
+            )  # Mark as used for eviction, keep the age
+            return payload, st.st_mtime
+        except OSError:
+            return None, None
+
+    def _write_disk(self, key, payload):
+        if not self.cache_dir:
+            return
+
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            # Write then rename so concurrent workers and threads never read a partial file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+
+        now = time.time()
+        with self._lock:
+            if self._disk_size is not None:
+                self._disk_size += len(payload) - replaced
+            due = (
+                self._disk_size is None
+                or self._disk_size > self.disk_bytes
+                or now >= self._next_sweep
+            )
+        if due:
+            self._sweep_disk(now)
+
+    def _sweep_disk(self, now):
+        """
+        Scan the disk tier: remove expired entries, then the least recently
+        used until under the byte budget, and reset the tracked size.
+        One sweep at a time; a write during a sweep does not wait for it.
+        """
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._evict_disk(now)
+        finally:
+            self._sweep_lock.release()
+
+    def _evict_disk(self, now):
+        entries = []
+        total = 0
+
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.ttl:
+                    self._unlink(entry.path, 0, "expired")
+                    continue
+                entries.append((st.st_atime, st.st_size, entry.path))
+                total += st.st_size
+
+        if total > self.disk_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.disk_bytes:
+                    break
+                self._unlink(path, 0, "disk_evictions")
+                total -= size
+
+        with self._lock:
+            self._disk_size = total
+            self._next_sweep = now + self.sweep_interval
+
+    def _unlink(self, path, size, counter):
+        """Remove a disk entry of size bytes (0 while sweeping, which recounts the size)"""
+        try:
+            os.unlink(path)
+        except OSError:
+            return
+        with self._lock:
+            self.stats[counter] += 1
+            if self._disk_size is not None:
+                self._disk_size -= size
@@ -0,0 +1,104 @@
+"""
+Cold-start benchmark for the OCR service
+Starts gunicorn with the service configuration and reports the time until
+/health answers, until the first invoice is served, and how long the first
+and a second (warm) invoice took. The result cache is disabled for the run.
+
+Usage: python startup_benchmark.py invoice.pdf [--port 8099] [--workers 1]
+       OCR_WARMUP=0 python startup_benchmark.py invoice.pdf   # compare without warm-up
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+
+def wait_for_health(base_url, process, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"/health did not answer within {timeout}s")
+
+
+def post_invoice(base_url, pdf_bytes, run):
+    start = time.perf_counter()
+    response = requests.post(
+        f"{base_url}/process-invoice",
+        files={"pdf_file": ("invoice.pdf", pdf_bytes, "application/pdf")},
+        data={"extracted_text": f"startup benchmark {run}"},
+        timeout=600,
+    )
+    response.raise_for_status()
+    return time.perf_counter() - start, response.json().get("error")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("pdf")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="seconds to wait for /health"
+    )
+    args = parser.parse_args()
+
+    with open(args.pdf, "rb") as f:
+        pdf_bytes = f.read()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, OCR_CACHE_ENABLED="0")
+    command = [
+        "gunicorn",
+        "--bind",
+        f"127.0.0.1:{args.port}",
+        "--workers",
+        str(args.workers),
+        "--timeout",
+        "600",
+    ]
+
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env
+    )
+    try:
+        wait_for_health(base_url, process, args.timeout)
+        healthy = time.perf_counter() - start
+
+        first_seconds, first_error = post_invoice(base_url, pdf_bytes, 1)
+        first_served = time.perf_counter() - start
+        second_seconds, second_error = post_invoice(base_url, pdf_bytes, 2)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    report = {
+        "server": env.get("OCR_SERVER", "wsgi"),
+        "warmup": env.get("OCR_WARMUP", "1") == "1",
+        "preload": env.get("OCR_PRELOAD", "1") == "1",
+        "time_to_healthy": round(healthy, 3),
+        "time_to_first_invoice": round(first_served, 3),
+        "first_invoice_seconds": round(first_seconds, 3),
+        "second_invoice_seconds": round(second_seconds, 3),
+        "errors": [e for e in (first_error, second_error) if e],
+    }
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
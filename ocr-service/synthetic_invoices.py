@@ -0,0 +1,182 @@
+"""
+Synthetic Dutch invoices for benchmarking the OCR pipeline
+Generates invoices with PyMuPDF, either born-digital (text layer) or as
+scanned images with noise and rotation, together with their ground truth
+"""
+
+import random
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+
+SUPPLIERS = (
+    "Jansen Installatietechniek B.V.",
+    "De Vries Bouwmaterialen B.V.",
+    "Bakker & Zonen Logistiek B.V.",
+    "Visser ICT Diensten B.V.",
+    "Smit Kantoorartikelen B.V.",
+)
+ITEMS = (
+    "Montage werkzaamheden",
+    "Voorrijkosten",
+    "Kabelgoot 2m",
+    "Hosting pakket",
+    "Consultancy uur",
+    "Printpapier A4 doos",
+    "Transport Rotterdam",
+    "Licentie jaarabonnement",
+    "Onderhoudscontract",
+    "Materiaalkosten",
+)
+VAT_RATE = 0.21
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+COLUMNS = (50, 340, 410, 490)  # Omschrijving, Aantal, Prijs, Bedrag
+
+
+def money(value):
+    """Amount in the notation the extractor reads: € 1,234.56"""
+    return f"€ {value:,.2f}"
+
+
+def make_invoice(
+    rows=8,
+    rows_per_page=28,
+    text_layer=True,
+    noise=0.0,
+    rotation=0.0,
+    scan_dpi=200,
+    seed=0,
+):
+    """
+    Build one invoice. Returns (pdf_bytes, truth) where truth holds the
+    expected supplier, invoice number, date, totals and line item count.
+    Without a text layer every page is rendered at scan_dpi, degraded with
+    gaussian noise (sigma in gray levels) and rotated by `rotation` degrees.
+    """
+    rng = random.Random(seed)
+    supplier = rng.choice(SUPPLIERS)
+    invoice_number = f"V{rng.randint(2023000000, 2025999999)}"
+    invoice_date = f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.choice((2023, 2024, 2025))}"
+
+    items = []
+    for _ in range(rows):
+        quantity = rng.randint(1, 12)
+        price = rng.randint(500, 50000) / 100
+        items.append((rng.choice(ITEMS), quantity, price, round(quantity * price, 2)))
+    subtotal = round(sum(item[3] for item in items), 2)
+    vat = round(subtotal * VAT_RATE, 2)
+    total = round(subtotal + vat, 2)
+
+    font = fitz.Font("helv")
+    doc = fitz.open()
+    chunks = [
+        items[i : i + rows_per_page] for i in range(0, len(items), rows_per_page)
+    ] or [[]]
+
+    for page_index, chunk in enumerate(chunks):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        writer = fitz.TextWriter(page.rect)
+        y = 60
+
+        def text(x, line, size=10):
+            writer.append((x, y), line, font=font, fontsize=size)
+
+        if page_index == 0:
+            text(50, supplier, 14)
+            for line in (
+                "Industrieweg 12",
+                "3044 AS Rotterdam",
+                "KvK 12345678  BTW NL001234567B01",
+            ):
+                y += 16
+                text(50, line)
+            y += 40
+            text(50, "FACTUUR", 16)
+            y += 24
+            text(50, "Factuurnummer")
+            y += 14
+            text(50, invoice_number)
+            y += 20
+            text(50, f"Factuurdatum: {invoice_date}")
+            y += 36
+        else:
+            text(50, f"{supplier} - vervolg", 10)
+            y += 36
+
+        for x, header in zip(COLUMNS, ("Omschrijving", "Aantal", "Prijs", "Bedrag")):
+            text(x, header)
+        y += 20
+        for description, quantity, price, amount in chunk:
+            for x, value in zip(
+                COLUMNS, (description, str(quantity), money(price), money(amount))
+            ):
+                text(x, value)
+            y += 20
+
+        if page_index == len(chunks) - 1:
+            y += 20
+            for label, value in (
+                ("Totaal exclusief", subtotal),
+                ("Btw 21%", vat),
+                ("Totaal te betalen", total),
+            ):
+                text(300, label)
+                text(COLUMNS[3], money(value))
+                y += 18
+
+        text(50, f"Pagina {page_index + 1} van {len(chunks)}", 8)
+        writer.write_text(page)
+
+    if not text_layer:
+        doc = scan_document(doc, noise, rotation, scan_dpi, rng)
+
+    truth = {
+        "supplier_name": supplier,
+        "invoice_number": invoice_number,
+        "invoice_date": invoice_date,
+        "total_amount": total,
+        "vat_amount": vat,
+        "subtotal": subtotal,
+        "line_items": rows,
+        "pages": len(chunks),
+    }
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes, truth
+
+
+def scan_document(doc, noise, rotation, dpi, rng):
+    """Image-only copy of a document, as if printed and scanned"""
+    scanned = fitz.open()
+    np_rng = np.random.default_rng(rng.randint(0, 2**32 - 1))
+
+    for page in doc:
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        gray = (
+            np.frombuffer(pix.samples, dtype=np.uint8)
+            .reshape(pix.height, pix.width)
+            .astype(np.float32)
+        )
+
+        if noise:
+            gray += np_rng.normal(0, noise, gray.shape)
+            # Speckle: a few dark dots, as from dust on the scanner glass
+            speckle = np_rng.random(gray.shape) < noise / 20000
+            gray[speckle] = 0
+        image = np.clip(gray, 0, 255).astype(np.uint8)
+
+        if rotation:
+            center = (image.shape[1] / 2, image.shape[0] / 2)
+            matrix = cv2.getRotationMatrix2D(center, rotation, 1.0)
+            image = cv2.warpAffine(
+                image, matrix, (image.shape[1], image.shape[0]), borderValue=255
+            )
+
+        ok, png = cv2.imencode(".png", image)
+        new_page = scanned.new_page(width=page.rect.width, height=page.rect.height)
+        new_page.insert_image(new_page.rect, stream=png.tobytes())
+
+    doc.close()
+    return scanned
@@ -0,0 +1,73 @@
+"""
+Column detection for invoice line item tables
+Column anchors come from a density estimate over the x positions of all
+table rows (across pages); tokens are assigned to columns by binary search
+"""
+
+import numpy as np
+
+
+class ColumnModel:
+    """
+    Column anchors (left edge of each column) and the boundaries between
+    columns. Tokens left of the first column get column -1.
+    """
+
+    def __init__(self, anchors, boundaries):
+        self.anchors = anchors
+        self.boundaries = boundaries
+
+    def __len__(self):
+        return len(self.anchors)
+
+    def assign(self, x_positions):
+        """Column index per x position, O(n log k)"""
+        return (
+            np.searchsorted(
+                self.boundaries, np.asarray(x_positions, dtype=float), side="right"
+            )
+            - 1
+        )
+
+
+def cluster_columns(x_positions, tolerance=20, bin_width=4):
+    """
+    1-D density clustering of x positions (pixels) into columns:
+    1. Histogram the positions in bin_width bins and smooth over the
+       tolerance, so positions closer than the tolerance share density
+    2. Split at empty bins, and at valleys that drop below half of the lower
+       neighbouring peak (two columns that are close but clearly separate)
+    3. Each cluster's anchor is its leftmost position
+    """
+    x = np.sort(np.asarray(x_positions, dtype=float))
+    if not len(x):
+        return ColumnModel([], np.zeros(0))
+
+    bins = ((x - x[0]) // bin_width).astype(np.intp)
+    hist = np.bincount(bins).astype(float)
+    width = max(1, int(tolerance // bin_width))
+    density = np.convolve(hist, np.ones(width + 1), mode="full")[: len(hist)]
+
+    breaks = np.zeros(len(hist), dtype=bool)
+    breaks[1:] = (density[1:] > 0) & (density[:-1] == 0)  # First bin after a gap
+
+    # Valleys between consecutive peaks of the same run
+    rising = np.diff(density, prepend=0) > 0
+    falling = np.diff(density, append=0) <= 0
+    peaks = np.flatnonzero(rising & falling & (density > 0))
+    for left, right in zip(peaks[:-1], peaks[1:]):
+        valley = left + int(np.argmin(density[left : right + 1]))
+        if 0 < density[valley] < 0.5 * min(density[left], density[right]):
+            breaks[valley] = True
+
+    labels = np.cumsum(breaks)[bins]
+    starts = np.flatnonzero(np.diff(labels, prepend=-1))
+    anchors = x[starts]
+    ends = np.append(starts[1:], len(x)) - 1
+
+    # Boundaries: half a tolerance before the first column, then midway
+    # between the last position of a column and the anchor of the next
+    boundaries = np.empty(len(anchors))
+    boundaries[0] = anchors[0] - tolerance / 2
+    boundaries[1:] = (x[ends[:-1]] + anchors[1:]) / 2
+    return ColumnModel([int(a) for a in anchors], boundaries)
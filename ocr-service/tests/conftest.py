@@ -0,0 +1,48 @@
+"""
+Unit tests for the OCR service modules
+Run from the repository root with: pytest ocr-service/tests
+(needs ocr-service/requirements-ocr.txt; Tesseract itself is replaced by
+the bar code engine in fake_ocr.py)
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+# invoice_ocr_api creates its temp, cache and job directories on import
+_state_dir = tempfile.mkdtemp(prefix="ocr-service-tests-")
+os.environ.setdefault("OCR_TEMP_DIR", os.path.join(_state_dir, "temp"))
+os.environ.setdefault("OCR_CACHE_DIR", os.path.join(_state_dir, "cache"))
+os.environ.setdefault("OCR_JOBS_DIR", os.path.join(_state_dir, "jobs"))
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+from fake_ocr import BarcodeEngine  # noqa: E402
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    """Bar code engine in place of Tesseract, in this process"""
+    import invoice_ocr_api as api
+    import ocr_engine
+
+    engine = BarcodeEngine()
+    monkeypatch.setattr(ocr_engine, "get_engine", lambda: engine)
+    monkeypatch.setattr(api, "get_engine", lambda: engine)
+    return engine
+
+
+@pytest.fixture
+def processor():
+    """Sequential processor with every optional mode off"""
+    import invoice_ocr_api as api
+
+    processor = api.HybridInvoiceProcessor(
+        execution_mode="sequential", adaptive=False, lazy=False
+    )
+    processor.use_templates = False
+    return processor
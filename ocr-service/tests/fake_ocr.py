@@ -0,0 +1,257 @@
+"""
+Fake OCR for the service tests (no Tesseract needed)
+Scanned test pages draw every text line as a bar code: a solid bar whose
+cells encode the line's id. BarcodeEngine reads the bars back from any
+render, crop or stack of a page and returns the registered words, with
+their boxes scaled to the image, in pytesseract's Output.DICT layout.
+"""
+
+import threading
+
+import fitz  # PyMuPDF
+import numpy as np
+
+CELLS = 12  # Start cell, 10 id bits, end cell
+BAR_HEIGHT = 9.0
+MIN_BAR_WIDTH = 120.0
+CHAR_WIDTH = 5.5
+WORD_GAP = 3.0
+
+
+class BarcodeEngine:
+    """
+    Engine stand-in that decodes bar coded lines. Lines registered as weak
+    are read with low confidence below 200 DPI, as from a fast pass.
+    """
+
+    name = "fake"
+
+    def __init__(self):
+        self.lines = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def register(self, cells, weak=False):
+        """Line id for a line of (x, text) cells in PDF points"""
+        words = []
+        for x, text in cells:
+            for word in text.split():
+                width = CHAR_WIDTH * len(word)
+                words.append((word, x, width))
+                x += width + WORD_GAP
+        start = words[0][1]
+        end = max(start + MIN_BAR_WIDTH, max(x + width for _, x, width in words))
+        with self._lock:
+            line_id = len(self.lines) + 1
+            self.lines[line_id] = {"words": words, "x0": start, "x1": end, "weak": weak}
+        return line_id
+
+    def image_to_data(self, image, lang, psm=6, dpi=None):
+        image = np.asarray(image)
+        with self._lock:
+            self.calls.append({"shape": image.shape, "lang": lang})
+
+        data = {
+            key: []
+            for key in (
+                "text",
+                "conf",
+                "left",
+                "top",
+                "width",
+                "height",
+                "line_num",
+                "word_num",
+            )
+        }
+        ink = image < 128
+        rows = ink.any(axis=1)
+        line_num = 0
+        for top, bottom in runs(rows):
+            decoded = self.decode(ink[top:bottom])
+            if decoded is None:
+                continue
+            line_id, left, right = decoded
+            line = self.lines[line_id]
+            scale = (right - left) / (line["x1"] - line["x0"])
+            confidence = 50 if line["weak"] and scale < 200 / 72.0 else 95
+            line_num += 1
+            for word_num, (text, x, width) in enumerate(line["words"], 1):
+                data["text"].append(text)
+                data["conf"].append(confidence)
+                data["left"].append(int(left + (x - line["x0"]) * scale))
+                data["top"].append(top)
+                data["width"].append(max(1, int(width * scale)))
+                data["height"].append(bottom - top)
+                data["line_num"].append(line_num)
+                data["word_num"].append(word_num)
+        return data
+
+    def decode(self, band):
+        """(line id, left, right) of a bar coded band, or None for anything else"""
+        columns = np.flatnonzero(band.any(axis=0))
+        if len(columns) < CELLS or band.shape[0] < 3:
+            return None
+        left, right = int(columns[0]), int(columns[-1]) + 1
+        cell = (right - left) / CELLS
+        core = band[1:-1]  # Edge rows can be anti-aliased
+
+        bits = []
+        for i in range(CELLS):
+            x0, x1 = int(left + (i + 0.25) * cell), int(left + (i + 0.75) * cell)
+            fill = core[:, x0 : max(x1, x0 + 1)].mean()
+            if 0.1 < fill < 0.9:
+                return None  # Not a solid bar: glyphs or noise
+            bits.append(fill >= 0.9)
+        if not (bits[0] and bits[-1]):
+            return None
+        line_id = int("".join("1" if bit else "0" for bit in bits[1:-1]), 2)
+        return (line_id, left, right) if line_id in self.lines else None
+
+
+def install_engine(lines):
+    """
+    Process pool initializer: OCR with a bar code engine that knows the given
+    registered lines, in a spawned worker process
+    """
+    import invoice_ocr_api
+
+    engine = BarcodeEngine()
+    engine.lines = lines
+    invoice_ocr_api.get_engine = lambda: engine
+
+
+def runs(mask):
+    """(start, end) of the runs of True in a 1-D mask"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def draw_line(page, engine, y, cells, weak=False):
+    """Draw one line of (x, text) cells as a bar at y (points)"""
+    line_id = engine.register(cells, weak)
+    line = engine.lines[line_id]
+    bits = [True] + [bit == "1" for bit in format(line_id, "010b")] + [True]
+    cell = (line["x1"] - line["x0"]) / CELLS
+    for i, bit in enumerate(bits):
+        if bit:
+            x = line["x0"] + i * cell
+            page.draw_rect(
+                fitz.Rect(x, y, x + cell, y + BAR_HEIGHT), color=None, fill=(0, 0, 0)
+            )
+
+
+def barcode_pdf(engine, pages, spacing=18.0, top=50.0):
+    """
+    PDF bytes with one page per list of lines. A line is a string (one cell
+    at x=72), a list of (x, text) cells, or a dict with 'cells' and 'weak';
+    None leaves an empty line.
+    """
+    doc = fitz.open()
+    for lines in pages:
+        page = doc.new_page(width=595, height=842)
+        for i, line in enumerate(lines):
+            if line is None:
+                continue
+            if isinstance(line, str):
+                line = {"cells": [(72, line)]}
+            elif not isinstance(line, dict):
+                line = {"cells": line}
+            draw_line(
+                page, engine, top + i * spacing, line["cells"], line.get("weak", False)
+            )
+    pdf = doc.tobytes()
+    doc.close()
+    return pdf
+
+
+def scanned(pdf, dpi=150, footer=None):
+    """Image-only copy of a PDF, optionally with a line of real text (a scanner app footer)"""
+    src = fitz.open(stream=pdf, filetype="pdf")
+    doc = fitz.open()
+    for page in src:
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        new_page = doc.new_page(width=page.rect.width, height=page.rect.height)
+        new_page.insert_image(new_page.rect, stream=pix.tobytes("png"))
+        if footer:
+            new_page.insert_text((72, page.rect.height - 20), footer, fontsize=7)
+    data = doc.tobytes()
+    doc.close()
+    src.close()
+    return data
+
+
+def text_pdf(pages):
+    """PDF bytes with a real text layer: one page per list of (x, y, text) in points"""
+    doc = fitz.open()
+    font = fitz.Font("helv")  # Embedded with a Unicode map, so '€' survives extraction
+    for lines in pages:
+        page = doc.new_page(width=595, height=842)
+        writer = fitz.TextWriter(page.rect)
+        for x, y, text in lines:
+            writer.append((x, y), text, font=font, fontsize=10)
+        writer.write_text(page)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def money(value):
+    return f"€ {value:,.2f}"
+
+
+def invoice_page(
+    supplier="Jansen Installatietechniek B.V.",
+    number="V2024001",
+    date="15-03-2024",
+    items=(),
+    totals=True,
+    weak_lines=(),
+):
+    """Lines of a first invoice page in the layout the extractor expects"""
+    lines = [
+        supplier,
+        "Industrieweg 12 Rotterdam",
+        None,
+        "FACTUUR",
+        number,
+        f"Factuurdatum: {date}",
+        None,
+        [(72, "Omschrijving"), (330, "Prijs"), (450, "Bedrag")],
+    ]
+    lines += item_lines(items)
+    if totals:
+        lines += total_lines(items)
+    return [
+        (
+            {"cells": [(72, line)], "weak": True}
+            if i in weak_lines and isinstance(line, str)
+            else line
+        )
+        for i, line in enumerate(lines)
+    ]
+
+
+def item_lines(items):
+    return [
+        [(72, description), (330, money(price)), (450, money(amount))]
+        for description, price, amount in items
+    ]
+
+
+def total_lines(items):
+    subtotal = round(sum(amount for _, _, amount in items), 2)
+    vat = round(subtotal * 0.21, 2)
+    return [
+        None,
+        [(300, "Totaal exclusief"), (450, money(subtotal))],
+        [(300, "Btw 21%"), (450, money(vat))],
+        [(300, "Totaal te betalen"), (450, money(round(subtotal + vat, 2)))],
+    ]
+
+
+ITEMS = (
+    ("Montage werkzaamheden", 45.00, 90.00),
+    ("Kabelgoot 2m", 12.50, 25.00),
+    ("Voorrijkosten", 35.00, 35.00),
+)
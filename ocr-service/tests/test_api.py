@@ -0,0 +1,165 @@
+import io
+import json
+import os
+import zipfile
+
+import invoice_ocr_api as api
+import pytest
+from fake_ocr import ITEMS, barcode_pdf, invoice_page
+from result_cache import ResultCache
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import EnvironBuilder
+
+
+@pytest.fixture
+def client():
+    return api.app.test_client()
+
+
+def upload(pdf, name="invoice.pdf"):
+    return (io.BytesIO(pdf), name)
+
+
+def test_health(client):
+    assert client.get("/health").get_json()["status"] == "healthy"
+
+
+def test_process_invoice(engine, client):
+    pdf = barcode_pdf(engine, [invoice_page(items=ITEMS)])
+    response = client.post("/process-invoice", data={"pdf_file": upload(pdf)})
+
+    assert response.status_code == 200
+    fields = response.get_json()["extracted_fields"]
+    assert fields["invoice_number"] == "V2024001"
+    assert fields["totals"]["total_amount"] == 181.5
+
+
+def test_process_invoice_without_file(client):
+    response = client.post("/process-invoice", data={})
+    assert response.status_code == 400
+
+
+def batch_lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_process_invoices_streams_each_file(engine, client, monkeypatch):
+    monkeypatch.setattr(api, "result_cache", None)
+    pdfs = [
+        barcode_pdf(engine, [invoice_page(number=number, items=ITEMS)])
+        for number in ("V1001", "V1002")
+    ]
+    response = client.post(
+        "/process-invoices",
+        data={"pdf_files": [upload(pdfs[0], "a.pdf"), upload(pdfs[1], "b.pdf")]},
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    *results, summary = batch_lines(response)
+    numbers = {
+        line["filename"]: line["result"]["extracted_fields"]["invoice_number"]
+        for line in results
+    }
+    assert numbers == {"a.pdf": "V1001", "b.pdf": "V1002"}
+    assert summary["summary"]["files"] == 2
+    assert summary["summary"]["failed"] == 0
+
+
+def test_process_invoices_reads_zip_archives(engine, client, monkeypatch):
+    monkeypatch.setattr(api, "result_cache", None)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("invoices/a.pdf", barcode_pdf(engine, [invoice_page(items=ITEMS)]))
+        zf.writestr("notes.txt", "not an invoice")
+    response = client.post(
+        "/process-invoices", data={"archive": upload(archive.getvalue(), "batch.zip")}
+    )
+
+    *results, summary = batch_lines(response)
+    assert [line["filename"] for line in results] == ["invoices/a.pdf"]
+    assert summary["summary"]["files"] == 1
+
+
+def test_process_invoices_checks_size_before_reading(client, monkeypatch):
+    monkeypatch.setattr(api, "OCR_BATCH_MAX_MB", 1)
+    environ = EnvironBuilder(
+        path="/process-invoices",
+        method="POST",
+        data={"pdf_files": upload(bytes(1200 * 1024), "big.pdf")},
+    ).get_environ()
+    reads = []
+    monkeypatch.setattr(
+        FileStorage,
+        "read",
+        lambda self, *args: reads.append(self.filename),
+        raising=False,
+    )
+    response = client.open(environ)
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Batch too large"}
+    assert reads == []
+
+
+def test_request_over_max_content_length_is_rejected(client, monkeypatch):
+    monkeypatch.setitem(api.app.config, "MAX_CONTENT_LENGTH", 1024)
+    response = client.post("/process-invoices", data={"pdf_files": upload(bytes(4096))})
+
+    assert response.status_code == 413
+    assert "error" in response.get_json()
+
+
+@pytest.fixture
+def pdf_args(monkeypatch):
+    """Records what process_pdf is handed: bytes, or the path of a spooled upload"""
+    args = []
+    process_pdf = api.HybridInvoiceProcessor.process_pdf
+
+    def recording(self, pdf, *rest, **kwargs):
+        args.append(pdf)
+        return process_pdf(self, pdf, *rest, **kwargs)
+
+    monkeypatch.setattr(api.HybridInvoiceProcessor, "process_pdf", recording)
+    monkeypatch.setattr(api, "result_cache", None)
+    return args
+
+
+def test_small_upload_stays_in_memory(engine, client, pdf_args):
+    pdf = barcode_pdf(engine, [invoice_page(items=ITEMS)])
+    response = client.post("/process-invoice", data={"pdf_file": upload(pdf)})
+
+    assert response.get_json()["extracted_fields"]["invoice_number"] == "V2024001"
+    assert pdf_args == [pdf]
+
+
+def test_large_upload_is_opened_by_path(engine, client, pdf_args, monkeypatch):
+    monkeypatch.setattr(api, "OCR_SPOOL_MAX_BYTES", 1024)
+    pdf = barcode_pdf(engine, [invoice_page(items=ITEMS)])
+    response = client.post("/process-invoice", data={"pdf_file": upload(pdf)})
+
+    assert response.get_json()["extracted_fields"]["invoice_number"] == "V2024001"
+    (path,) = pdf_args
+    assert isinstance(path, str) and path.startswith(api.OCR_TEMP_DIR)
+    assert not os.path.exists(path)  # Removed with the request
+
+
+def test_spooled_upload_hits_the_cache_entry_of_the_bytes(
+    engine, client, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(api, "result_cache", ResultCache(str(tmp_path / "cache")))
+    pdf = barcode_pdf(engine, [invoice_page(items=ITEMS)])
+
+    assert (
+        client.post("/process-invoice", data={"pdf_file": upload(pdf)}).headers[
+            "X-OCR-Cache"
+        ]
+        == "miss"
+    )
+    monkeypatch.setattr(api, "OCR_SPOOL_MAX_BYTES", 1024)
+    assert (
+        client.post("/process-invoice", data={"pdf_file": upload(pdf)}).headers[
+            "X-OCR-Cache"
+        ]
+        == "hit-memory"
+    )
@@ -0,0 +1,82 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import asgi_app
+import httpx
+import invoice_ocr_api as api
+import pytest
+from fake_ocr import ITEMS, barcode_pdf, invoice_page
+
+
+class Client:
+    """Synchronous calls into the ASGI app (without lifespan, so the OCR pool is the test's)"""
+
+    def request(self, method, url, **kwargs):
+        async def send():
+            transport = httpx.ASGITransport(app=asgi_app.app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://ocr"
+            ) as client:
+                return await client.request(method, url, **kwargs)
+
+        return asyncio.run(send())
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """ASGI client with a thread pool in place of the spawned OCR pool, so the fake engine is used"""
+    monkeypatch.setattr(api, "result_cache", None)
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(api, "invoice_pool", pool)
+    yield Client()
+    pool.shutdown()
+
+
+def test_health(client):
+    assert client.get("/health").json()["status"] == "healthy"
+
+
+@pytest.mark.parametrize("spool_max_bytes", [10**8, 0])
+def test_process_invoice(engine, client, monkeypatch, spool_max_bytes):
+    monkeypatch.setattr(api, "OCR_SPOOL_MAX_BYTES", spool_max_bytes)
+    pdf = barcode_pdf(engine, [invoice_page(items=ITEMS)])
+    response = client.post(
+        "/process-invoice",
+        files={"pdf_file": ("a.pdf", io.BytesIO(pdf), "application/pdf")},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["X-OCR-Cache"] == "disabled"
+    fields = response.json()["extracted_fields"]
+    assert fields["invoice_number"] == "V2024001"
+    assert fields["totals"]["total_amount"] == 181.5
+
+
+def test_process_invoice_without_file(client):
+    assert (
+        client.post("/process-invoice", data={"extracted_text": ""}).status_code == 400
+    )
+
+
+def test_other_routes_are_served_by_flask(client):
+    assert client.get("/cache/stats").status_code == 200
+
+
+def test_pool_defaults_to_the_cpu_share(monkeypatch):
+    monkeypatch.setattr(api, "OCR_WARMUP", False)
+    monkeypatch.setattr(api, "invoice_pool", None)
+
+    asgi_app.start_invoice_pool()
+    try:
+        assert asgi_app.OCR_ASGI_WORKERS == api.CPU_SHARE
+        assert api.invoice_pool._max_workers == api.CPU_SHARE
+        assert api.invoice_pool._mp_context.get_start_method() == "spawn"
+    finally:
+        asgi_app.stop_invoice_pool()
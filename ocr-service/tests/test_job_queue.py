@@ -0,0 +1,121 @@
+import io
+import json
+import threading
+import time
+
+import invoice_ocr_api as api
+import pytest
+from fake_ocr import ITEMS, barcode_pdf, invoice_page
+from job_queue import JobQueue, QueueFullError
+
+
+@pytest.fixture
+def blocked_queue(tmp_path):
+    """Queue with one worker stuck on a job and its single slot taken"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(10)
+        return b"{}"
+
+    jobs = JobQueue(str(tmp_path / "jobs"), workers=1, max_queue=1)
+    jobs.submit(block)
+    assert started.wait(5)
+    jobs.submit(block)
+    yield jobs
+    release.set()
+
+
+def test_submit_raises_when_full(blocked_queue):
+    with pytest.raises(QueueFullError) as excinfo:
+        blocked_queue.submit(lambda: b"{}")
+
+    assert excinfo.value.retry_after >= 1
+    assert blocked_queue.depth() == 2
+
+
+def test_retry_after_scales_with_backlog(tmp_path):
+    jobs = JobQueue(str(tmp_path), workers=2, max_queue=10)
+    jobs._avg_seconds = 10.0
+    jobs._running = 2
+    assert jobs.retry_after() == 10
+
+    jobs._running = 6
+    assert jobs.retry_after() == 30
+
+
+def test_jobs_endpoint_returns_429_with_retry_after(blocked_queue, monkeypatch):
+    monkeypatch.setattr(api, "job_queue", blocked_queue)
+    monkeypatch.setattr(api, "result_cache", None)
+
+    response = api.app.test_client().post(
+        "/jobs", data={"pdf_file": (io.BytesIO(b"%PDF-1.4"), "invoice.pdf")}
+    )
+
+    assert response.status_code == 429
+    retry_after = int(response.headers["Retry-After"])
+    assert retry_after >= 1
+    assert response.get_json() == {
+        "error": "Job queue is full",
+        "retry_after": retry_after,
+    }
+
+
+def test_job_result_after_processing(engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        api, "job_queue", JobQueue(str(tmp_path / "jobs"), workers=1, max_queue=4)
+    )
+    monkeypatch.setattr(api, "result_cache", None)
+    client = api.app.test_client()
+    pdf = barcode_pdf(engine, [invoice_page(items=ITEMS)])
+
+    response = client.post("/jobs", data={"pdf_file": (io.BytesIO(pdf), "invoice.pdf")})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert response.headers["Location"] == job["status_url"]
+
+    deadline = time.monotonic() + 10
+    while client.get(job["status_url"]).get_json()["status"] in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+    response = client.get(job["result_url"])
+    assert response.status_code == 200
+    assert response.get_json()["extracted_fields"]["invoice_number"] == "V2024001"
+    assert client.get("/jobs/0123abcd").status_code == 404
+
+
+def test_stale_jobs_are_failed_on_startup(tmp_path):
+    (tmp_path / "a1.json").write_text(
+        json.dumps({"job_id": "a1", "status": "running", "owner": "gone"})
+    )
+    (tmp_path / "b2.json").write_text(json.dumps({"job_id": "b2", "status": "done"}))
+
+    JobQueue(str(tmp_path), workers=1, max_queue=1)
+
+    stale = json.loads((tmp_path / "a1.json").read_text())
+    assert stale["status"] == "failed"
+    assert stale["error"] == JobQueue.STALE_ERROR
+    assert json.loads((tmp_path / "b2.json").read_text())["status"] == "done"
+
+
+def test_jobs_fail_when_their_worker_exits(tmp_path):
+    release = threading.Event()
+    jobs = JobQueue(str(tmp_path), workers=1, max_queue=2)
+    job_ids = [jobs.submit(lambda: release.wait(10) and b"{}") for _ in range(2)]
+
+    # Another worker process sharing the jobs volume sees the jobs as pending
+    other = JobQueue(str(tmp_path), workers=1, max_queue=1)
+    assert [other.get_status(job_id)["status"] for job_id in job_ids] in (
+        ["running", "queued"],
+        ["queued", "queued"],
+    )
+
+    jobs._owner_file.close()  # The first worker exits and its lock is released
+    assert [other.get_status(job_id)["status"] for job_id in job_ids] == [
+        "failed",
+        "failed",
+    ]
+    release.set()
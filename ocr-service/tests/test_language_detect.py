@@ -0,0 +1,31 @@
+from language_detect import choose_language, language_scores
+
+DUTCH = "Factuur Factuurdatum 01-02-2024 Omschrijving Aantal Prijs Totaal te betalen incl. BTW".split()
+ENGLISH = "Invoice Date 01-02-2024 Description Quantity Price Total amount due incl. VAT".split()
+
+
+def test_scores_count_tokens_case_insensitively():
+    assert language_scores(["BTW:", "totaal,", "the"], ["nld", "eng"]) == {
+        "nld": 2,
+        "eng": 1,
+    }
+
+
+def test_chooses_dutch_and_english():
+    assert choose_language(DUTCH, ["nld", "eng"])[0] == "nld"
+    assert choose_language(ENGLISH, ["nld", "eng"])[0] == "eng"
+
+
+def test_too_few_hits():
+    language, scores = choose_language(["Factuur", "12.50"], ["nld", "eng"])
+    assert language is None
+    assert scores == {"nld": 1, "eng": 0}
+
+
+def test_close_runner_up():
+    # Mixed-language page: neither language has twice the hits of the other
+    assert choose_language(DUTCH + ENGLISH, ["nld", "eng"])[0] is None
+
+
+def test_candidate_without_word_list():
+    assert choose_language(DUTCH, ["nld", "spa"])[0] is None
@@ -0,0 +1,92 @@
+import io
+
+import invoice_ocr_api as api
+import pytest
+from fake_ocr import ITEMS, barcode_pdf, invoice_page, item_lines, total_lines
+
+
+def lazy_processor(order=None):
+    processor = api.HybridInvoiceProcessor(
+        execution_mode="sequential", adaptive=False, lazy=True, lazy_order=order
+    )
+    processor.use_templates = False
+    return processor
+
+
+@pytest.fixture
+def three_pages(engine):
+    """Header fields on page 1, items on page 2, the rest of the items and the totals on page 3"""
+    return barcode_pdf(
+        engine,
+        [
+            invoice_page(items=ITEMS[:1], totals=False),
+            item_lines(ITEMS[1:2]),
+            item_lines(ITEMS[2:]) + total_lines(ITEMS),
+        ],
+    )
+
+
+@pytest.mark.parametrize(
+    "order, expected",
+    [
+        ("first,last,middle", [0, 4, 1, 2, 3]),
+        ("first,middle,last", [0, 1, 2, 3, 4]),
+        ("last,first", [4, 0, 1, 2, 3]),
+        ("1,-1,3", [0, 4, 2, 1, 3]),
+        (" First , 9 , -2 ", [0, 3, 1, 2, 4]),
+    ],
+)
+def test_lazy_page_order(order, expected):
+    assert lazy_processor(order).lazy_page_order([0, 1, 2, 3, 4], 5) == expected
+
+
+def test_lazy_page_order_skips_text_layer_pages():
+    assert lazy_processor("first,last,2").lazy_page_order([0, 2, 3], 5) == [0, 3, 2]
+
+
+@pytest.mark.parametrize("order", ["first,top", "0", ""])
+def test_unknown_lazy_order_is_rejected(order):
+    with pytest.raises(ValueError):
+        api.parse_lazy_order(order)
+
+
+def test_default_order_skips_the_middle_page(engine, three_pages):
+    results = lazy_processor().process_pdf(three_pages)
+
+    info = results["processing_info"]
+    assert info["ocr_pages"] == [0, 2]
+    assert info["skipped_pages"] == [1]
+    assert results["ocr_data"][1]["source"] == "skipped"
+    assert results["extracted_fields"]["totals"]["total_amount"] == 181.5
+    assert len(engine.calls) == 2
+
+
+def test_page_one_is_ocred_wherever_the_order_puts_it(engine, three_pages):
+    results = lazy_processor("last,middle,first").process_pdf(three_pages)
+
+    assert results["processing_info"]["ocr_pages"] == [0, 1, 2]
+    assert results["extracted_fields"]["invoice_number"] == "V2024001"
+
+
+def test_lazy_order_request_parameter(engine, three_pages, monkeypatch):
+    monkeypatch.setattr(api, "result_cache", None)
+    client = api.app.test_client()
+
+    response = client.post(
+        "/process-invoice?lazy=1&lazy_order=first,middle,last",
+        data={"pdf_file": (io.BytesIO(three_pages), "a.pdf")},
+    )
+    assert response.get_json()["processing_info"]["skipped_pages"] == []
+
+    response = client.post(
+        "/process-invoice?lazy=1&lazy_order=first,top",
+        data={"pdf_file": (io.BytesIO(three_pages), "a.pdf")},
+    )
+    assert response.status_code == 400
+
+
+def test_lazy_order_is_part_of_the_cache_key():
+    assert (
+        lazy_processor("first,last,middle").cache_params()
+        != lazy_processor("first,middle,last").cache_params()
+    )
@@ -0,0 +1,41 @@
+import sys
+
+import pipeline_benchmark
+import pytest
+
+RESULT = {"errors": [], "seconds": 1.0, "peak_rss_mb": 100.0, "stages": {"ocr": 0.8}}
+
+
+def test_missing_baseline_fails_before_running(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["pipeline_benchmark.py", "--baseline", str(tmp_path / "baseline.json")],
+    )
+    monkeypatch.setattr(
+        pipeline_benchmark,
+        "make_invoice",
+        lambda **kwargs: pytest.fail("scenario was run"),
+    )
+
+    with pytest.raises(SystemExit) as exit_info:
+        pipeline_benchmark.main()
+    assert exit_info.value.code != 0
+
+
+def test_scenario_missing_from_baseline_is_a_problem():
+    assert pipeline_benchmark.compare("service/text-1p", RESULT, None, 0.25, 0.15) != []
+
+
+def test_compare_within_tolerance():
+    baseline = {"seconds": 0.9, "peak_rss_mb": 95.0, "stages": {"ocr": 0.7}}
+    assert (
+        pipeline_benchmark.compare("service/text-1p", RESULT, baseline, 0.25, 0.15)
+        == []
+    )
+
+    slower = {**RESULT, "seconds": 1.5}
+    assert (
+        len(pipeline_benchmark.compare("service/text-1p", slower, baseline, 0.25, 0.15))
+        == 1
+    )
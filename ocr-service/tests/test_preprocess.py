@@ -0,0 +1,88 @@
+import io
+
+import fitz
+import invoice_ocr_api as api
+import numpy as np
+import pytest
+from fake_ocr import ITEMS, barcode_pdf, invoice_page
+
+
+def render(pdf, dpi=300):
+    with fitz.open(stream=pdf, filetype="pdf") as doc:
+        pix = doc[0].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return (
+        np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width).copy()
+    )
+
+
+def noisy(gray, sigma, seed=0):
+    noise = np.random.default_rng(seed).normal(0, sigma, gray.shape)
+    return np.clip(gray + noise, 0, 255).astype(np.uint8)
+
+
+def image_pdf(gray):
+    """Single page PDF holding a grayscale scan"""
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    pix = fitz.Pixmap(fitz.csGRAY, gray.shape[1], gray.shape[0], gray.tobytes(), False)
+    page.insert_image(page.rect, pixmap=pix)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@pytest.fixture
+def page(engine):
+    return render(barcode_pdf(engine, [invoice_page(items=ITEMS)]))
+
+
+@pytest.mark.parametrize("sigma, expected", [(0, "none"), (10, "light"), (40, "full")])
+def test_auto_profile_follows_noise(processor, page, sigma, expected):
+    profile, stats = processor.select_preprocess_profile(
+        noisy(page, sigma) if sigma else page
+    )
+    assert profile == expected
+    assert set(stats) == {"noise", "mid_tones", "contrast", "sharpness"}
+
+
+def test_clean_render_is_not_preprocessed(engine, processor):
+    results = processor.process_pdf(barcode_pdf(engine, [invoice_page(items=ITEMS)]))
+    info = results["ocr_data"][0]["preprocess"]
+    assert info["profile"] == "none"
+    assert info["noise"] == 0.0
+
+
+def test_noisy_scan_is_cleaned_before_ocr(engine, processor, page):
+    results = processor.process_pdf(image_pdf(noisy(page, 10)))
+
+    assert results["ocr_data"][0]["preprocess"]["profile"] == "light"
+    assert results["extracted_fields"]["invoice_number"] == "V2024001"
+    assert results["extracted_fields"]["totals"]["total_amount"] == 181.5
+
+
+def test_light_profile_binarizes(processor, page):
+    binary = processor.preprocess_image(noisy(page, 10), "light")
+    assert binary.shape == page.shape
+    assert set(np.unique(binary).tolist()) <= {0, 255}
+
+
+def test_forced_profile_from_request(engine, monkeypatch):
+    monkeypatch.setattr(api, "result_cache", None)
+    client = api.app.test_client()
+    pdf = barcode_pdf(engine, [invoice_page(items=ITEMS)])
+
+    response = client.post(
+        "/process-invoice?preprocess=light",
+        data={"pdf_file": (io.BytesIO(pdf), "a.pdf")},
+    )
+    assert response.status_code == 200
+    assert response.get_json()["ocr_data"][0]["preprocess"]["profile"] == "light"
+
+
+def test_unknown_profile_is_rejected():
+    with pytest.raises(ValueError):
+        api.processor_from_values({"preprocess": "sharpen"})
+    assert (
+        api.processor_from_values({"preprocess": "none"}).cache_params()
+        != api.processor_from_values({"preprocess": "full"}).cache_params()
+    )
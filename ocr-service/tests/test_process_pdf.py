@@ -0,0 +1,210 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import invoice_ocr_api as api
+from fake_ocr import (
+    ITEMS,
+    barcode_pdf,
+    install_engine,
+    invoice_page,
+    item_lines,
+    scanned,
+    text_pdf,
+)
+
+
+def test_raster_invoice(engine, processor):
+    pdf = barcode_pdf(engine, [invoice_page(items=ITEMS)])
+    results = processor.process_pdf(pdf)
+
+    assert "error" not in results
+    fields = results["extracted_fields"]
+    assert fields["supplier_name"] == "Jansen Installatietechniek B.V."
+    assert fields["invoice_number"] == "V2024001"
+    assert fields["invoice_date"] == "15-03-2024"
+    assert fields["totals"] == {
+        "subtotal": 150.0,
+        "vat_amount": 31.5,
+        "total_amount": 181.5,
+    }
+    assert [item["description"] for item in fields["line_items"]] == [
+        d for d, _, _ in ITEMS
+    ]
+    assert [item["amount"] for item in fields["line_items"]] == [a for _, _, a in ITEMS]
+
+    info = results["processing_info"]
+    assert info["ocr_pages"] == [0]
+    assert info["text_layer_pages"] == []
+    assert len(engine.calls) == 1
+
+
+def test_page_result_layout(engine, processor):
+    pdf = barcode_pdf(engine, [invoice_page(items=ITEMS[:1])])
+    page = processor.process_pdf(pdf)["ocr_data"][0]
+
+    assert page["source"] == "ocr"
+    assert page["image_size"] == {
+        "width": 2480,
+        "height": 3509,
+    }  # 842 pt at 300 DPI, rounded up
+    words = [w for line in page["lines"] for w in line["words"]]
+    assert words == page["words"]
+    for line in page["lines"]:
+        assert line["text"] == " ".join(w["text"] for w in line["words"])
+        assert line["bbox"]["x"] == min(w["bbox"]["x"] for w in line["words"])
+        assert line["bbox"]["y"] == min(w["bbox"]["y"] for w in line["words"])
+    assert set(page["words"][0]) == {
+        "text",
+        "confidence",
+        "bbox",
+        "line_num",
+        "word_num",
+    }
+
+
+def test_multi_page_table_is_stitched(engine, processor):
+    first = invoice_page(items=ITEMS[:2], totals=False)
+    second = [
+        "Jansen Installatietechniek - vervolg",
+        [(72, "Omschrijving"), (450, "Bedrag")],
+    ] + item_lines(ITEMS[2:])
+    results = processor.process_pdf(barcode_pdf(engine, [first, second]))
+
+    assert results["processing_info"]["ocr_pages"] == [0, 1]
+    assert len(results["processing_info"]["page_times"]) == 2
+    assert [
+        item["description"] for item in results["extracted_fields"]["line_items"]
+    ] == [d for d, _, _ in ITEMS]
+    assert results["layout_analysis"]["table_structure"]["pages"] == [0, 1]
+
+
+def test_error_is_reported(engine, processor):
+    results = processor.process_pdf(b"not a pdf")
+    assert "error" in results
+
+
+def test_born_digital_page_uses_text_layer(engine, processor):
+    pdf = text_pdf(
+        [
+            [
+                (72, 60, "Jansen Installatietechniek B.V."),
+                (72, 120, "FACTUUR"),
+                (72, 140, "V2024001"),
+                (72, 160, "Factuurdatum: 15-03-2024"),
+                (300, 400, "Totaal te betalen"),
+                (450, 400, "€ 181.50"),
+            ]
+        ]
+    )
+    processor.use_text_layer = True
+    results = processor.process_pdf(pdf)
+
+    assert results["processing_info"]["text_layer_pages"] == [0]
+    assert results["ocr_data"][0]["source"] == "text_layer"
+    assert results["extracted_fields"]["invoice_number"] == "V2024001"
+    assert results["extracted_fields"]["totals"] == {"total_amount": 181.5}
+    assert engine.calls == []
+
+
+def test_scan_with_footer_text_is_ocred(engine, processor):
+    # Scanner apps add a line of real text; the page is still a raster image
+    pdf = scanned(
+        barcode_pdf(engine, [invoice_page(items=ITEMS)]),
+        footer="Scanned with CamScanner app",
+    )
+    processor.use_text_layer = True
+    results = processor.process_pdf(pdf)
+
+    assert results["processing_info"]["text_layer_pages"] == []
+    assert results["processing_info"]["ocr_pages"] == [0]
+    assert results["extracted_fields"]["invoice_number"] == "V2024001"
+    assert len(engine.calls) == 1
+
+
+def test_process_mode_ocrs_pages_in_spawned_workers(engine, monkeypatch):
+    first = invoice_page(items=ITEMS[:2], totals=False)
+    second = [
+        "Jansen Installatietechniek - vervolg",
+        [(72, "Omschrijving"), (450, "Bedrag")],
+    ] + item_lines(ITEMS[2:])
+    pdf = barcode_pdf(engine, [first, second])
+    pool = ProcessPoolExecutor(
+        max_workers=2,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=install_engine,
+        initargs=(engine.lines,),
+    )
+    monkeypatch.setattr(api, "_page_pool", pool)
+    processor = api.HybridInvoiceProcessor(
+        execution_mode="process", max_workers=2, adaptive=False, lazy=False
+    )
+    processor.use_templates = False
+
+    try:
+        results = processor.process_pdf(pdf)
+    finally:
+        pool.shutdown()
+
+    assert "error" not in results
+    assert results["processing_info"]["ocr_pages"] == [0, 1]
+    assert [
+        item["description"] for item in results["extracted_fields"]["line_items"]
+    ] == [d for d, _, _ in ITEMS]
+    assert engine.calls == []  # Every page was OCRed in a pool process
+
+
+def test_page_pool_is_spawned_once(monkeypatch):
+    monkeypatch.setattr(api, "_page_pool", None)
+    pools = []
+    threads = [
+        threading.Thread(target=lambda: pools.append(api.get_page_pool(1)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    try:
+        assert len({id(pool) for pool in pools}) == 1
+        assert pools[0]._mp_context.get_start_method() == "spawn"
+    finally:
+        pools[0].shutdown()
+
+
+def test_adaptive_reocrs_weak_and_field_bands_in_one_call(engine, processor):
+    # Line 5 (the invoice date, below the header band) reads weakly at 150 DPI
+    pdf = barcode_pdf(engine, [invoice_page(items=ITEMS, weak_lines=(5,))])
+    processor.adaptive = True
+    results = processor.process_pdf(pdf)
+
+    page = results["ocr_data"][0]
+    assert page["source"] == "ocr_adaptive"
+    assert page["image_size"] == {"width": 2480, "height": 3509}
+    assert {w["confidence"] for w in page["words"]} == {95}
+    assert results["extracted_fields"]["invoice_date"] == "15-03-2024"
+    assert results["extracted_fields"]["totals"] == {
+        "subtotal": 150.0,
+        "vat_amount": 31.5,
+        "total_amount": 181.5,
+    }
+    assert len(results["extracted_fields"]["line_items"]) == len(ITEMS)
+
+    # Fast pass, then a single call on the stacked bands; table rows are not re-read
+    fast, bands = engine.calls
+    assert fast["shape"] == (1755, 1240)
+    assert (
+        bands["shape"][0] < 3509 * page["reocr_fraction"] + 24 * page["reocr_regions"]
+    )
+    assert page["reocr_fraction"] < 0.5
+
+
+def test_adaptive_keeps_confident_fast_pass(engine, processor):
+    pdf = barcode_pdf(engine, [invoice_page(items=ITEMS)])
+    processor.adaptive = True
+    results = processor.process_pdf(pdf)
+
+    assert results["extracted_fields"]["invoice_number"] == "V2024001"
+    # Header and totals bands only, merged where lines are close
+    assert results["ocr_data"][0]["reocr_regions"] == 2
@@ -0,0 +1,120 @@
+import pytest
+from reference_index import ReferenceIndex, TrigramIndex, normalize_code, normalize_name
+
+ROWS = {
+    "Supplier": [
+        {
+            "name": "SUP-1",
+            "supplier_name": "Jansen Installatietechniek B.V.",
+            "tax_id": "NL 8012.34.567.B01",
+            "country": "Netherlands",
+            "disabled": 0,
+            "modified": "2024-01-01 10:00:00",
+        },
+        {
+            "name": "SUP-2",
+            "supplier_name": "De Vries Bouw",
+            "tax_id": None,
+            "country": "Netherlands",
+            "disabled": 0,
+            "modified": "2024-01-02 10:00:00",
+        },
+        {
+            "name": "SUP-3",
+            "supplier_name": "Jansen Oud",
+            "tax_id": None,
+            "country": "Netherlands",
+            "disabled": 1,
+            "modified": "2024-01-03 10:00:00",
+        },
+    ],
+    "Item": [
+        {
+            "name": "ITEM-1",
+            "item_name": "Koperen buis 15mm",
+            "item_code": "KB-015",
+            "item_group": "Materiaal",
+            "disabled": 0,
+            "modified": "2024-01-01 10:00:00",
+        },
+        {
+            "name": "ITEM-2",
+            "item_name": "Arbeid monteur",
+            "item_code": "ARB-01",
+            "item_group": "Diensten",
+            "disabled": 0,
+            "modified": "2024-01-01 10:00:00",
+        },
+    ],
+}
+
+
+def test_normalize_name_drops_punctuation_and_legal_form():
+    assert normalize_name("Jansen B.V.") == "jansen"
+    assert normalize_name("JANSEN BV") == "jansen"
+    assert normalize_name("Müller GmbH & Co") == "müller co"
+    assert normalize_name(None) == ""
+
+
+def test_normalize_code():
+    assert normalize_code("nl 8012.34.567.b01") == "NL801234567B01"
+
+
+def test_trigram_search_ranks_by_similarity():
+    index = TrigramIndex()
+    index.add("a", "Jansen Installatietechniek B.V.")
+    index.add("b", "Janssen Elektro")
+    index.add("c", "Bakkerij de Vries")
+
+    results = index.search("Jansen Installatie Techniek BV", min_score=0.1)
+    assert [key for key, _ in results][:2] == ["a", "b"]
+    assert results[0][1] > results[1][1]
+    assert all(key != "c" for key, _ in results)
+
+
+def test_trigram_search_min_score_and_empty():
+    index = TrigramIndex()
+    index.add("a", "Jansen")
+    index.add("b", "B.V.")  # Nothing left after dropping the legal form
+
+    assert len(index) == 1
+    assert index.search("Jansen", min_score=1.0) == [("a", 1.0)]
+    assert index.search("Pietersen Groep", min_score=0.5) == []
+    assert index.search("") == []
+
+
+@pytest.fixture
+def reference(tmp_path, monkeypatch):
+    index = ReferenceIndex(
+        "http://erpnext.invalid/", "key", "secret", str(tmp_path / "reference.json")
+    )
+    monkeypatch.setattr(
+        index, "_fetch", lambda doctype, fields, since=None: iter(ROWS.get(doctype, []))
+    )
+    return index
+
+
+def test_supplier_tax_id_match_wins(reference):
+    result = reference.match_supplier("Something Else", tax_id="NL801234567B01")
+
+    assert result["method"] == "tax_id"
+    assert result["match"]["name"] == "SUP-1"
+    assert result["match"]["score"] == 1.0
+
+
+def test_supplier_name_match_skips_disabled(reference):
+    result = reference.match_supplier("Jansen Installatietechniek")
+
+    assert result["method"] == "name"
+    assert result["match"]["name"] == "SUP-1"
+    assert "SUP-3" not in [c["name"] for c in result["candidates"]]
+    assert "disabled" not in result["match"]
+
+
+def test_item_matches(reference):
+    code, name, unknown = reference.match_items(["KB-015", "Koperen buis 15 mm", "Xyz"])
+
+    assert (code["method"], code["match"]["name"]) == ("item_code", "ITEM-1")
+    assert (name["method"], name["match"]["name"]) == ("name", "ITEM-1")
+    assert unknown["match"] is None
+    assert reference.get_stats()["records"]["items"] == 2
@@ -0,0 +1,165 @@
+import gzip
+import json
+
+import pytest
+from response_format import parse_options, render, select_fields
+
+
+def word(text, x, line_num):
+    return {
+        "text": text,
+        "confidence": 90,
+        "bbox": {"x": x, "y": 10 * line_num, "width": 20, "height": 8},
+        "line_num": line_num,
+        "word_num": 0,
+    }
+
+
+def line(line_num, words):
+    return {
+        "line_num": line_num,
+        "words": words,
+        "text": " ".join(w["text"] for w in words),
+        "bbox": {"x": 0, "y": 10 * line_num, "width": 100, "height": 8},
+    }
+
+
+@pytest.fixture
+def result():
+    words = [word("Factuur", 0, 0), word("Totaal", 0, 1), word("12.50", 50, 1)]
+    row = [word("Widget", 0, 2), word("3", 40, 2)]
+    return {
+        "success": True,
+        "invoice_fields": {
+            "invoice_number": "F-1",
+            "totals": {"total_amount": "12.50"},
+        },
+        "ocr_data": [
+            {
+                "page": 0,
+                "image_size": {"width": 100, "height": 200},
+                "words": words,
+                "lines": [line(0, words[:1]), line(1, words[1:])],
+            }
+        ],
+        "layout_analysis": {
+            "table_structure": {"columns": [0, 40], "data_lines": [line(2, row)]}
+        },
+    }
+
+
+def options(**values):
+    return parse_options(values)
+
+
+def decode(body):
+    return json.loads(body)
+
+
+@pytest.mark.parametrize(
+    "values, message",
+    [
+        ({"detail": "everything"}, "Unknown detail level"),
+        ({"format": "xml"}, "Unknown format"),
+    ],
+)
+def test_parse_options_rejects_unknown_values(values, message):
+    with pytest.raises(ValueError, match=message):
+        parse_options(values)
+
+
+def test_parse_options_defaults():
+    assert parse_options({}, "gzip, deflate") == {
+        "fields": None,
+        "detail": "words",
+        "format": "json",
+        "gzip": True,
+    }
+    assert parse_options({"fields": " a, ,b.c "})["fields"] == ["a", "b.c"]
+
+
+def test_full_result_is_passed_through(result):
+    payload = json.dumps(result).encode("utf-8")
+    body, content_type, headers = render(payload, options())
+
+    assert body is payload
+    assert content_type == "application/json"
+    assert "Content-Encoding" not in headers
+
+
+def test_summary_keeps_counts_only(result):
+    body, _, _ = render(json.dumps(result).encode("utf-8"), options(detail="summary"))
+    shaped = decode(body)
+
+    page = shaped["ocr_data"][0]
+    assert page == {
+        "page": 0,
+        "image_size": {"width": 100, "height": 200},
+        "word_count": 3,
+        "line_count": 2,
+    }
+    assert shaped["layout_analysis"]["table_structure"]["data_lines"] == 1
+    assert shaped["invoice_fields"] == result["invoice_fields"]
+
+
+def test_lines_drop_words(result):
+    shaped = decode(
+        render(json.dumps(result).encode("utf-8"), options(detail="lines"))[0]
+    )
+
+    page = shaped["ocr_data"][0]
+    assert "words" not in page
+    assert [l["text"] for l in page["lines"]] == ["Factuur", "Totaal 12.50"]
+    assert all("words" not in l for l in page["lines"])
+    assert "words" not in shaped["layout_analysis"]["table_structure"]["data_lines"][0]
+
+
+def test_columnar_words(result):
+    shaped = decode(
+        render(json.dumps(result).encode("utf-8"), options(format="columnar"))[0]
+    )
+
+    page = shaped["ocr_data"][0]
+    assert page["words"]["text"] == ["Factuur", "Totaal", "12.50"]
+    assert page["words"]["x"] == [0, 0, 50]
+    assert page["lines"]["first_word"] == [0, 1]
+    assert page["lines"]["word_count"] == [1, 2]
+
+    rows = shaped["layout_analysis"]["table_structure"]["data_lines"]
+    assert rows["text"] == ["Widget 3"]
+    assert rows["words"]["text"] == ["Widget", "3"]
+
+
+def test_select_fields_dotted_paths_and_error():
+    results = {
+        "invoice_fields": {"invoice_number": "F-1", "date": "2024-01-01"},
+        "ocr_data": [],
+        "error": "x",
+    }
+
+    assert select_fields(results, ["invoice_fields.invoice_number", "missing"]) == {
+        "invoice_fields": {"invoice_number": "F-1"},
+        "error": "x",
+    }
+    assert select_fields(results, ["ocr_data"]) == {"ocr_data": [], "error": "x"}
+
+
+def test_gzip_only_above_threshold(result):
+    small = json.dumps({"success": True}).encode("utf-8")
+    body, _, headers = render(small, parse_options({}, "gzip"))
+    assert body == small and "Content-Encoding" not in headers
+
+    large = json.dumps(result | {"padding": "x" * 4096}).encode("utf-8")
+    body, _, headers = render(large, parse_options({}, "gzip"))
+    assert headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(body) == large
+
+
+def test_msgpack_round_trip(result):
+    msgpack = pytest.importorskip("msgpack")
+    body, content_type, _ = render(
+        json.dumps(result).encode("utf-8"), options(format="msgpack", detail="lines")
+    )
+
+    assert content_type == "application/msgpack"
+    assert msgpack.unpackb(body)["invoice_fields"] == result["invoice_fields"]
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+
+import pytest
+import result_cache
+from result_cache import ResultCache, make_cache_key
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache.time, "time", clock)
+    return clock
+
+
+def key(n):
+    return f"{n:064x}"
+
+
+def test_cache_key_depends_on_content_and_params(tmp_path):
+    pdf = b"%PDF-1.4 invoice"
+    path = tmp_path / "invoice.pdf"
+    path.write_bytes(pdf)
+
+    assert make_cache_key(pdf, {"dpi": 300}) == make_cache_key(str(path), {"dpi": 300})
+    assert make_cache_key(pdf, {"dpi": 300}) != make_cache_key(pdf, {"dpi": 200})
+    assert make_cache_key(pdf, {"dpi": 300}) != make_cache_key(pdf + b" ", {"dpi": 300})
+    assert make_cache_key(pdf, {"a": 1, "b": 2}) == make_cache_key(
+        pdf, {"b": 2, "a": 1}
+    )
+
+
+def test_memory_hit_then_disk_hit(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put(key(1), b'{"a": 1}')
+    assert cache.get(key(1)) == (b'{"a": 1}', "memory")
+
+    # A fresh worker only has the disk tier
+    assert ResultCache(str(tmp_path)).get(key(1)) == (b'{"a": 1}', "disk")
+    assert cache.get(key(2)) == (None, None)
+    assert cache.get_stats()["misses"] == 1
+
+
+def test_memory_lru_by_items(tmp_path):
+    cache = ResultCache(str(tmp_path), memory_items=2)
+    cache.put(key(1), b"1")
+    cache.put(key(2), b"2")
+    cache.get(key(1))  # 1 is now the most recently used
+    cache.put(key(3), b"3")
+
+    assert cache.get(key(1))[1] == "memory"
+    assert cache.get(key(3))[1] == "memory"
+    assert cache.get(key(2))[1] == "disk"
+    assert cache.get_stats()["memory_evictions"] >= 1
+
+
+def test_memory_bounded_by_bytes(tmp_path):
+    cache = ResultCache(None, memory_bytes=100)
+    cache.put(key(1), b"x" * 60)
+    cache.put(key(2), b"y" * 60)
+    cache.put(key(3), b"z" * 200)  # Larger than the whole tier: not kept
+
+    stats = cache.get_stats()
+    assert stats["memory_entries"] == 1
+    assert stats["memory_bytes"] == 60
+    assert cache.get(key(2))[1] == "memory"
+    assert cache.get(key(1)) == (None, None)
+
+
+def test_ttl_expires_both_tiers(tmp_path, clock):
+    cache = ResultCache(str(tmp_path), ttl=60)
+    cache.put(key(1), b"1")
+    os.utime(cache._disk_path(key(1)), (clock.now, clock.now))
+
+    clock.now += 30
+    assert cache.get(key(1))[1] == "memory"
+
+    clock.now += 31
+    assert cache.get(key(1)) == (None, None)
+    assert not os.path.exists(cache._disk_path(key(1)))
+    assert cache.get_stats()["expired"] == 2
+
+
+def test_disk_evicts_oldest_over_budget(tmp_path, clock):
+    cache = ResultCache(str(tmp_path), memory_items=0, disk_bytes=250)
+    for n in range(4):
+        cache.put(key(n), bytes(100))
+        os.utime(cache._disk_path(key(n)), (clock.now, clock.now))
+        clock.now += 1
+
+    on_disk = [n for n in range(4) if os.path.exists(cache._disk_path(key(n)))]
+    assert on_disk == [2, 3]
+    assert cache.get_stats()["disk_evictions"] == 2
+
+
+def test_concurrent_writes_of_one_key_stay_valid(tmp_path):
+    cache = ResultCache(str(tmp_path), memory_items=0)
+    keys = [key(n) for n in range(50)]
+
+    def write(n):
+        for k in keys:
+            cache.put(
+                k,
+                json.dumps({"writer": n, "pad": "x" * (2000 + 997 * n)}).encode(
+                    "utf-8"
+                ),
+            )
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for k in keys:
+        payload, tier = cache.get(k)
+        assert tier == "disk"
+        json.loads(payload)
+    assert not [
+        name
+        for _, _, files in os.walk(tmp_path)
+        for name in files
+        if name.endswith(".tmp")
+    ]
+
+
+def test_disk_hit_refreshes_eviction_order(tmp_path, clock):
+    cache = ResultCache(str(tmp_path), memory_items=0, disk_bytes=250)
+    for n in range(2):
+        cache.put(key(n), bytes(100))
+        os.utime(cache._disk_path(key(n)), (clock.now, clock.now))
+        clock.now += 1
+
+    assert cache.get(key(0))[1] == "disk"  # 0 is now the most recently used
+    clock.now += 1
+    cache.put(key(2), bytes(100))
+
+    on_disk = [n for n in range(3) if os.path.exists(cache._disk_path(key(n)))]
+    assert on_disk == [0, 2]
+
+
+def test_disk_size_is_tracked_between_sweeps(tmp_path, clock, monkeypatch):
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(
+        result_cache.os, "scandir", lambda path: scans.append(path) or scandir(path)
+    )
+    cache = ResultCache(
+        str(tmp_path), memory_items=0, disk_bytes=1000, sweep_interval=60
+    )
+
+    for n in range(5):
+        cache.put(key(n), bytes(100))
+    cache.put(key(0), bytes(50))  # Replaces 100 bytes
+    assert cache.get_stats()["disk_bytes"] == 450
+    top_level_scans = [path for path in scans if path == str(tmp_path)]
+    assert len(top_level_scans) == 1  # Only the first write, when the size was unknown
+
+    clock.now += 61
+    cache.put(key(5), bytes(100))
+    assert len([path for path in scans if path == str(tmp_path)]) == 2
+    assert cache.get_stats()["disk_bytes"] == 550
@@ -0,0 +1,135 @@
+import numpy as np
+from table_engine import cluster_columns
+from word_table import WordTable
+
+
+def test_separated_columns_with_jitter():
+    rng = np.random.default_rng(0)
+    anchors = [100, 900, 1400, 1900]
+    positions = [a + int(rng.integers(0, 12)) for a in anchors for _ in range(30)]
+
+    columns = cluster_columns(positions)
+
+    assert len(columns) == 4
+    assert all(
+        abs(found - anchor) < 12 for found, anchor in zip(columns.anchors, anchors)
+    )
+
+
+def test_columns_are_independent_of_input_order():
+    positions = [100, 104, 108, 500, 502, 900, 903] * 3
+    assert (
+        cluster_columns(positions).anchors
+        == cluster_columns(sorted(positions, reverse=True)).anchors
+    )
+
+
+def test_close_but_separate_columns_split_at_valley():
+    # Two dense columns 40 px apart with a single stray position between them
+    positions = [1000] * 20 + [1020] + [1040] * 20
+    assert len(cluster_columns(positions, tolerance=20)) == 2
+
+
+def test_positions_within_tolerance_merge():
+    assert cluster_columns([500, 505, 510, 515], tolerance=20).anchors == [500]
+
+
+def test_assign():
+    columns = cluster_columns([100] * 5 + [600] * 5 + [1200] * 5)
+
+    assert columns.assign([100, 105, 599, 610, 1300]).tolist() == [0, 0, 1, 1, 2]
+    assert columns.assign([0]).tolist() == [-1]  # Left of the first column
+
+
+def test_empty():
+    columns = cluster_columns([])
+    assert len(columns) == 0
+    assert columns.assign([10]).tolist() == [-1]
+
+
+def page_words(lines):
+    """WordTable from (y, [(x, text), ...]) lines"""
+    words = [
+        {
+            "text": text,
+            "confidence": 95,
+            "bbox": {"x": x, "y": y, "width": 20 * len(text), "height": 30},
+        }
+        for y, cells in lines
+        for x, text in cells
+    ]
+    return WordTable.from_words(words).group_lines()
+
+
+def table_rows(processor, lines):
+    model = processor.build_layout_model({"table": page_words(lines)})
+    return [model["lines"].text[i] for i in model["table_rows"]]
+
+
+def test_rows_are_numeric_tokens_aligned_to_columns(processor):
+    rows = table_rows(
+        processor,
+        [
+            (100, [(300, "Tel"), (420, "010"), (560, "4123456")]),
+            (400, [(300, "Omschrijving"), (1200, "Aantal"), (1600, "Bedrag")]),
+            (475, [(300, "Montage"), (1200, "2"), (1600, "90.00")]),
+            (550, [(300, "Kabelgoot"), (1200, "10"), (1605, "125.00")]),
+            (625, [(300, "Voorrijkosten"), (1200, "1"), (1610, "35.00")]),
+            (775, [(1000, "Totaal"), (1600, "250.00")]),
+        ],
+    )
+
+    # No currency signs needed; the phone number line is not aligned with the table
+    assert rows == ["Montage 2 90.00", "Kabelgoot 10 125.00", "Voorrijkosten 1 35.00"]
+
+
+def test_number_in_description_does_not_make_a_row(processor):
+    rows = table_rows(
+        processor,
+        [
+            (
+                475,
+                [
+                    (300, "Kogelkraan"),
+                    (560, "22"),
+                    (640, "mm"),
+                    (1200, "€"),
+                    (1240, "12.50"),
+                    (1600, "€"),
+                    (1640, "25.00"),
+                ],
+            ),
+            (
+                550,
+                [
+                    (300, "Montage"),
+                    (1200, "€"),
+                    (1240, "45.00"),
+                    (1600, "€"),
+                    (1640, "90.00"),
+                ],
+            ),
+            (700, [(300, "Rekening"), (560, "22"), (900, "0417")]),
+        ],
+    )
+    assert rows == ["Kogelkraan 22 mm € 12.50 € 25.00", "Montage € 45.00 € 90.00"]
+
+
+def test_single_row_needs_two_amounts(processor):
+    rows = table_rows(
+        processor,
+        [
+            (100, [(300, "Postbus"), (560, "1234"), (800, "3000")]),
+            (
+                475,
+                [
+                    (300, "Montage"),
+                    (1200, "€"),
+                    (1240, "45.00"),
+                    (1600, "€"),
+                    (1640, "90.00"),
+                ],
+            ),
+        ],
+    )
+    assert rows == ["Montage € 45.00 € 90.00"]
@@ -0,0 +1,97 @@
+import invoice_ocr_api as api
+import pytest
+from fake_ocr import ITEMS, barcode_pdf, invoice_page, total_lines
+from layout_templates import TemplateStore
+
+MORE_ITEMS = ITEMS + (
+    ("Thermostaat", 45.0, 45.0),
+    ("Kogelkraan 22 mm", 12.5, 25.0),
+    ("Montage", 60.0, 60.0),
+    ("Klein materiaal", 8.25, 8.25),
+)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = TemplateStore(str(tmp_path / "templates.json"))
+    monkeypatch.setattr(api, "template_store", store)
+    return store
+
+
+@pytest.fixture
+def template_processor(store):
+    processor = api.HybridInvoiceProcessor(
+        execution_mode="sequential", adaptive=False, lazy=False
+    )
+    processor.use_templates = True
+    return processor
+
+
+def spaced_invoice(items, above=0, below=0, subtotal=True):
+    """Invoice page with blank lines above and below the item table"""
+    lines = invoice_page(items=items, totals=False)
+    lines[7:7] = [None] * above
+    totals = total_lines(items)
+    return lines + [None] * below + (totals if subtotal else [totals[0]] + totals[2:])
+
+
+def amounts(results):
+    return [item["amount"] for item in results["extracted_fields"]["line_items"]]
+
+
+def test_repeat_supplier_reads_template_bands(engine, store, template_processor):
+    first = template_processor.process_pdf(
+        barcode_pdf(engine, [invoice_page(items=ITEMS)])
+    )
+    assert first["processing_info"]["template"]["learned"] is True
+
+    items = [
+        (description, price * 2, amount * 2) for description, price, amount in ITEMS
+    ]
+    engine.calls.clear()
+    results = template_processor.process_pdf(
+        barcode_pdf(engine, [invoice_page(number="V2024002", items=items)])
+    )
+
+    assert (
+        results["processing_info"]["template"]["supplier"]
+        == "Jansen Installatietechniek B.V."
+    )
+    assert results["ocr_data"][0]["source"] == "template"
+    assert results["extracted_fields"]["invoice_number"] == "V2024002"
+    assert results["extracted_fields"]["totals"]["total_amount"] == 363.0
+    assert amounts(results) == [amount for _, _, amount in items]
+    assert len(engine.calls) == 2  # Header band, then the field and table bands
+    assert store.stats["hits"] == 1
+
+
+def test_added_rows_stay_inside_the_table_band(engine, store, template_processor):
+    # The learned table band reaches down to the totals, which stay in place
+    template_processor.process_pdf(
+        barcode_pdf(engine, [spaced_invoice(ITEMS, below=3)])
+    )
+    results = template_processor.process_pdf(
+        barcode_pdf(engine, [spaced_invoice(MORE_ITEMS[:6])])
+    )
+
+    assert results["ocr_data"][0]["source"] == "template"
+    assert amounts(results) == [amount for _, _, amount in MORE_ITEMS[:6]]
+
+
+@pytest.mark.parametrize("subtotal", [True, False])
+def test_rows_outside_the_bands_fall_back_to_full_ocr(
+    engine, store, template_processor, subtotal
+):
+    # The table moved up into the blank space above the learned table band;
+    # the totals and every required field are still inside the bands
+    template_processor.process_pdf(
+        barcode_pdf(engine, [spaced_invoice(ITEMS, above=4, subtotal=subtotal)])
+    )
+    results = template_processor.process_pdf(
+        barcode_pdf(engine, [spaced_invoice(MORE_ITEMS, subtotal=subtotal)])
+    )
+
+    assert store.stats["fallbacks"] == 1
+    assert results["ocr_data"][0]["source"] == "ocr"
+    assert amounts(results) == [amount for _, _, amount in MORE_ITEMS]
+    assert results["extracted_fields"]["totals"]["total_amount"] == 348.78
@@ -0,0 +1,218 @@
+import random
+
+import pytest
+from word_table import WordTable
+
+
+def line_bbox(words):
+    x0 = min(w["bbox"]["x"] for w in words)
+    y0 = min(w["bbox"]["y"] for w in words)
+    x1 = max(w["bbox"]["x"] + w["bbox"]["width"] for w in words)
+    y1 = max(w["bbox"]["y"] + w["bbox"]["height"] for w in words)
+    return {"x": x0, "y": y0, "width": x1 - x0, "height": y1 - y0}
+
+
+def build_line(line_num, words):
+    return {
+        "line_num": line_num,
+        "words": words,
+        "text": " ".join(w["text"] for w in words),
+        "bbox": line_bbox(words),
+    }
+
+
+def reference_tesseract_page(data, page_num, width, height):
+    """Dict-building path of process_page before WordTable"""
+    words, lines, current_line, current_line_num = [], [], [], -1
+    for i, text in enumerate(data["text"]):
+        if int(data["conf"][i]) > 30 and text.strip():
+            word = {
+                "text": text.strip(),
+                "confidence": int(data["conf"][i]),
+                "bbox": {
+                    "x": data["left"][i],
+                    "y": data["top"][i],
+                    "width": data["width"][i],
+                    "height": data["height"][i],
+                },
+                "line_num": data["line_num"][i],
+                "word_num": data["word_num"][i],
+            }
+            words.append(word)
+            if data["line_num"][i] != current_line_num:
+                if current_line:
+                    lines.append(build_line(current_line_num, current_line))
+                current_line, current_line_num = [word], data["line_num"][i]
+            else:
+                current_line.append(word)
+    if current_line:
+        lines.append(build_line(current_line_num, current_line))
+    return {
+        "page": page_num,
+        "words": words,
+        "lines": lines,
+        "image_size": {"width": width, "height": height},
+    }
+
+
+def reference_page_from_words(words, page_num, width, height):
+    """Dict-building path of build_page_from_words before WordTable"""
+    words = sorted(
+        (dict(w) for w in words), key=lambda w: w["bbox"]["y"] + w["bbox"]["height"] / 2
+    )
+    heights = sorted(w["bbox"]["height"] for w in words)
+    tolerance = heights[len(heights) // 2] / 2 if heights else 0
+
+    groups = []
+    for word in words:
+        center = word["bbox"]["y"] + word["bbox"]["height"] / 2
+        if groups and abs(center - groups[-1][0]) <= tolerance:
+            groups[-1][1].append(word)
+        else:
+            groups.append([center, [word]])
+
+    words, lines = [], []
+    for line_num, (_, line_words) in enumerate(groups):
+        line_words.sort(key=lambda w: w["bbox"]["x"])
+        for word_num, word in enumerate(line_words):
+            word["line_num"], word["word_num"] = line_num, word_num
+        words.extend(line_words)
+        lines.append(build_line(line_num, line_words))
+    return {
+        "page": page_num,
+        "words": words,
+        "lines": lines,
+        "image_size": {"width": width, "height": height},
+    }
+
+
+def random_tesseract_data(rng, lines=12):
+    data = {
+        key: []
+        for key in (
+            "text",
+            "conf",
+            "left",
+            "top",
+            "width",
+            "height",
+            "line_num",
+            "word_num",
+        )
+    }
+    for line_num in range(1, lines + 1):
+        for word_num in range(1, rng.randint(1, 8)):
+            data["text"].append(
+                rng.choice(
+                    ["Factuur", "Totaal", "€", "12.50", "", " ", "B.V.", " btw "]
+                )
+            )
+            data["conf"].append(rng.choice([-1, 10, 30, 31, 55, 90, 96.6]))
+            data["left"].append(rng.randint(0, 2000))
+            data["top"].append(line_num * 40 + rng.randint(-3, 3))
+            data["width"].append(rng.randint(10, 200))
+            data["height"].append(rng.randint(15, 30))
+            data["line_num"].append(
+                line_num % 5
+            )  # Tesseract restarts numbering per block
+            data["word_num"].append(word_num)
+    return data
+
+
+def random_words(rng, count=60):
+    return [
+        {
+            "text": rng.choice(["Omschrijving", "Aantal", "€", "99.00", "Totaal"]),
+            "confidence": rng.randint(30, 100),
+            "bbox": {
+                "x": rng.randint(0, 2000),
+                "y": rng.randint(0, 3000),
+                "width": rng.randint(10, 200),
+                "height": rng.randint(15, 30),
+            },
+        }
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_from_tesseract_matches_dict_path(seed):
+    data = random_tesseract_data(random.Random(seed))
+    page = WordTable.from_tesseract(data, min_confidence=30).to_page(0, 2480, 3508)
+    assert page == reference_tesseract_page(data, 0, 2480, 3508)
+
+
+def test_from_tesseract_empty():
+    data = {
+        key: []
+        for key in (
+            "text",
+            "conf",
+            "left",
+            "top",
+            "width",
+            "height",
+            "line_num",
+            "word_num",
+        )
+    }
+    assert WordTable.from_tesseract(data).to_page(3, 10, 20) == {
+        "page": 3,
+        "words": [],
+        "lines": [],
+        "image_size": {"width": 10, "height": 20},
+    }
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_group_lines_matches_dict_path(seed):
+    words = random_words(random.Random(seed))
+    page = WordTable.from_words(words).group_lines().to_page(1, 2480, 3508)
+    assert page == reference_page_from_words(words, 1, 2480, 3508)
+
+
+def test_text_layer_cells_on_one_row_form_one_line():
+    # get_text('words') tuples: x0, y0, x1, y1, text, block, line, word; every cell its own block
+    raw_words = [
+        (72.0, 700.0, 110.0, 711.0, "Totaal", 5, 0, 0),
+        (112.0, 700.0, 118.0, 711.0, "te", 5, 0, 1),
+        (120.0, 700.0, 160.0, 711.0, "betalen", 5, 0, 2),
+        (400.0, 700.5, 408.0, 711.5, "€", 6, 0, 0),
+        (410.0, 700.5, 460.0, 711.5, "145.20", 6, 0, 1),
+        (72.0, 100.0, 150.0, 111.0, "Acme", 1, 0, 0),
+        (400.0, 300.0, 450.0, 311.0, "  ", 2, 0, 0),
+    ]
+    page = WordTable.from_text_layer(raw_words, 300 / 72.0).to_page(0, 2480, 3508)
+
+    assert [line["text"] for line in page["lines"]] == [
+        "Acme",
+        "Totaal te betalen € 145.20",
+    ]
+    assert [w["word_num"] for w in page["lines"][1]["words"]] == [0, 1, 2, 3, 4]
+    assert all(w["confidence"] == 100 for w in page["words"])
+    assert page["lines"][0]["bbox"] == {"x": 300, "y": 416, "width": 325, "height": 45}
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_line_table_matches_line_dicts(seed):
+    table = WordTable.from_words(random_words(random.Random(seed))).group_lines()
+    lines = table.lines()
+    page = table.to_page(0, 2480, 3508)
+
+    assert lines.text == [line["text"] for line in page["lines"]]
+    for i, line in enumerate(page["lines"]):
+        confidences = [w["confidence"] for w in line["words"]]
+        assert lines.bbox(i) == line["bbox"]
+        assert lines.confidence[i] == pytest.approx(sum(confidences) / len(confidences))
+        assert lines.min_confidence[i] == min(confidences)
+        assert lines.line_words(i).to_words() == line["words"]
+    assert lines.bbox_union([0, len(lines) - 1]) == line_bbox(
+        page["lines"][0]["words"] + page["lines"][-1]["words"]
+    )
+
+
+def test_line_table_empty():
+    lines = WordTable.empty().lines()
+    assert len(lines) == 0
+    assert lines.text == []
+    assert lines.bbox_union([]) == {"x": 0, "y": 0, "width": 0, "height": 0}
@@ -0,0 +1,286 @@
+"""
+Columnar word storage for the OCR service
+Words of a page are kept as numpy columns while lines are grouped and
+measured; the word/line dicts of the API response are built only at the end
+"""
+
+import numpy as np
+
+WORD_DTYPE = np.dtype(
+    [
+        ("x", np.int32),
+        ("y", np.int32),
+        ("width", np.int32),
+        ("height", np.int32),
+        ("confidence", np.int32),
+        ("line_num", np.int32),
+        ("word_num", np.int32),
+    ]
+)
+
+
+class WordTable:
+    """
+    Words of one page: a structured array of boxes, confidences and line/word
+    numbers plus a parallel string array. Words of a line are contiguous.
+    """
+
+    def __init__(self, cols, text):
+        self.cols = cols
+        self.text = text
+
+    def __len__(self):
+        return len(self.cols)
+
+    def __getitem__(self, index):
+        """Table of the words selected by a slice, mask or index array"""
+        return WordTable(self.cols[index], self.text[index])
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0, dtype=WORD_DTYPE), np.zeros(0, dtype=str))
+
+    @classmethod
+    def concat(cls, tables):
+        """Words of several tables in one table, line numbers as they are"""
+        tables = [table for table in tables if len(table)]
+        if not tables:
+            return cls.empty()
+        return cls(
+            np.concatenate([t.cols for t in tables]),
+            np.concatenate([t.text for t in tables]),
+        )
+
+    @classmethod
+    def from_tesseract(cls, data, min_confidence=30):
+        """Words from pytesseract's Output.DICT layout, dropping weak and empty ones"""
+        if not len(data["text"]):
+            return cls.empty()
+
+        text = np.char.strip(np.asarray(data["text"], dtype=str))
+        confidence = np.asarray(data["conf"], dtype=float).astype(np.int32)
+        keep = (confidence > min_confidence) & (np.char.str_len(text) > 0)
+
+        cols = np.zeros(int(keep.sum()), dtype=WORD_DTYPE)
+        cols["x"] = np.asarray(data["left"])[keep]
+        cols["y"] = np.asarray(data["top"])[keep]
+        cols["width"] = np.asarray(data["width"])[keep]
+        cols["height"] = np.asarray(data["height"])[keep]
+        cols["confidence"] = confidence[keep]
+        cols["line_num"] = np.asarray(data["line_num"])[keep]
+        cols["word_num"] = np.asarray(data["word_num"])[keep]
+        return cls(cols, text[keep])
+
+    @classmethod
+    def from_text_layer(cls, raw_words, scale):
+        """
+        Words from PyMuPDF's get_text('words') tuples, with points scaled to
+        pixels. PyMuPDF's (block, line) numbers follow the content stream, in
+        which every table cell can be a line of its own, so words are grouped
+        into visual lines by position instead, as for merged OCR passes
+        """
+        if not raw_words:
+            return cls.empty()
+
+        text = np.char.strip(np.asarray([w[4] for w in raw_words], dtype=str))
+        keep = np.char.str_len(text) > 0
+        boxes = np.asarray([w[:4] for w in raw_words], dtype=float)[keep]
+
+        cols = np.zeros(len(boxes), dtype=WORD_DTYPE)
+        cols["x"] = boxes[:, 0] * scale
+        cols["y"] = boxes[:, 1] * scale
+        cols["width"] = (boxes[:, 2] - boxes[:, 0]) * scale
+        cols["height"] = (boxes[:, 3] - boxes[:, 1]) * scale
+        cols["confidence"] = 100  # Text layer is exact
+        return cls(cols, text[keep]).group_lines()
+
+    @classmethod
+    def from_words(cls, words):
+        """Table from word dicts (e.g. merged OCR passes), line numbers still unset"""
+        if not words:
+            return cls.empty()
+
+        cols = np.zeros(len(words), dtype=WORD_DTYPE)
+        for name in ("x", "y", "width", "height"):
+            cols[name] = [w["bbox"][name] for w in words]
+        cols["confidence"] = [w["confidence"] for w in words]
+        return cls(cols, np.asarray([w["text"] for w in words], dtype=str))
+
+    def scaled(self, scale):
+        """Copy with the boxes scaled, e.g. from a low-DPI pass to full DPI"""
+        cols = self.cols.copy()
+        for name in ("x", "y", "width", "height"):
+            cols[name] = (cols[name] * scale).astype(np.int32)
+        return WordTable(cols, self.text)
+
+    def centers(self):
+        """(x, y) arrays of the word box centers"""
+        cols = self.cols
+        return cols["x"] + cols["width"] / 2, cols["y"] + cols["height"] / 2
+
+    def group_lines(self):
+        """
+        New table with words grouped into lines by vertical position: a
+        word joins the current line when its center is within half the
+        median word height of the line's first word. Lines are ordered top
+        to bottom and words left to right.
+        """
+        if not len(self):
+            return self
+
+        cols = self.cols
+        centers = cols["y"] + cols["height"] / 2
+        order = np.argsort(centers, kind="stable")
+        tolerance = np.sort(cols["height"])[len(cols) // 2] / 2
+
+        # Anchor scan over the sorted centers; everything else is vectorized
+        groups = np.empty(len(order), dtype=np.int32)
+        anchor = None
+        group = -1
+        for i, center in enumerate(centers[order].tolist()):
+            if anchor is None or abs(center - anchor) > tolerance:
+                anchor = center
+                group += 1
+            groups[i] = group
+
+        order = order[np.lexsort((cols["x"][order], groups))]
+        grouped = cols[order]
+        grouped["line_num"] = np.sort(groups)
+        new_line = np.ones(len(order), dtype=bool)
+        new_line[1:] = grouped["line_num"][1:] != grouped["line_num"][:-1]
+        _, grouped["word_num"] = self._number_lines(new_line)
+        return WordTable(grouped, self.text[order])
+
+    @staticmethod
+    def _number_lines(new_line):
+        """(line index, index within line) per word from a line-start mask"""
+        line_index = np.cumsum(new_line) - 1
+        starts = np.flatnonzero(new_line)
+        return line_index, np.arange(len(new_line)) - starts[line_index]
+
+    def line_starts(self):
+        """Index of the first word of each line"""
+        line_nums = self.cols["line_num"]
+        new_line = np.ones(len(line_nums), dtype=bool)
+        new_line[1:] = line_nums[1:] != line_nums[:-1]
+        return np.flatnonzero(new_line)
+
+    def line_bboxes(self, starts):
+        """Union of the word boxes per line as (x0, y0, x1, y1) arrays"""
+        cols = self.cols
+        return (
+            np.minimum.reduceat(cols["x"], starts),
+            np.minimum.reduceat(cols["y"], starts),
+            np.maximum.reduceat(cols["x"] + cols["width"], starts),
+            np.maximum.reduceat(cols["y"] + cols["height"], starts),
+        )
+
+    def lines(self):
+        """Per-line view (text, boxes, confidences) of a table whose lines are contiguous"""
+        return LineTable(self)
+
+    def to_words(self):
+        """Word dicts in the API response layout"""
+        cols = self.cols
+        return [
+            {
+                "text": text,
+                "confidence": confidence,
+                "bbox": {"x": x, "y": y, "width": width, "height": height},
+                "line_num": line_num,
+                "word_num": word_num,
+            }
+            for text, x, y, width, height, confidence, line_num, word_num in zip(
+                self.text.tolist(),
+                cols["x"].tolist(),
+                cols["y"].tolist(),
+                cols["width"].tolist(),
+                cols["height"].tolist(),
+                cols["confidence"].tolist(),
+                cols["line_num"].tolist(),
+                cols["word_num"].tolist(),
+            )
+        ]
+
+    def to_dicts(self):
+        """'words' and 'lines' of a page result in the API response layout"""
+        words = self.to_words()
+        lines = self.lines()
+        return {
+            "words": words,
+            "lines": [lines.to_line(i, words) for i in range(len(lines))],
+        }
+
+    def to_page(self, page_num, width, height):
+        """Page result (words, lines, image size) in the API response layout"""
+        return {
+            "page": page_num,
+            **self.to_dicts(),
+            "image_size": {"width": width, "height": height},
+        }
+
+
+class LineTable:
+    """
+    Lines of a WordTable as columns: word ranges, line numbers, text, the
+    union of the word boxes and the mean and minimum word confidence
+    """
+
+    def __init__(self, words):
+        self.words = words
+        self.starts = words.line_starts()
+        self.ends = np.append(self.starts[1:], len(words)).astype(np.intp)
+        cols = words.cols
+
+        if len(words):
+            self.x0, self.y0, self.x1, self.y1 = words.line_bboxes(self.starts)
+            counts = self.ends - self.starts
+            self.confidence = np.add.reduceat(cols["confidence"], self.starts) / counts
+            self.min_confidence = np.minimum.reduceat(cols["confidence"], self.starts)
+        else:
+            self.x0 = self.y0 = self.x1 = self.y1 = np.zeros(0, dtype=np.int32)
+            self.confidence = np.zeros(0)
+            self.min_confidence = np.zeros(0, dtype=np.int32)
+        self.line_num = cols["line_num"][self.starts]
+
+        texts = words.text.tolist()
+        self.text = [
+            " ".join(texts[start:end])
+            for start, end in zip(self.starts.tolist(), self.ends.tolist())
+        ]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def word_lines(self):
+        """Line index of every word"""
+        return np.repeat(np.arange(len(self)), self.ends - self.starts)
+
+    def line_words(self, i):
+        """WordTable of the words of line i"""
+        return self.words[self.starts[i] : self.ends[i]]
+
+    def bbox(self, i):
+        """Box of line i in the API response layout"""
+        return self.bbox_union([i])
+
+    def bbox_union(self, indexes):
+        """Box enclosing the given lines"""
+        indexes = np.asarray(indexes, dtype=np.intp)
+        if not len(indexes):
+            return {"x": 0, "y": 0, "width": 0, "height": 0}
+        x0, y0 = int(self.x0[indexes].min()), int(self.y0[indexes].min())
+        x1, y1 = int(self.x1[indexes].max()), int(self.y1[indexes].max())
+        return {"x": x0, "y": y0, "width": x1 - x0, "height": y1 - y0}
+
+    def to_line(self, i, words=None):
+        """Line i in the API response layout; words are the table's word dicts when already built"""
+        start, end = int(self.starts[i]), int(self.ends[i])
+        return {
+            "line_num": int(self.line_num[i]),
+            "words": (
+                words[start:end] if words is not None else self.line_words(i).to_words()
+            ),
+            "text": self.text[i],
+            "bbox": self.bbox(i),
+        }